@@ -0,0 +1,136 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Circuit breaker for a ViPR endpoint.
+
+"""
+
+import threading
+import time
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling ViPR while the circuit is open."""
+
+
+class CircuitBreaker(object):
+    """Stops calling a ViPR endpoint that keeps failing or stalling.
+
+    A call counts as failed when it raises a connection error or gets a
+    5xx, and as slow when it takes longer than latency_threshold seconds
+    (0 disables the latency check). After failure_threshold failed or
+    slow calls in a row the circuit opens and every call fails at once
+    with CircuitOpenError. reset_timeout seconds later the next caller
+    runs probe_func, a cheap health call; if it succeeds the circuit
+    closes, otherwise it stays open for another reset_timeout.
+    """
+
+    def __init__(self, name, probe_func, failure_threshold=5,
+                 latency_threshold=0, reset_timeout=30):
+        self.name = name
+        self.probe_func = probe_func
+        self.failure_threshold = max(failure_threshold, 1)
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.fast_failures = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Raises CircuitOpenError unless a call may go to ViPR now."""
+        if self.state == CLOSED:
+            return
+
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            waited = time.time() - self.opened_at
+            if self.state == HALF_OPEN or waited < self.reset_timeout:
+                self.fast_failures += 1
+                raise CircuitOpenError(
+                    "ViPR %(name)s is unavailable: circuit opened after "
+                    "%(failures)d failed or slow calls, %(waited)d "
+                    "seconds ago" % {'name': self.name,
+                                     'failures': self.failure_threshold,
+                                     'waited': waited})
+            self.state = HALF_OPEN
+
+        # this greenthread probes; the others keep failing fast
+        try:
+            healthy = self.probe_func()
+        except Exception:
+            healthy = False
+
+        with self._lock:
+            if healthy:
+                LOG.info("ViPR %s answered the health probe; closing the "
+                         "circuit" % self.name)
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                self.opened_at = None
+            else:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+        if not healthy:
+            self.fast_failures += 1
+            raise CircuitOpenError(
+                "ViPR %s is unavailable: the health probe failed" %
+                self.name)
+
+    def record(self, failed, duration):
+        slow = bool(self.latency_threshold and
+                    duration > self.latency_threshold)
+        with self._lock:
+            if not failed and not slow:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if (self.state == CLOSED and
+                    self.consecutive_failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+                LOG.error("Opening the circuit to ViPR %(name)s after "
+                          "%(count)d failed or slow calls; failing fast "
+                          "for %(reset)d seconds" %
+                          {'name': self.name,
+                           'count': self.consecutive_failures,
+                           'reset': self.reset_timeout})
+
+    def state_info(self):
+        with self._lock:
+            return {'state': self.state,
+                    'consecutive_failures': self.consecutive_failures,
+                    'open_for_seconds': int(time.time() - self.opened_at)
+                    if self.opened_at else None,
+                    'trips': self.trips,
+                    'fast_failures': self.fast_failures}
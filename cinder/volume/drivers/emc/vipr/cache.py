@@ -0,0 +1,302 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory lookup caches used by the EMC ViPR driver.
+
+"""
+
+import collections
+import threading
+import time
+
+
+class ResolutionCache(object):
+    """Bounded TTL/LRU cache of OpenStack id -> ViPR (name, uri).
+
+    Entries are keyed by resource kind ('volume', 'snapshot',
+    'consistencygroup') and the OpenStack id of the resource. The least
+    recently used entry is evicted once max_entries is reached, and an
+    entry older than ttl seconds is treated as a miss.
+    """
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, kind, os_id):
+        """Returns the cached (name, uri) tuple or None."""
+        if not self.enabled:
+            return None
+
+        key = (kind, os_id)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                name, uri, stamp = entry
+                if self.ttl <= 0 or time.time() - stamp < self.ttl:
+                    # re-insert to mark as most recently used
+                    self._entries[key] = entry
+                    self.hits += 1
+                    self._tally('hits')
+                    return name, uri
+            self.misses += 1
+            self._tally('misses')
+            return None
+
+    def put(self, kind, os_id, name, uri):
+        if not self.enabled or os_id is None:
+            return
+
+        key = (kind, os_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (name, uri, time.time())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, kind, os_id):
+        with self._lock:
+            self._entries.pop((kind, os_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def begin_operation(self):
+        """Starts counting hits and misses for the calling greenthread.
+
+        Calls may nest; only the outermost begin/end pair resets and
+        reports the per-operation tallies.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._local.hits = 0
+            self._local.misses = 0
+        self._local.depth = depth + 1
+
+    def end_operation(self):
+        """Returns (hits, misses) for the outermost operation, else None."""
+        depth = getattr(self._local, 'depth', 0) - 1
+        self._local.depth = max(depth, 0)
+        if depth > 0:
+            return None
+        return (getattr(self._local, 'hits', 0),
+                getattr(self._local, 'misses', 0))
+
+    def _tally(self, counter):
+        if getattr(self._local, 'depth', 0) > 0:
+            setattr(self._local, counter,
+                    getattr(self._local, counter, 0) + 1)
+
+    def counters(self):
+        """Returns a snapshot of the hit/miss/eviction counters."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries)}
+
+
+class ExportGroupIndex(object):
+    """Index of export groups by the initiator ports they contain.
+
+    Each entry records the export group name, URI, virtual array URI and
+    the set of initiator ports. Groups that may have changed are marked
+    dirty so that the next refresh re-reads only those and any new groups:
+    the groups sharing a port with a connector no group was found for, and
+    groups an export to failed.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._groups = collections.OrderedDict()
+        self._by_port = {}
+        self._no_initiators = set()
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    @property
+    def expired(self):
+        return (self.loaded_at is None or
+                (self.ttl > 0 and time.time() - self.loaded_at > self.ttl))
+
+    def mark_loaded(self):
+        self.loaded_at = time.time()
+
+    def update(self, groupdetails):
+        """Adds or replaces a group from an exportgroup_show result."""
+        uri = groupdetails['id']
+        with self._lock:
+            self._remove(uri)
+            self._dirty.discard(uri)
+            if groupdetails.get('inactive'):
+                return
+
+            initiators = groupdetails.get('initiators')
+            ports = frozenset(initiator['initiator_port']
+                              for initiator in (initiators or []))
+            varray = groupdetails.get('varray')
+            self._groups[uri] = {
+                'name': groupdetails['name'],
+                'id': uri,
+                'varray': varray['id'] if varray else None,
+                'initiators': ports}
+            for port in ports:
+                self._by_port.setdefault(port, set()).add(uri)
+            # the original scan skipped groups without an initiator list
+            # but matched those with an empty one
+            if initiators is not None and not ports:
+                self._no_initiators.add(uri)
+
+    def remove(self, uri):
+        with self._lock:
+            self._remove(uri)
+            self._dirty.discard(uri)
+
+    def remove_by_name(self, name):
+        with self._lock:
+            for uri, group in list(self._groups.items()):
+                if group['name'] == name:
+                    self._remove(uri)
+
+    def _remove(self, uri):
+        group = self._groups.pop(uri, None)
+        self._no_initiators.discard(uri)
+        if group is not None:
+            for port in group['initiators']:
+                uris = self._by_port.get(port)
+                if uris is not None:
+                    uris.discard(uri)
+                    if not uris:
+                        del self._by_port[port]
+
+    def uri_by_name(self, name):
+        """Returns the URI of the indexed group called name, or None."""
+        with self._lock:
+            for uri, group in self._groups.items():
+                if group['name'] == name:
+                    return uri
+        return None
+
+    def mark_dirty(self, uri):
+        with self._lock:
+            self._dirty.add(uri)
+
+    def mark_dirty_by_name(self, name):
+        with self._lock:
+            for uri, group in self._groups.items():
+                if group['name'] == name:
+                    self._dirty.add(uri)
+
+    def mark_ports_dirty(self, initiator_ports):
+        """Marks the groups sharing a port with initiator_ports dirty.
+
+        Used when no group matched the ports: a group whose initiators
+        changed in ViPR since it was read may match now.
+        """
+        with self._lock:
+            for port in initiator_ports:
+                self._dirty |= self._by_port.get(port, set())
+
+    def uris_to_refresh(self, current_uris):
+        """Returns the group URIs a refresh has to show.
+
+        Groups no longer present in current_uris are dropped from the
+        index; groups that are new or dirty are returned.
+        """
+        current = set(current_uris)
+        with self._lock:
+            for uri in list(self._groups.keys()):
+                if uri not in current:
+                    self._remove(uri)
+            self._dirty &= current
+            return [uri for uri in current_uris
+                    if uri not in self._groups or uri in self._dirty]
+
+    def find(self, initiator_ports, varray_uri):
+        """Returns the name of a group whose initiators are all contained
+        in initiator_ports and whose virtual array is varray_uri.
+        """
+        ports = set(initiator_ports)
+        with self._lock:
+            candidates = set()
+            for port in ports:
+                candidates |= self._by_port.get(port, set())
+            # groups with an empty initiator list match any port set, as
+            # they did in the original scan; prefer groups that share a
+            # port
+            for uri in list(candidates) + list(self._no_initiators):
+                if uri in self._dirty:
+                    continue
+                group = self._groups[uri]
+                if (group['initiators'] <= ports and
+                        group['varray'] == varray_uri):
+                    return group['name']
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+            self._by_port.clear()
+            self._no_initiators.clear()
+            self._dirty.clear()
+            self.loaded_at = None
+
+
+class InitiatorHostIndex(object):
+    """Tenant-wide map of initiator port -> ViPR host name."""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    @property
+    def expired(self):
+        return (self.loaded_at is None or
+                (self.ttl > 0 and time.time() - self.loaded_at > self.ttl))
+
+    def load(self, port_to_host):
+        """Replaces the whole map with the result of a bulk pass."""
+        with self._lock:
+            self._hosts = dict(port_to_host)
+            self.loaded_at = time.time()
+
+    def add(self, port, hostname):
+        with self._lock:
+            self._hosts[port] = hostname
+
+    def get(self, port):
+        with self._lock:
+            return self._hosts.get(port)
+
+    def clear(self):
+        with self._lock:
+            self._hosts.clear()
+            self.loaded_at = None
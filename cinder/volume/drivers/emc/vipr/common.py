@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
 import platform
 import random
 import string
@@ -21,6 +22,8 @@ import time
 import traceback
 import os
 
+from eventlet import greenpool
+
 try:
     from oslo.config import cfg
 except ImportError:
@@ -44,24 +47,40 @@ try:
 except ImportError:
     from cinder.openstack.common import log as logging
 
+from six.moves import urllib
+
 try:
     from cinder.openstack.common.gettextutils import _
 except ImportError:
     from cinder.i18n import _
 
 from cinder.volume import volume_types
+from cinder.volume.drivers.emc.vipr import breaker as vipr_breaker
+from cinder.volume.drivers.emc.vipr import cache as vipr_cache
+from cinder.volume.drivers.emc.vipr import index as vipr_index
+from cinder.volume.drivers.emc.vipr import lun as vipr_lun
+from cinder.volume.drivers.emc.vipr import metrics as vipr_metrics
+from cinder.volume.drivers.emc.vipr import polling as vipr_polling
+from cinder.volume.drivers.emc.vipr import rest as vipr_rest
+from cinder.volume.drivers.emc.vipr import retry as vipr_retry
+from cinder.volume.drivers.emc.vipr import stats as vipr_stats
+from cinder.volume.drivers.emc.vipr import tagging as vipr_tagging
+from cinder.volume.drivers.emc.vipr import tasks as vipr_tasks
+from cinder.volume.drivers.emc.vipr import throttle as vipr_throttle
+from cinder.volume.drivers.emc.vipr import tracing as vipr_tracing
 
 
 LOG = logging.getLogger(__name__)
 
 try:
-    import viprcli.authentication as vipr_auth
     import viprcli.common as vipr_utils
     import viprcli.exportgroup as vipr_eg
     import viprcli.host as vipr_host
     import viprcli.hostinitiators as vipr_host_initiator
+    import viprcli.project as vipr_project
     import viprcli.snapshot as vipr_snap
     import viprcli.virtualarray as vipr_varray
+    import viprcli.virtualpool as vipr_vpool
     import viprcli.volume as vipr_vol
     import viprcli.consistencygroup as vipr_cg
     import viprcli.tag as vipr_tag
@@ -93,7 +112,8 @@ volume_opts = [
                help='Virtual Array to utilize within the EMC ViPR Instance'),
     cfg.StrOpt('vipr_cookiedir',
                default='/tmp',
-               help='directory to store temporary cookies, defaults to /tmp'),
+               help='directory for the local state files of the driver, '
+                    'defaults to /tmp'),
     cfg.StrOpt('vipr_scaleio_rest_gateway_ip',
                default='None',
                help='Rest Gateway for Scaleio'),
@@ -117,7 +137,178 @@ volume_opts = [
                help='True | False to indicate if the storage array in ViPR is VMAX or VPLEX'),
     cfg.StrOpt('vipr_security_file',
                default=None,
-               help='Path of security file') 
+               help='Path of security file'),
+    cfg.IntOpt('vipr_resolution_cache_size',
+               default=1000,
+               help='Maximum number of OpenStack id to ViPR name/URI '
+                    'resolutions kept in memory, 0 disables the cache'),
+    cfg.IntOpt('vipr_resolution_cache_ttl',
+               default=300,
+               help='Seconds a cached id resolution stays valid, '
+                    '0 keeps entries until they are evicted'),
+    cfg.StrOpt('vipr_id_index',
+               default='False',
+               help='True | False to keep a persistent OpenStack id to '
+                    'ViPR URI index on local disk'),
+    cfg.StrOpt('vipr_id_index_file',
+               default=None,
+               help='Path of the persistent id index, defaults to '
+                    '<vipr_cookiedir>/vipr-index-<volume_backend_name>.db'),
+    cfg.IntOpt('vipr_bulk_batch_size',
+               default=500,
+               help='Number of resources fetched per ViPR bulk request'),
+    cfg.IntOpt('vipr_exportgroup_index_ttl',
+               default=3600,
+               help='Seconds after which the export group index is rebuilt '
+                    'from a full scan of the project, 0 never expires it'),
+    cfg.IntOpt('vipr_host_index_ttl',
+               default=3600,
+               help='Seconds after which the initiator to host map is '
+                    'rebuilt from a bulk listing, 0 never expires it'),
+    cfg.FloatOpt('vipr_device_info_initial_delay',
+                 default=1.0,
+                 help='Seconds to wait before polling again for the HLU of '
+                      'a newly exported volume'),
+    cfg.FloatOpt('vipr_device_info_max_delay',
+                 default=10.0,
+                 help='Upper bound of the exponentially growing delay '
+                      'between HLU polls'),
+    cfg.IntOpt('vipr_device_info_timeout',
+               default=100,
+               help='Seconds after which polling for the HLU of an '
+                    'exported volume gives up'),
+    cfg.IntOpt('vipr_stats_max_concurrency',
+               default=8,
+               help='Maximum number of virtual pool capacity queries '
+                    'issued in parallel during a stats refresh'),
+    cfg.IntOpt('vipr_stats_refresh_interval',
+               default=60,
+               help='Seconds between background refreshes of the backend '
+                    'stats, 0 refreshes them inline on every request'),
+    cfg.IntOpt('vipr_stats_refresh_max_interval',
+               default=600,
+               help='Upper bound of the refresh interval when ViPR is slow '
+                    'or failing'),
+    cfg.IntOpt('vipr_stats_slow_threshold',
+               default=30,
+               help='Seconds after which a stats refresh is considered '
+                    'slow and the refresh interval is backed off'),
+    cfg.StrOpt('vipr_tag_write_behind',
+               default='False',
+               help='True | False to tag new volumes from a background '
+                    'worker instead of inside the create call'),
+    cfg.StrOpt('vipr_tag_journal_file',
+               default=None,
+               help='Path of the journal of pending tag writes, defaults to '
+                    '<vipr_cookiedir>/vipr-tags-<volume_backend_name>.db'),
+    cfg.IntOpt('vipr_tag_write_interval',
+               default=2,
+               help='Seconds between runs of the background tag writer'),
+    cfg.IntOpt('vipr_tag_write_max_attempts',
+               default=10,
+               help='Number of attempts after which a pending tag write '
+                    'is dropped'),
+    cfg.StrOpt('vipr_metrics_file',
+               default=None,
+               help='File the per-endpoint ViPR call metrics are written '
+                    'to on every stats refresh; a Prometheus textfile if '
+                    'the name ends in .prom, JSON otherwise'),
+    cfg.FloatOpt('vipr_trace_sample_rate',
+                 default=0.0,
+                 help='Fraction of driver operations traced, between 0 '
+                      'and 1; 0 disables tracing'),
+    cfg.FloatOpt('vipr_trace_threshold',
+                 default=5.0,
+                 help='Seconds a traced operation must take for its trace '
+                      'to be reported'),
+    cfg.StrOpt('vipr_trace_file',
+               default=None,
+               help='File traces are appended to as JSON lines, by default '
+                    'they are logged'),
+    cfg.IntOpt('vipr_http_pool_size',
+               default=10,
+               help='Number of keep-alive connections kept open to the '
+                    'EMC ViPR Instance'),
+    cfg.IntOpt('vipr_token_max_age',
+               default=3600,
+               help='Seconds after which the ViPR auth token is replaced '
+                    'by a new login, 0 keeps it until ViPR rejects it'),
+    cfg.IntOpt('vipr_retry_read_attempts',
+               default=4,
+               help='Attempts for a ViPR GET request that fails with a '
+                    'transient error'),
+    cfg.IntOpt('vipr_retry_mutation_attempts',
+               default=2,
+               help='Attempts for a mutating ViPR request that ViPR '
+                    'refused without acting on it'),
+    cfg.IntOpt('vipr_retry_task_attempts',
+               default=3,
+               help='Attempts for a create, delete, expand or unexport '
+                    'whose ViPR task failed because the resource was busy'),
+    cfg.FloatOpt('vipr_retry_initial_delay',
+                 default=1.0,
+                 help='Seconds to wait before the first retry of a ViPR '
+                      'call'),
+    cfg.FloatOpt('vipr_retry_max_delay',
+                 default=15.0,
+                 help='Upper bound of the exponentially growing delay '
+                      'between retries of a ViPR call'),
+    cfg.IntOpt('vipr_circuit_failure_threshold',
+               default=5,
+               help='Number of failed or slow ViPR calls in a row after '
+                    'which calls fail fast until ViPR recovers'),
+    cfg.IntOpt('vipr_circuit_latency_threshold',
+               default=60,
+               help='Seconds after which a ViPR call counts as failed for '
+                    'the circuit breaker, 0 disables the latency check'),
+    cfg.IntOpt('vipr_circuit_reset_timeout',
+               default=30,
+               help='Seconds to fail fast before probing ViPR again'),
+    cfg.IntOpt('vipr_max_concurrent_reads',
+               default=20,
+               help='Maximum number of ViPR GET requests in flight per '
+                    'backend, 0 for no limit'),
+    cfg.IntOpt('vipr_max_concurrent_mutations',
+               default=10,
+               help='Maximum number of mutating ViPR requests in flight '
+                    'per backend, 0 for no limit'),
+    cfg.FloatOpt('vipr_read_rate_limit',
+                 default=0,
+                 help='Maximum ViPR GET requests per second per backend, '
+                      '0 for no limit'),
+    cfg.FloatOpt('vipr_mutation_rate_limit',
+                 default=0,
+                 help='Maximum mutating ViPR requests per second per '
+                      'backend, 0 for no limit'),
+    cfg.IntOpt('vipr_http_idle_timeout',
+               default=60,
+               help='Seconds of inactivity after which pooled connections '
+                    'to ViPR are closed, 0 keeps them open'),
+    cfg.StrOpt('vipr_async_tasks',
+               default='False',
+               help='True | False to submit ViPR tasks without waiting in '
+                    'viprcli; one poller of the backend then checks all '
+                    'pending tasks with a bulk query and wakes the '
+                    'operations waiting for them'),
+    cfg.StrOpt('vipr_deferred_deletes',
+               default='False',
+               help='True | False to return from volume and snapshot '
+                    'deletes once ViPR accepted the task; a background '
+                    'poller follows the task and logs failures. Needs '
+                    'vipr_async_tasks'),
+    cfg.FloatOpt('vipr_task_poll_initial_delay',
+                 default=0.5,
+                 help='Shortest delay between polls of a ViPR task; tasks '
+                      'are first polled when tasks of the same operation '
+                      'usually end'),
+    cfg.FloatOpt('vipr_task_poll_max_delay',
+                 default=10.0,
+                 help='Upper bound of the growing delay between polls of '
+                      'a ViPR task'),
+    cfg.IntOpt('vipr_task_timeout',
+               default=3600,
+               help='Seconds after which waiting for a ViPR task gives '
+                    'up'),
 ]
 
 CONF = cfg.CONF
@@ -125,52 +316,142 @@ CONF.register_opts(volume_opts)
 
 URI_VPOOL_VARRAY_CAPACITY = '/block/vpools/{0}/varrays/{1}/capacity'
 URI_BLOCK_EXPORTS_FOR_INITIATORS = '/block/exports?initiators={0}'
+URI_PROJECT_RESOURCE_SEARCH = {
+    'volume': '/block/volumes/search?project={0}',
+    'snapshot': '/block/snapshots/search?project={0}',
+    'consistencygroup': '/block/consistency-groups/search?project={0}'}
+URI_RESOURCES = {
+    'volume': '/block/volumes/{0}',
+    'snapshot': '/block/snapshots/{0}',
+    'consistencygroup': '/block/consistency-groups/{0}'}
+URI_BULK_RESOURCES = {
+    'volume': '/block/volumes/bulk',
+    'snapshot': '/block/snapshots/bulk',
+    'consistencygroup': '/block/consistency-groups/bulk',
+    'task': '/vdc/tasks/bulk'}
+URI_INITIATORS_BULK = '/compute/initiators/bulk'
+URI_INITIATOR = '/compute/initiators/{0}'
+URI_INITIATORS_SEARCH_BY_PORT = '/compute/initiators/search?initiator_port={0}'
+BULK_RESOURCE_KEYS = {
+    'volume': 'volume',
+    'snapshot': 'block_snapshot',
+    'consistencygroup': 'consistency_group',
+    'task': 'task'}
 EXPORT_RETRY_COUNT = 5
 
 
 def retry_wrapper(func):
-    def try_and_retry(*args, **kwargs):
-        retry = False
-
+    # authentication failures are handled by the rest client, which logs
+    # in again and replays only the rejected request; the operation
+    # itself is never run a second time
+    def run_operation(*args, **kwargs):
+        rest_client = getattr(args[0], 'rest_client', None) \
+            if args else None
+        scope = vipr_rest.use_client(rest_client)
+        try:
+            with scope:
+                return _with_resolution_tally(*args, **kwargs)
+        finally:
+            if scope.outermost and scope.reauth_replays:
+                LOG.info(_("%(op)s: replayed %(count)d ViPR requests after "
+                           "re-authentication") %
+                         {'op': func.__name__,
+                          'count': scope.reauth_replays})
+
+    def _with_resolution_tally(*args, **kwargs):
+        resolution_cache = getattr(args[0], 'resolution_cache', None) \
+            if args else None
+        if resolution_cache is None:
+            return _translate_errors(*args, **kwargs)
+
+        resolution_cache.begin_operation()
+        try:
+            return _translate_errors(*args, **kwargs)
+        finally:
+            tally = resolution_cache.end_operation()
+            if tally is not None and (tally[0] or tally[1]):
+                LOG.debug("%(op)s: id resolution cache hits=%(hits)d "
+                          "misses=%(misses)d; ViPR tag searches saved: "
+                          "at least %(hits)d" %
+                          {'op': func.__name__,
+                           'hits': tally[0],
+                           'misses': tally[1]})
+
+    def _translate_errors(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except vipr_breaker.CircuitOpenError as e:
+            raise exception.VolumeBackendAPIException(data=str(e))
         except vipr_utils.SOSError as e:
-            # if we got an http error and
-            # the string contains 401 or if the string contains the word cookie
-            if (e.err_code == vipr_utils.SOSError.HTTP_ERR and
-                (e.err_text.find('401') != -1 or
-                 e.err_text.lower().find('cookie') != -1)):
-                retry = True
-                EMCViPRDriverCommon.AUTHENTICATED = False
-            else:
-                exception_message = "\nViPR Exception: %s\nStack Trace:\n%s" \
-                    % (e.err_text, traceback.format_exc())
-                raise exception.VolumeBackendAPIException(
-                    data=exception_message)
+            exception_message = "\nViPR Exception: %s\nStack Trace:\n%s" \
+                % (e.err_text, traceback.format_exc())
+            raise exception.VolumeBackendAPIException(
+                data=exception_message)
         except Exception:
             exception_message = "\nGeneral Exception: %s\nStack Trace:\n%s" \
                 % (sys.exc_info()[0], traceback.format_exc())
             raise exception.VolumeBackendAPIException(
                 data=exception_message)
 
-        if retry:
-            return func(*args, **kwargs)
-
-    return try_and_retry
+    return run_operation
 
 
 class EMCViPRDriverCommon(object):
 
     OPENSTACK_TAG = 'OpenStack'
-    AUTHENTICATED = False
 
     def __init__(self, protocol, default_backend_name, configuration=None):
         self.protocol = protocol
         self.configuration = configuration
         self.configuration.append_config_values(volume_opts)
 
+        self.metrics = vipr_metrics.MetricsRegistry(
+            self.configuration.volume_backend_name or default_backend_name)
+        self.tracer = vipr_tracing.Tracer(
+            self.configuration.volume_backend_name or default_backend_name,
+            self.configuration.vipr_trace_sample_rate,
+            self.configuration.vipr_trace_threshold,
+            self.configuration.vipr_trace_file)
         self.init_vipr_cli_components()
 
+        self.resolution_cache = vipr_cache.ResolutionCache(
+            self.configuration.vipr_resolution_cache_size,
+            self.configuration.vipr_resolution_cache_ttl)
+        self.id_index = None
+        self._project_uri = None
+        self.exportgroup_index = vipr_cache.ExportGroupIndex(
+            self.configuration.vipr_exportgroup_index_ttl)
+        self._varray_uri = None
+        self.host_index = vipr_cache.InitiatorHostIndex(
+            self.configuration.vipr_host_index_ttl)
+        self._host_names = {}
+        self.lun_allocator = vipr_lun.LunAllocator()
+        self.task_tracker = vipr_tasks.TaskTracker(
+            vipr_rest.bind(self.rest_client, self._get_tasks),
+            self.configuration.vipr_task_poll_initial_delay,
+            self.configuration.vipr_task_poll_max_delay,
+            self.configuration.vipr_task_timeout)
+        self.stats_refresher = None
+        self.tag_writer = None
+        self._capacity_vpools = set()
+        self._vpool_uris = {}
+        self.device_info_stats = {'attaches': 0,
+                                  'polls': 0,
+                                  'wait_seconds': 0.0,
+                                  'max_wait_seconds': 0.0,
+                                  'not_found': 0}
+
+        # diagnostic counters go to the metrics dump, not to the
+        # capabilities reported to the scheduler
+        self.metrics.add_stats('vipr_http_pool', self.rest_client.pool_stats)
+        self.metrics.add_stats('vipr_retries', self.retry_policy.counters)
+        self.metrics.add_stats('vipr_circuit',
+                               self.rest_client.breaker.state_info)
+        self.metrics.add_stats('vipr_throttle',
+                               self.rest_client.throttle.stats)
+        self.metrics.add_stats('vipr_tasks', self.task_tracker.stats)
+        self.metrics.add_stats('vipr_device_info', self._device_info_stats)
+
         self.stats = {'driver_version': '1.0',
                       'free_capacity_gb': 'unknown',
                       'reserved_percentage': '0',
@@ -183,36 +464,87 @@ class EMCViPRDriverCommon(object):
 
     def init_vipr_cli_components(self):
 
-        vipr_utils.COOKIE = None
-
-        # instantiate a few vipr cli objects for later use
-        self.volume_obj = vipr_vol.Volume(
-            self.configuration.vipr_hostname,
-            self.configuration.vipr_port)
-
-        self.exportgroup_obj = vipr_eg.ExportGroup(
-            self.configuration.vipr_hostname,
-            self.configuration.vipr_port)
-
-        self.host_obj = vipr_host.Host(
-            self.configuration.vipr_hostname,
-            self.configuration.vipr_port)
-
-        self.hostinitiator_obj = vipr_host_initiator.HostInitiator(
+        # each backend owns its session, token and connection pool; the
+        # viprcli calls of an operation are routed to it by retry_wrapper
+        self.rest_client = vipr_rest.ViPRRestClient(
             self.configuration.vipr_hostname,
-            self.configuration.vipr_port)
+            self.configuration.vipr_port,
+            self.configuration.vipr_http_pool_size,
+            self.configuration.vipr_http_idle_timeout)
+        vipr_rest.install(self.rest_client, vipr_utils)
+
+        self.retry_policy = vipr_retry.RetryPolicy(
+            {vipr_retry.READ: self.configuration.vipr_retry_read_attempts,
+             vipr_retry.MUTATION:
+             self.configuration.vipr_retry_mutation_attempts,
+             vipr_retry.TASK: self.configuration.vipr_retry_task_attempts},
+            self.configuration.vipr_retry_initial_delay,
+            self.configuration.vipr_retry_max_delay)
+        self.rest_client.retry_policy = self.retry_policy
+
+        self.rest_client.breaker = vipr_breaker.CircuitBreaker(
+            "%s:%s" % (self.configuration.vipr_hostname,
+                       self.configuration.vipr_port),
+            self.rest_client.probe,
+            self.configuration.vipr_circuit_failure_threshold,
+            self.configuration.vipr_circuit_latency_threshold,
+            self.configuration.vipr_circuit_reset_timeout)
+
+        self.rest_client.metrics = self.metrics
+        vipr_metrics.instrument_module(vipr_utils, ['search_by_tag'],
+                                       vipr_rest.active_metrics)
+        vipr_metrics.instrument_module(vipr_tag,
+                                       ['tag_resource', 'list_tags'],
+                                       vipr_rest.active_metrics)
+
+        self.rest_client.throttle = vipr_throttle.Throttle(
+            vipr_throttle.CallLimiter(
+                self.configuration.vipr_max_concurrent_reads,
+                self.configuration.vipr_read_rate_limit),
+            vipr_throttle.CallLimiter(
+                self.configuration.vipr_max_concurrent_mutations,
+                self.configuration.vipr_mutation_rate_limit))
 
-        self.varray_obj = vipr_varray.VirtualArray(
-            self.configuration.vipr_hostname,
-            self.configuration.vipr_port)
-
-        self.snapshot_obj = vipr_snap.Snapshot(
-            self.configuration.vipr_hostname,
-            self.configuration.vipr_port)
-
-        self.consistencygroup_obj = vipr_cg.ConsistencyGroup(
-            self.configuration.vipr_hostname,
-            self.configuration.vipr_port)
+        # instantiate a few vipr cli objects for later use
+        self.volume_obj = vipr_metrics.InstrumentedObject(
+            vipr_vol.Volume(self.configuration.vipr_hostname,
+                            self.configuration.vipr_port),
+            self.metrics)
+
+        self.exportgroup_obj = vipr_metrics.InstrumentedObject(
+            vipr_eg.ExportGroup(self.configuration.vipr_hostname,
+                                self.configuration.vipr_port),
+            self.metrics)
+
+        self.host_obj = vipr_metrics.InstrumentedObject(
+            vipr_host.Host(self.configuration.vipr_hostname,
+                           self.configuration.vipr_port),
+            self.metrics)
+
+        self.hostinitiator_obj = vipr_metrics.InstrumentedObject(
+            vipr_host_initiator.HostInitiator(self.configuration.vipr_hostname,
+                                              self.configuration.vipr_port),
+            self.metrics)
+
+        self.varray_obj = vipr_metrics.InstrumentedObject(
+            vipr_varray.VirtualArray(self.configuration.vipr_hostname,
+                                     self.configuration.vipr_port),
+            self.metrics)
+
+        self.vpool_obj = vipr_metrics.InstrumentedObject(
+            vipr_vpool.VirtualPool(self.configuration.vipr_hostname,
+                                   self.configuration.vipr_port),
+            self.metrics)
+
+        self.snapshot_obj = vipr_metrics.InstrumentedObject(
+            vipr_snap.Snapshot(self.configuration.vipr_hostname,
+                               self.configuration.vipr_port),
+            self.metrics)
+
+        self.consistencygroup_obj = vipr_metrics.InstrumentedObject(
+            vipr_cg.ConsistencyGroup(self.configuration.vipr_hostname,
+                                     self.configuration.vipr_port),
+            self.metrics)
 
 
     def check_for_setup_error(self):
@@ -245,45 +577,178 @@ class EMCViPRDriverCommon(object):
             message = "vipr_varray is not set in cinder configuration"
             raise exception.VolumeBackendAPIException(data=message)
 
-    def authenticate_user(self):
-        # we should check to see if we are already authenticated before blindly
-        # doing it again
-        if EMCViPRDriverCommon.AUTHENTICATED is False:
-            obj = vipr_auth.Authentication(
-                self.configuration.vipr_hostname,
-                self.configuration.vipr_port)
+        if self.configuration.vipr_tag_write_behind == 'True':
+            self._start_tag_writer()
 
-            cookiedir = self.configuration.vipr_cookiedir
-            shell_pid = os.getppid()
-            cookie_path = str(self.configuration.vipr_username)+ 'cookie' + str(shell_pid)
-
-            username = None
-            password = None
-  
-
-            if( (self.configuration.vipr_security_file is not '')
-               and (self.configuration.vipr_security_file is not None)):
-                from Crypto.Cipher import ARC4
-                import getpass
-                obj1 = ARC4.new(getpass.getuser())
-                security_file = open(self.configuration.vipr_security_file, 'r')
-                cipher_text = security_file.readline().rstrip()
-                username = obj1.decrypt(cipher_text)
-                cipher_text = security_file.readline().rstrip()
-                password = obj1.decrypt(cipher_text)
-                security_file.close()
-            else:
-                username = self.configuration.vipr_username
-                password = self.configuration.vipr_password
+        if self.configuration.vipr_id_index == 'True':
+            try:
+                self._open_id_index()
+                self._preload_id_index()
+            except Exception:
+                # the tag search still works without the index; a failed
+                # preload leaves it open but cold
+                LOG.exception(_("Setting up the ViPR id index failed"))
+
+    def _start_tag_writer(self):
+        path = self.configuration.vipr_tag_journal_file
+        if not path:
+            path = os.path.join(
+                self.configuration.vipr_cookiedir,
+                'vipr-tags-' + self.stats['volume_backend_name'] + '.db')
+        journal = vipr_tagging.TagJournal(path)
+        self.tag_writer = vipr_tagging.TagWriter(
+            journal,
+            vipr_rest.bind(self.rest_client, self._apply_journaled_tags),
+            self.configuration.vipr_tag_write_interval,
+            self.configuration.vipr_tag_write_max_attempts)
+        pending = journal.count()
+        if pending:
+            LOG.info(_("Resuming %d pending ViPR tag writes") % pending)
+        self.tag_writer.start()
+
+    def _open_id_index(self):
+        path = self.configuration.vipr_id_index_file
+        if not path:
+            path = os.path.join(
+                self.configuration.vipr_cookiedir,
+                'vipr-index-' + self.stats['volume_backend_name'] + '.db')
+        self.id_index = vipr_index.PersistentIdIndex(path)
 
-            obj.authenticate_user(username,
-                                  password,
-                                  cookiedir,
-                                  cookie_path)
+    @retry_wrapper
+    def _preload_id_index(self):
+        """Loads the id index from one listing of the configured project.
+
+        Each resource kind costs one project search plus one bulk request
+        per vipr_bulk_batch_size resources.
+        """
+        self.authenticate_user()
+        project_uri = self._get_project_uri()
+
+        for kind in ('volume', 'snapshot', 'consistencygroup'):
+            uris = self._list_project_resource_uris(kind, project_uri)
+            rows = []
+            for batch in self._bulk_fetch(kind, uris):
+                for resource in batch:
+                    if resource.get('inactive'):
+                        continue
+                    os_id = self._get_openstack_id_from_tags(
+                        resource.get('tags'))
+                    if os_id is not None:
+                        rows.append((os_id, resource['name'],
+                                     resource['id']))
+            self.id_index.replace_all(kind, rows)
+            LOG.info(_("Loaded %(count)d %(kind)s entries into the "
+                       "ViPR id index") % {'count': len(rows), 'kind': kind})
+
+    def _get_project_uri(self):
+        if self._project_uri is None:
+            self._project_uri = vipr_project.Project(
+                self.configuration.vipr_hostname,
+                self.configuration.vipr_port).project_query(
+                    self.configuration.vipr_tenant + "/" +
+                    self.configuration.vipr_project)
+        return self._project_uri
 
-            vipr_utils.COOKIE = cookiedir + "/" + cookie_path
-            EMCViPRDriverCommon.AUTHENTICATED = True
+    def _list_project_resource_uris(self, kind, project_uri):
+        (s, h) = vipr_utils.service_json_request(
+            self.configuration.vipr_hostname,
+            self.configuration.vipr_port, "GET",
+            URI_PROJECT_RESOURCE_SEARCH[kind].format(project_uri),
+            None)
+        o = vipr_utils.json_decode(s)
+        if not o:
+            return []
+        return [resource['id'] for resource in o.get('resource', [])]
+
+    def _bulk_fetch(self, kind, uris):
+        """Yields the details of the given resources, one batch at a time."""
+        batch_size = max(self.configuration.vipr_bulk_batch_size, 1)
+        for start in xrange(0, len(uris), batch_size):
+            body = json.dumps({'id': uris[start:start + batch_size]})
+            (s, h) = vipr_utils.service_json_request(
+                self.configuration.vipr_hostname,
+                self.configuration.vipr_port, "POST",
+                URI_BULK_RESOURCES[kind],
+                body)
+            o = vipr_utils.json_decode(s)
+            if o:
+                yield o.get(BULK_RESOURCE_KEYS[kind], [])
+
+    def _get_openstack_id_from_tags(self, tags):
+        """Returns the OpenStack id recorded in a ViPR tag list, if any."""
+        if not tags:
+            return None
+        obj_id = None
+        for tag in tags:
+            if tag.startswith(self.OPENSTACK_TAG + ":id:"):
+                return tag[len(self.OPENSTACK_TAG + ":id:"):]
+            elif tag.startswith(self.OPENSTACK_TAG + ":obj_id:"):
+                obj_id = tag[len(self.OPENSTACK_TAG + ":obj_id:"):]
+        return obj_id
 
+    def authenticate_user(self):
+        # the token lives in memory and is shared by all greenthreads of
+        # this backend; the rest client logs in again only when it is
+        # missing, too old or rejected by ViPR
+        # fail fast, before any lookup, while ViPR is known to be down
+        self.rest_client.breaker.check()
+        if self.rest_client.tokens is None:
+            username, password = self._get_credentials()
+            self.rest_client.set_credentials(
+                username, password,
+                self.configuration.vipr_token_max_age)
+        self.rest_client.tokens.get()
+
+    def _get_tasks(self, task_uris):
+        tasks = []
+        for batch in self._bulk_fetch('task', task_uris):
+            tasks.extend(batch)
+        return tasks
+
+    def _run_task(self, operation, submit, deferrable=False, resources=()):
+        """Runs a viprcli call that submits ViPR tasks, until they end.
+
+        submit(sync) makes the call. With vipr_async_tasks viprcli only
+        submits the tasks, and the call waits for the shared task poller
+        to see them end; a deferrable operation may even return before.
+        resources, such as ('volume', uri), name what the tasks act on:
+        the call first waits for deferred tasks on them to end.
+        """
+        self.task_tracker.wait_for_resources(resources)
+        if self.configuration.vipr_async_tasks != 'True':
+            return submit(True)
+
+        tasks = self.task_tracker.track(operation, submit(False),
+                                        resources)
+        if deferrable and self.configuration.vipr_deferred_deletes == 'True':
+            self.task_tracker.defer(tasks)
+            return
+        try:
+            self.task_tracker.wait(tasks)
+        except vipr_tasks.TaskError as e:
+            error = vipr_utils.SOSError(vipr_utils.SOSError.SOS_FAILURE_ERR,
+                                        e.err_text)
+            if not e.task_failed:
+                # the task may still be running: never submit it again
+                error.error_class = vipr_retry.PERMANENT
+            raise error
+
+    def _get_credentials(self):
+        if( (self.configuration.vipr_security_file is not '')
+           and (self.configuration.vipr_security_file is not None)):
+            from Crypto.Cipher import ARC4
+            import getpass
+            obj1 = ARC4.new(getpass.getuser())
+            security_file = open(self.configuration.vipr_security_file, 'r')
+            cipher_text = security_file.readline().rstrip()
+            username = obj1.decrypt(cipher_text)
+            cipher_text = security_file.readline().rstrip()
+            password = obj1.decrypt(cipher_text)
+            security_file.close()
+        else:
+            username = self.configuration.vipr_username
+            password = self.configuration.vipr_password
+        return username, password
 
     @retry_wrapper
     def create_volume(self, vol, driver):
@@ -293,6 +758,7 @@ class EMCViPRDriverCommon(object):
 
         vpool = self._get_vpool(vol)
         self.vpool = vpool['ViPR:VPOOL']
+        self._capacity_vpools.add(self.vpool)
 
         try:
             cgid = None
@@ -307,17 +773,20 @@ class EMCViPRDriverCommon(object):
                 cgid = None
                 cgname = None
 
-            self.volume_obj.create(
-                self.configuration.vipr_tenant + "/" +
-                self.configuration.vipr_project,
-                name, size, self.configuration.vipr_varray,
-                self.vpool, protocol=None,
-                # no longer specified in volume creation
-                sync=True,
-                number_of_volumes=1,
-                thin_provisioned=None,
-                # no longer specified in volume creation
-                consistencygroup=cgname)
+            self.retry_policy.call(
+                vipr_retry.TASK,
+                self._run_task, "create volume",
+                lambda sync: self.volume_obj.create(
+                    self.configuration.vipr_tenant + "/" +
+                    self.configuration.vipr_project,
+                    name, size, self.configuration.vipr_varray,
+                    self.vpool, protocol=None,
+                    # no longer specified in volume creation
+                    sync=sync,
+                    number_of_volumes=1,
+                    thin_provisioned=None,
+                    # no longer specified in volume creation
+                    consistencygroup=cgname))
         except vipr_utils.SOSError as e:
             if(e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR):
                 raise vipr_utils.SOSError(
@@ -346,6 +815,8 @@ class EMCViPRDriverCommon(object):
             self.set_tags_for_resource(
                 vipr_cg.ConsistencyGroup.URI_CONSISTENCY_GROUP_TAGS,
                 cgUri, group)
+            self._remember_vipr_resource('consistencygroup', group['id'],
+                                         name, cgUri)
          
         except vipr_utils.SOSError as e:
             if(e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR):
@@ -396,6 +867,12 @@ class EMCViPRDriverCommon(object):
 
 
     def _get_vipr_consistency_group_name(self, cg , verbose=False):
+        cached = self._lookup_vipr_resource('consistencygroup', cg['id'])
+        if cached is not None:
+            if(verbose == True):
+                return cached
+            return cached[0]
+
         tagname = "OpenStack:id:"+ cg['id']
         rslt = vipr_utils.search_by_tag(
             vipr_cg.ConsistencyGroup.URI_SEARCH_CONSISTENCY_GROUPS_BY_TAG.format(tagname),
@@ -415,6 +892,8 @@ class EMCViPRDriverCommon(object):
         if(len(rslt) > 0):
             rsltCg = self.consistencygroup_obj.show(rslt[0],
                 self.configuration.vipr_project, self.configuration.vipr_tenant)
+            self._remember_vipr_resource('consistencygroup', cg['id'],
+                                         rsltCg['name'], rslt[0])
 
             if(verbose == True):
                 return rsltCg['name'] , rslt[0]
@@ -431,6 +910,9 @@ class EMCViPRDriverCommon(object):
         name = group['name']        
         
         try:
+            # deferred deletes of its snapshots
+            self.task_tracker.wait_for_resources(
+                [('consistencygroup', name)])
             volumes = driver.db.volume_get_all_by_group(
                 context, group['id'])
 
@@ -448,11 +930,13 @@ class EMCViPRDriverCommon(object):
                     forceDelete=True)
 
                 vol['status'] = 'deleted'
+                self._forget_vipr_resource('volume', vol['id'])
 
             self.consistencygroup_obj.delete(
                 name,
                 self.configuration.vipr_project,
                 self.configuration.vipr_tenant)
+            self._forget_vipr_resource('consistencygroup', group['id'])
 
             model_update = {}
             model_update['status'] = group['status']
@@ -493,29 +977,27 @@ class EMCViPRDriverCommon(object):
                 self.configuration.vipr_project,
                 self.configuration.vipr_tenant)
             
-            self.snapshot_obj.snapshot_create(
-                'block',
-                'consistency-groups',
-                resUri,
-                cgsnapshot_name,
-                False,
-                None,
-                True)
+            self._run_task(
+                "create consistency group snapshot",
+                lambda sync: self.snapshot_obj.snapshot_create(
+                    'block',
+                    'consistency-groups',
+                    resUri,
+                    cgsnapshot_name,
+                    False,
+                    None,
+                    sync))
 
             for snapshot in snapshots:
                 vol_id_of_snap = snapshot['volume_id']
                 
                 '''Finding the volume in VIPR for this volume id'''
-                tagname = "OpenStack:id:"+ vol_id_of_snap
-                rslt = vipr_utils.search_by_tag(
-                    vipr_vol.Volume.URI_SEARCH_VOLUMES_BY_TAG.format(tagname),
-                    self.configuration.vipr_hostname,
-                    self.configuration.vipr_port)
+                resolved = self._resolve_vipr_volume(vol_id_of_snap)
 
-                if( (rslt is None) or (len(rslt) == 0) ) :
+                if resolved is None:
                     continue
 
-                volUri = rslt[0]
+                volUri = resolved[1]
 
                 snapshots_of_volume = self.snapshot_obj.snapshot_list_uri(
                     'block',
@@ -548,12 +1030,18 @@ class EMCViPRDriverCommon(object):
                                    vipr_snap.Snapshot.URI_BLOCK_SNAPSHOTS_TAG ,
                                    snapUri['id'], 
                                    snapshot)
+                               self._remember_vipr_resource(
+                                   'snapshot', snapshot['id'],
+                                   snapshot_obj['name'], snapUri['id'])
                                 
                        elif( cgsnapshot_name == snapshot_obj['name'] ):
                                 self.set_tags_for_resource(
                                     vipr_snap.Snapshot.URI_BLOCK_SNAPSHOTS_TAG ,
                                     snapUri['id'], 
                                     snapshot)
+                                self._remember_vipr_resource(
+                                    'snapshot', snapshot['id'],
+                                    snapshot_obj['name'], snapUri['id'])
 
                 snapshot['status'] = 'available'
                 snapshots_model_update.append(
@@ -613,15 +1101,21 @@ class EMCViPRDriverCommon(object):
                                                    resUri ,
                                                    cgsnapshot_name)
                     
-            self.snapshot_obj.snapshot_delete_uri(
-                'block',
-                resUri,
-                uri,
-                True,
-                0)
+            self._run_task(
+                "delete consistency group snapshot",
+                lambda sync: self.snapshot_obj.snapshot_delete_uri(
+                    'block',
+                    resUri,
+                    uri,
+                    sync,
+                    0),
+                deferrable=True,
+                # a later delete of the group waits for this one
+                resources=[('consistencygroup', cg_name)])
 
             for snapshot in snapshots:
                 #snapshot['status'] = 'deleted'
+                self._forget_vipr_resource('snapshot', snapshot['id'])
                 snapshots_model_update.append(
                     {'id': snapshot['id'], 'status': 'deleted'})
 
@@ -641,50 +1135,96 @@ class EMCViPRDriverCommon(object):
 
     @retry_wrapper
     def set_volume_tags(self, vol, exemptTags=[]):
-        self.authenticate_user()
         name = self._get_volume_name(vol)
+        vol_path = self.configuration.vipr_tenant + "/" + \
+            self.configuration.vipr_project + "/" + name
+
+        if self.tag_writer is not None:
+            # tagged later by the background writer
+            self.tag_writer.enqueue(vol['id'], vol_path,
+                                    vipr_vol.Volume.URI_TAG_VOLUME,
+                                    self._get_resource_tags(vol, exemptTags))
+            return
 
-        vol_uri = self.volume_obj.volume_query(self.configuration.vipr_tenant +
-                                              "/" +
-                                              self.configuration.vipr_project
-                                              + "/" + name)
+        self.authenticate_user()
+        vol_uri = self.volume_obj.volume_query(vol_path)
         
         self.set_tags_for_resource(vipr_vol.Volume.URI_TAG_VOLUME, vol_uri, vol, exemptTags)
+        self._remember_vipr_resource('volume', vol['id'], name, vol_uri)
 
+    def _apply_journaled_tags(self, entry):
+        """Applies one entry of the write-behind tag journal.
 
-    @retry_wrapper
-    def set_tags_for_resource(self, uri , resourceId, resource, exemptTags=[]):
+        Not wrapped in retry_wrapper: the tag writer retries failed
+        entries itself and needs to tell a missing volume apart.
+        """
+        try:
+            self.authenticate_user()
+            vol_uri = self.volume_obj.volume_query(entry['path'])
+            self._sync_resource_tags(entry['uri'], vol_uri, entry['tags'])
+        except vipr_utils.SOSError as e:
+            if e.err_code == vipr_utils.SOSError.NOT_FOUND_ERR:
+                raise LookupError(entry['path'])
+            raise
+
+        self._remember_vipr_resource('volume', entry['os_id'],
+                                     entry['path'].rsplit('/', 1)[-1],
+                                     vol_uri)
 
+
+    @retry_wrapper
+    def set_tags_for_resource(self, uri , resourceId, resource, exemptTags=[],
+                              return_tags=False):
+        """Brings the OpenStack tags of a ViPR resource in line with the
+        properties of the OpenStack resource.
+
+        Only the difference between the current and the desired tags is
+        sent, in a single request, and nothing is sent when they already
+        match. The resulting tags are listed only if return_tags is set.
+        """
         self.authenticate_user()
+        return self._sync_resource_tags(
+            uri, resourceId, self._get_resource_tags(resource, exemptTags),
+            return_tags)
 
-        # first, get the current tags that start with the OPENSTACK_TAG
-        # eyecatcher
+    def _sync_resource_tags(self, uri, resourceId, desired_tags,
+                            return_tags=False):
         formattedUri = uri.format(resourceId)
-        remove_tags = []
+
+        # get the current tags that start with the OPENSTACK_TAG eyecatcher
         currentTags = vipr_tag.list_tags(self.configuration.vipr_hostname , 
                                          self.configuration.vipr_port, 
                                          formattedUri)
-        for cTag in currentTags:
-            if cTag.startswith(self.OPENSTACK_TAG):
-                remove_tags.append(cTag)
+        current_tags = set(cTag for cTag in currentTags
+                           if cTag.startswith(self.OPENSTACK_TAG))
 
-        try:
-            if len(remove_tags) > 0:
+        add_tags = [tag for tag in desired_tags if tag not in current_tags]
+        remove_tags = list(current_tags - set(desired_tags))
+
+        if add_tags or remove_tags:
+            try:
                 vipr_tag.tag_resource(
                     self.configuration.vipr_hostname , 
                     self.configuration.vipr_port,
                     uri,
                     resourceId,
-                    None,
-                    remove_tags)
-        except vipr_utils.SOSError as e:
-            if e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR:
-                LOG.debug("SOSError adding the tag: " + e.err_text)
+                    add_tags or None,
+                    remove_tags or None)
+            except vipr_utils.SOSError as e:
+                if e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR:
+                    LOG.debug("SOSError tagging the resource: " + e.err_text)
 
-        # now add the tags for the resource
-        add_tags = []
-        # put all the openstack resource properties into the ViPR resource
+        if return_tags:
+            return vipr_tag.list_tags(self.configuration.vipr_hostname ,
+                                      self.configuration.vipr_port,  
+                                      formattedUri)
 
+    def _get_resource_tags(self, resource, exemptTags=[]):
+        """Returns the ViPR tags for the properties of an OpenStack
+        resource, as a list without duplicates.
+        """
+        tags = []
+        # put all the openstack resource properties into the ViPR resource
         try:
             for prop, value in vars(resource).iteritems():
                 try:
@@ -699,34 +1239,19 @@ class EMCViPRDriverCommon(object):
                     if ((not prop.startswith("status")
                            and not prop.startswith("obj_status")
                            and prop != "obj_volume") and (value)):
-                        add_tags.append(
-                            self.OPENSTACK_TAG +
-                            ":" +
-                            prop +
-                            ":" +
-                            str(value))
+                        tag = (self.OPENSTACK_TAG +
+                               ":" +
+                               prop +
+                               ":" +
+                               str(value))
+                        if tag not in tags:
+                            tags.append(tag)
                 except TypeError:
                     LOG.debug("Error tagging the resource property %s ", prop)
         except TypeError:
             LOG.debug("Error tagging the resource properties ")
 
-
-        try:
-            vipr_tag.tag_resource(
-                self.configuration.vipr_hostname , 
-                self.configuration.vipr_port,
-                uri,
-                resourceId,
-                add_tags,
-                None)
-        except vipr_utils.SOSError as e:
-            if e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR:
-                LOG.debug("SOSError adding the tag: " + e.err_text)
-
-        return vipr_tag.list_tags(self.configuration.vipr_hostname ,
-                                  self.configuration.vipr_port,  
-                                  formattedUri)
-
+        return tags
 
 
     @retry_wrapper
@@ -757,11 +1282,13 @@ class EMCViPRDriverCommon(object):
                 self.configuration.vipr_project,
                 self.configuration.vipr_tenant)
 
-            self.volume_obj.clone(
-                name,
-                number_of_volumes,
-                resource_id,
-                sync=True)
+            self._run_task(
+                "clone volume",
+                lambda sync: self.volume_obj.clone(
+                    name,
+                    number_of_volumes,
+                    resource_id,
+                    sync=sync))
 
             clone_vol_path = self.configuration.vipr_tenant + "/" + self.configuration.vipr_project + "/" + name
             detachable = self.volume_obj.is_volume_detachable(clone_vol_path)
@@ -769,7 +1296,10 @@ class EMCViPRDriverCommon(object):
                                                  
             #detach it from the source volume immediately after creation
             if(detachable):
-                self.volume_obj.volume_clone_detach("",clone_vol_path, True)
+                self._run_task(
+                    "detach clone",
+                    lambda sync: self.volume_obj.volume_clone_detach(
+                        "", clone_vol_path, sync))
 
         except IndexError as e:
             LOG.exception("Volume clone detach returned empty task list")
@@ -791,14 +1321,17 @@ class EMCViPRDriverCommon(object):
         size_in_bytes = vipr_utils.to_bytes(str(new_size) + "G")
 
         try:
-            self.volume_obj.expand(
-                self.configuration.vipr_tenant +
-                "/" +
-                self.configuration.vipr_project +
-                "/" +
-                volume_name,
-                size_in_bytes,
-                True)
+            self.retry_policy.call(
+                vipr_retry.TASK,
+                self._run_task, "expand volume",
+                lambda sync: self.volume_obj.expand(
+                    self.configuration.vipr_tenant +
+                    "/" +
+                    self.configuration.vipr_project +
+                    "/" +
+                    volume_name,
+                    size_in_bytes,
+                    sync))
         except vipr_utils.SOSError as e:
             if e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR:
                 raise vipr_utils.SOSError(
@@ -842,11 +1375,13 @@ class EMCViPRDriverCommon(object):
                 self.configuration.vipr_project,
                 self.configuration.vipr_tenant)
 
-            self.volume_obj.clone(
-                new_volume_name,
-                number_of_volumes,
-                resource_id,
-                sync=True)
+            self._run_task(
+                "clone snapshot",
+                lambda sync: self.volume_obj.clone(
+                    new_volume_name,
+                    number_of_volumes,
+                    resource_id,
+                    sync=sync))
 
         except vipr_utils.SOSError as e:
             if(e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR):
@@ -865,18 +1400,26 @@ class EMCViPRDriverCommon(object):
     @retry_wrapper
     def delete_volume(self, vol):
         self.authenticate_user()
-        name = self._get_vipr_volume_name(vol)
+        (name, uri) = self._get_vipr_volume_name(vol, True)
         try:
-            self.volume_obj.delete(
-                self.configuration.vipr_tenant +
-                "/" +
-                self.configuration.vipr_project +
-                "/" +
-                name,
-                volume_name_list=None,
-                sync=True)
+            self.retry_policy.call(
+                vipr_retry.TASK,
+                self._run_task, "delete volume",
+                lambda sync: self.volume_obj.delete(
+                    self.configuration.vipr_tenant +
+                    "/" +
+                    self.configuration.vipr_project +
+                    "/" +
+                    name,
+                    volume_name_list=None,
+                    sync=sync),
+                deferrable=True,
+                # deferred deletes of its snapshots
+                resources=[('volume', uri)])
+            self._forget_vipr_resource('volume', vol['id'])
         except vipr_utils.SOSError as e:
             if e.err_code == vipr_utils.SOSError.NOT_FOUND_ERR:
+                self._forget_vipr_resource('volume', vol['id'])
                 LOG.info(_(
                     "Volume %s"
                     " no longer exists; volume deletion is"
@@ -892,15 +1435,11 @@ class EMCViPRDriverCommon(object):
     @retry_wrapper
     def list_volume(self):
         try:
-            uris = self.volume_obj.list_volumes(
-                self.configuration.vipr_tenant +
-                "/" +
-                self.configuration.vipr_project)
-            if len(uris) > 0:
-                output = []
-                for uri in uris:
-                    output.append(self.volume_obj.show_by_uri(uri))
+            output = []
+            for batch in self._iter_volumes():
+                output.extend(batch)
 
+            if len(output) > 0:
                 return vipr_utils.format_json_object(output)
             else:
                 return
@@ -908,6 +1447,21 @@ class EMCViPRDriverCommon(object):
             with excutils.save_and_reraise_exception():
                     LOG.exception(_("List volumes failed"))
 
+    def _iter_volumes(self):
+        """Yields the details of the project's volumes, one list per bulk
+        request of vipr_bulk_batch_size volumes.
+
+        Only one batch is held in memory at a time, whatever the size of
+        the project. ViPR errors are raised as SOSError while iterating,
+        so it is only consumed inside methods wrapped in retry_wrapper,
+        which give it the client scope and the retry policy.
+        """
+        self.authenticate_user()
+        uris = self._list_project_resource_uris('volume',
+                                                self._get_project_uri())
+        for batch in self._bulk_fetch('volume', uris):
+            yield [vol for vol in batch if not vol.get('inactive')]
+
     @retry_wrapper
     def create_snapshot(self, snapshot, volume_db):
         self.authenticate_user()
@@ -948,15 +1502,16 @@ class EMCViPRDriverCommon(object):
                 tenant=tenantname)
             inactive = False
             rptype = None
-            sync = True
-            self.snapshot_obj.snapshot_create(
-                storageresType,
-                storageresTypename,
-                resourceUri,
-                snapshotname,
-                inactive,
-                rptype,
-                sync)
+            self._run_task(
+                "create snapshot",
+                lambda sync: self.snapshot_obj.snapshot_create(
+                    storageresType,
+                    storageresTypename,
+                    resourceUri,
+                    snapshotname,
+                    inactive,
+                    rptype,
+                    sync))
 
             snapshotUri = self.snapshot_obj.snapshot_query(
                 storageresType,
@@ -967,6 +1522,8 @@ class EMCViPRDriverCommon(object):
             self.set_tags_for_resource(
                 vipr_snap.Snapshot.URI_BLOCK_SNAPSHOTS_TAG,
                 snapshotUri, snapshot, ['_volume'])
+            self._remember_vipr_resource('snapshot', snapshot['id'],
+                                         snapshotname, snapshotUri)
             
 
         except vipr_utils.SOSError as e:
@@ -1023,12 +1580,19 @@ class EMCViPRDriverCommon(object):
             else:
                 snapshotname = self._get_vipr_snapshot_name(snapshot, resourceUri)
                  
-                self.snapshot_obj.snapshot_delete(
-                    storageresType,
-                    storageresTypename,
-                    resourceUri,
-                    snapshotname,
-                    sync=True)
+                self.retry_policy.call(
+                    vipr_retry.TASK,
+                    self._run_task, "delete snapshot",
+                    lambda sync: self.snapshot_obj.snapshot_delete(
+                        storageresType,
+                        storageresTypename,
+                        resourceUri,
+                        snapshotname,
+                        sync=sync),
+                    deferrable=True,
+                    # a later delete of the volume waits for this one
+                    resources=[('volume', resourceUri)])
+                self._forget_vipr_resource('snapshot', snapshot['id'])
         except vipr_utils.SOSError as e:
             if e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR:
                 raise vipr_utils.SOSError(
@@ -1052,114 +1616,63 @@ class EMCViPRDriverCommon(object):
         try:
             self.authenticate_user()
             volumename = self._get_vipr_volume_name(volume)
-            foundgroupname = self._find_exportgroup(initiatorPorts)
-            foundhostname = None
-            if foundgroupname is None:
-                for i in xrange(len(initiatorPorts)):
-                    # check if this initiator is contained in any ViPR Host
-                    # object
-                    LOG.debug(
-                        "checking for initiator port:" + initiatorPorts[i])
-                    foundhostname = self._find_host(initiatorPorts[i])
-                    if ((foundhostname is None) and ( i+1 == len(initiatorPorts))):
-                    #if foundhostname is None:
-                        hostfound = self._host_exists(hostname)
-                        if hostfound is None:
-                            # create a host so it can be added to the export
-                            # group
-                            hostfound = hostname
-                            self.host_obj.create(
-                                hostname,
-                                platform.system(),
-                                hostname,
-                                self.configuration.vipr_tenant,
-                                port=None,
-                                username=None,
-                                passwd=None,
-                                usessl=None,
-                                osversion=None,
-                                cluster=None,
-                                datacenter=None,
-                                vcenter=None,
-                                autodiscovery=True)
-                            LOG.info(_("Created host %s") % hostname)
-                        # add the initiator to the host
-                        self.hostinitiator_obj.create(
-                            hostfound,
-                            protocol,
-                            initiatorNodes[i],
-                            initiatorPorts[i])
-                        LOG.info(_(
-                            "Initiator  v1=%(v1)s"
-                            " added to host  v2=%(v2)s") %
-                            {'v1': initiatorPorts[i], 'v2': hostfound})
-                        foundhostname = hostfound
-                    else:
-                        LOG.info(_("Found host %s") % foundhostname)
-                # create an export group for this host
-                foundgroupname = foundhostname + 'SG'
-                # create a unique name
-                foundgroupname = foundgroupname + '-' + \
-                    ''.join(random.choice(string.ascii_uppercase
-                                          + string.digits)
-                            for x in range(6))
-                self.exportgroup_obj.exportgroup_create(
-                    foundgroupname,
-                    self.configuration.vipr_project,
-                    self.configuration.vipr_tenant,
-                    self.configuration.vipr_varray,
-                    'Host',
-                    foundhostname)
+            (foundgroupname, foundhostname) = self._find_or_create_exportgroup(
+                protocol, initiatorNodes, initiatorPorts, hostname)
 
-            next_lun_id = 1
             for try_id in range(1,EXPORT_RETRY_COUNT+1):
+                next_lun_id = None
                 try:
-                    vipr_exportgroup = self.exportgroup_obj.exportgroup_show(
-                                   foundgroupname,
-                                   self.configuration.vipr_project,
-                                   self.configuration.vipr_tenant,
-                                   None, False)
-
-                except vipr_utils.SOSError as e:
-                    if e.err_code == vipr_utils.SOSError.NOT_FOUND_ERR:
-                        self.exportgroup_obj.exportgroup_create(
-                            foundgroupname,
-                            self.configuration.vipr_project,
+                    if not self.lun_allocator.is_seeded(foundgroupname):
+                        self._seed_exportgroup_luns(foundgroupname)
+
+                    # We explicitly give lun id an unused value greater then 0.
+                    # This is to get around the problem, which crops up while creating 
+                    # volume from image when cinder node is different from nova node.
+                    # When using lun id of 0, export of volume is having problems.
+                    next_lun_id = self.lun_allocator.reserve(foundgroupname)
+
+                    # an indexed group is addressed by URI, which saves
+                    # viprcli the name lookup through every export group
+                    groupref = self.exportgroup_index.uri_by_name(
+                        foundgroupname) or foundgroupname
+                    LOG.debug("adding the volume to the exportgroup : " + volumename)
+                    self._run_task(
+                        "export volume",
+                        lambda sync: self.exportgroup_obj.exportgroup_add_volumes(
+                            sync,
+                            groupref,
                             self.configuration.vipr_tenant,
-                            self.configuration.vipr_varray,
-                            'Host',
-                            foundhostname)
-
-                # We explicitly give lun id an unused value greater then 0.
-                # This is to get around the problem, which crops up while creating 
-                # volume from image when cinder node is different from nova node.
-                # When using lun id of 0, export of volume is having problems.
-                volumes_list = [vol['lun'] for vol in vipr_exportgroup['volumes']]
-                volumes_list.sort()
-                for iter in volumes_list:
-                    if(iter > next_lun_id):
-                        break
-                    elif(iter < next_lun_id):
-                        continue
-                    elif(iter == next_lun_id):
-                        next_lun_id = next_lun_id + 1
-
-                LOG.debug("adding the volume to the exportgroup : " + volumename)
-                try:
-                    self.exportgroup_obj.exportgroup_add_volumes(
-                        True,
-                        foundgroupname,
-                        self.configuration.vipr_tenant,
-                        None,
-                        None,
-                        None,
-                        self.configuration.vipr_project,
-                        [volumename+":"+str(next_lun_id)],
-                        None,
-                        None)
+                            None,
+                            None,
+                            None,
+                            self.configuration.vipr_project,
+                            [volumename+":"+str(next_lun_id)],
+                            None,
+                            None))
                     break
                 except vipr_utils.SOSError as ex:
+                        collision = next_lun_id is not None and \
+                            vipr_lun.is_collision(ex.err_text)
+                        missing = \
+                            ex.err_code == vipr_utils.SOSError.NOT_FOUND_ERR \
+                            or 'HTTP code: 404' in (ex.err_text or '')
+                        if next_lun_id is not None and not collision:
+                            self.lun_allocator.release(foundgroupname,
+                                                       next_lun_id)
+                        if missing:
+                            # the group was deleted outside this driver
+                            self.lun_allocator.forget(foundgroupname)
+                            self.exportgroup_index.remove_by_name(
+                                foundgroupname)
+                        elif not collision:
+                            # the group may have changed in ViPR
+                            self.exportgroup_index.mark_dirty_by_name(
+                                foundgroupname)
                         if (try_id >= EXPORT_RETRY_COUNT):
+                            # re-read the group from ViPR on the next attach
+                            self.lun_allocator.forget(foundgroupname)
+                            self.exportgroup_index.remove_by_name(
+                                foundgroupname)
                             raise vipr_utils.SOSError(
                                vipr_utils.SOSError.SOS_FAILURE_ERR,
                                "Attach volume (" +
@@ -1170,11 +1683,20 @@ class EMCViPRDriverCommon(object):
                                initiatorPorts[0] +
                                ") failed: " +
                                ex.err_text)
+                        elif missing:
+                            LOG.info(_("Export group %s no longer exists; "
+                                       "looking it up again") %
+                                     foundgroupname)
+                            (foundgroupname, foundhostname) = \
+                                self._find_or_create_exportgroup(
+                                    protocol, initiatorNodes,
+                                    initiatorPorts, hostname)
                         else:
+                            # a LUN taken outside this process stays marked
+                            # as used; any other LUN was released above
                             LOG.exception(_("Export volume with LUN: %s failed.") 
                                           % str(next_lun_id))
                             LOG.info("Retry with next available LUN ID")
-                            next_lun_id = next_lun_id + 1
                                
             return self._find_device_info(volume, initiatorPorts)
 
@@ -1192,6 +1714,100 @@ class EMCViPRDriverCommon(object):
                 ") failed: " +
                 e.err_text)
 
+    def _find_or_create_exportgroup(self, protocol, initiatorNodes,
+                                    initiatorPorts, hostname):
+        """Returns (export group, host) for the initiators of a connector.
+
+        The host is only known when the group had to be created.
+        """
+        foundgroupname = self._find_exportgroup(initiatorPorts)
+        foundhostname = None
+        if foundgroupname is None:
+            # resolve every initiator of the connector in one lookup
+            hostmap = self._find_hosts(initiatorPorts)
+            for i in xrange(len(initiatorPorts)):
+                # check if this initiator is contained in any ViPR Host
+                # object
+                LOG.debug(
+                    "checking for initiator port:" + initiatorPorts[i])
+                foundhostname = hostmap.get(initiatorPorts[i])
+                if ((foundhostname is None) and ( i+1 == len(initiatorPorts))):
+                #if foundhostname is None:
+                    hostfound = self._host_exists(hostname)
+                    if hostfound is None:
+                        # create a host so it can be added to the export
+                        # group
+                        hostfound = hostname
+                        self.host_obj.create(
+                            hostname,
+                            platform.system(),
+                            hostname,
+                            self.configuration.vipr_tenant,
+                            port=None,
+                            username=None,
+                            passwd=None,
+                            usessl=None,
+                            osversion=None,
+                            cluster=None,
+                            datacenter=None,
+                            vcenter=None,
+                            autodiscovery=True)
+                        LOG.info(_("Created host %s") % hostname)
+                    # add the initiator to the host
+                    self.hostinitiator_obj.create(
+                        hostfound,
+                        protocol,
+                        initiatorNodes[i],
+                        initiatorPorts[i])
+                    self.host_index.add(initiatorPorts[i], hostfound)
+                    LOG.info(_(
+                        "Initiator  v1=%(v1)s"
+                        " added to host  v2=%(v2)s") %
+                        {'v1': initiatorPorts[i], 'v2': hostfound})
+                    foundhostname = hostfound
+                else:
+                    LOG.info(_("Found host %s") % foundhostname)
+            # create an export group for this host
+            foundgroupname = foundhostname + 'SG'
+            # create a unique name
+            foundgroupname = foundgroupname + '-' + \
+                ''.join(random.choice(string.ascii_uppercase
+                                      + string.digits)
+                        for x in range(6))
+            task = self.exportgroup_obj.exportgroup_create(
+                foundgroupname,
+                self.configuration.vipr_project,
+                self.configuration.vipr_tenant,
+                self.configuration.vipr_varray,
+                'Host',
+                foundhostname)
+            # index the new group and seed its LUNs with one show, so the
+            # next attach from this host finds it without a list
+            groupuri = ((task or {}).get('resource') or {}).get('id')
+            self._seed_exportgroup_luns(foundgroupname, groupuri)
+        return (foundgroupname, foundhostname)
+
+    def _seed_exportgroup_luns(self, groupname, groupuri=None):
+        """Seeds the LUN allocator of a group with one exportgroup_show.
+
+        The group is shown by URI when it is known, so that viprcli does
+        not have to look the name up through every export group.
+        """
+        vipr_exportgroup = self.exportgroup_obj.exportgroup_show(
+            groupuri or self.exportgroup_index.uri_by_name(groupname) or
+            groupname,
+            self.configuration.vipr_project,
+            self.configuration.vipr_tenant,
+            None, False)
+        if vipr_exportgroup is None:
+            raise vipr_utils.SOSError(
+                vipr_utils.SOSError.NOT_FOUND_ERR,
+                "Export group " + groupname + ": not found")
+        self.exportgroup_index.update(vipr_exportgroup)
+        self.lun_allocator.seed(
+            groupname,
+            [vol['lun'] for vol in vipr_exportgroup['volumes']])
+
     @retry_wrapper
     def terminate_connection(self,
                              volume,
@@ -1209,22 +1825,28 @@ class EMCViPRDriverCommon(object):
 
             # find the exportgroups
             exports = self.volume_obj.get_exports_by_uri(volid)
-            exportgroups = set()
+            exportgroups = {}
             itls = exports['itl']
             for itl in itls:
                 itl_port = itl['initiator']['port']
                 if itl_port in initiatorPorts:
-                    exportgroups.add(itl['export']['id'])
+                    exportgroups[itl['export']['id']] = \
+                        (itl['export'].get('name'), itl['hlu'])
 
             for exportgroup in exportgroups:
-                self.exportgroup_obj.exportgroup_remove_volumes_by_uri(
-                    exportgroup,
-                    volid,
-                    True,
-                    None,
-                    None,
-                    None,
-                    None)
+                self.retry_policy.call(
+                    vipr_retry.TASK,
+                    self._run_task, "unexport volume",
+                    lambda sync: self.exportgroup_obj.exportgroup_remove_volumes_by_uri(
+                        exportgroup,
+                        volid,
+                        sync,
+                        None,
+                        None,
+                        None,
+                        None))
+                (groupname, hlu) = exportgroups[exportgroup]
+                self.lun_allocator.release(groupname, hlu)
             else:
                 LOG.info(_(
                     "No export group found for the host: %s"
@@ -1266,52 +1888,94 @@ class EMCViPRDriverCommon(object):
                  }
                 ]
         '''
-        volumename = self._get_vipr_volume_name(volume)
-        fullname = self.configuration.vipr_project + '/' + volumename
-        vol_uri = self.volume_obj.volume_query(fullname)
+        volumename, vol_uri = self._get_vipr_volume_name(volume, True)
 
         '''
         The itl info shall be available at the first try since now export is a
-        synchronous call.  We are trying a few more times to accommodate any
-        delay on filling in the itl info after the export task is completed.
+        synchronous call.  We are polling a few more times, with a growing
+        delay, to accommodate any delay on filling in the itl info after the
+        export task is completed.
         '''
-        itls = []
-        for x in xrange(10):
-            exports = self.volume_obj.get_exports_by_uri(vol_uri)
-            LOG.debug("Volume exports: ")
-            LOG.info(vol_uri)
-            LOG.debug(exports)
-            for itl in exports['itl']:
-                itl_port = itl['initiator']['port']
-                if itl_port in initiator_ports:
-                    found_device_number = itl['hlu']
-                    if (found_device_number is not None and
-                       found_device_number != '-1'):
-                        # 0 is a valid number for found_device_number.
-                        # Only loop if it is None or -1
-                        LOG.debug("Found Device Number: "
-                                  + str(found_device_number))
-                        itls.append(itl)
-
+        backoff = vipr_polling.Backoff(
+            self.configuration.vipr_device_info_initial_delay,
+            self.configuration.vipr_device_info_max_delay,
+            self.configuration.vipr_device_info_timeout)
+        polls = 0
+        while True:
+            polls += 1
+            itls = self._get_itls_for_initiators(vol_uri, initiator_ports)
             if itls:
                 break
-            else:
-                LOG.debug("Device Number not found yet." +
-                          " Retrying after 10 seconds...")
-                time.sleep(10)
 
-        if itls is None:
-            # No device number found after 10 tries; return an empty itl
+            LOG.debug("Device Number not found yet; retrying.")
+            if not backoff.sleep():
+                break
+
+        waited = backoff.elapsed
+        self._record_device_info_wait(polls, waited, bool(itls))
+        LOG.info(_("Device info for volume %(volumename)s polled "
+                   "%(polls)d times in %(waited).1f seconds") %
+                 {'volumename': volumename,
+                  'polls': polls,
+                  'waited': waited})
+
+        if not itls:
+            # No device number found before the deadline; return an empty itl
             LOG.info(_(
-                "No device number has been found after 10 tries;"
+                "No device number has been found after %(polls)d tries;"
                 "this likely indicates an unsuccessful attach of"
                 "volume volumename=%(volumename)s to"
                 " initiator  initiator_ports=%(initiator_ports)s") %
-                {'volumename': volumename,
+                {'polls': polls,
+                 'volumename': volumename,
                     'initiator_ports': str(initiator_ports)})
 
         return itls
 
+    def _get_itls_for_initiators(self, vol_uri, initiator_ports):
+        """Returns the ITLs of a volume with a valid HLU for the given
+        initiators, filtered on the ViPR side by initiator.
+        """
+        (s, h) = vipr_utils.service_json_request(
+            self.configuration.vipr_hostname,
+            self.configuration.vipr_port, "GET",
+            URI_BLOCK_EXPORTS_FOR_INITIATORS.format(
+                ",".join(initiator_ports)),
+            None)
+        exports = vipr_utils.json_decode(s)
+        LOG.debug("Volume exports: ")
+        LOG.debug(exports)
+
+        itls = []
+        if not exports:
+            return itls
+        for itl in exports['itl']:
+            if itl['device']['id'] != vol_uri:
+                continue
+            itl_port = itl['initiator']['port']
+            if itl_port in initiator_ports:
+                found_device_number = itl['hlu']
+                if (found_device_number is not None and
+                   found_device_number != '-1'):
+                    # 0 is a valid number for found_device_number.
+                    # Only loop if it is None or -1
+                    LOG.debug("Found Device Number: "
+                              + str(found_device_number))
+                    itls.append(itl)
+        return itls
+
+    def _record_device_info_wait(self, polls, waited, found):
+        stats = self.device_info_stats
+        stats['attaches'] += 1
+        stats['polls'] += polls
+        stats['wait_seconds'] += waited
+        stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+        if not found:
+            stats['not_found'] += 1
+        # the distribution of the waits, next to the ViPR call latencies
+        self.metrics.observe(vipr_metrics.WAIT, 'device_info', waited,
+                             not found)
+
 
     def _get_consistencygroup_name(self, driver, context, cgid):
         consisgrp = driver.db.consistencygroup_get(context, cgid)
@@ -1320,6 +1984,10 @@ class EMCViPRDriverCommon(object):
 
 
     def _get_vipr_snapshot_name(self, snapshot, resUri):
+        cached = self._lookup_vipr_resource('snapshot', snapshot['id'])
+        if cached is not None:
+            return cached[0]
+
         tagname = "OpenStack:id:"+ snapshot['id']
         rslt = vipr_utils.search_by_tag(
             vipr_snap.Snapshot.URI_SEARCH_SNAPSHOT_BY_TAG.format(tagname),
@@ -1342,11 +2010,40 @@ class EMCViPRDriverCommon(object):
                 'block',
                 resUri,
                 rslt[0])
+            self._remember_vipr_resource('snapshot', snapshot['id'],
+                                         rsltSnap['name'], rslt[0])
             return rsltSnap['name']
 
 
     def _get_vipr_volume_name(self, vol, verbose=False):
-        tagname = "OpenStack:id:"+ vol['id']
+        resolved = self._resolve_vipr_volume(vol['id'])
+
+        if resolved is not None:
+            if(verbose == True):
+                return resolved
+            else:
+                return resolved[0]
+        else:
+            raise vipr_utils.SOSError(
+                vipr_utils.SOSError.NOT_FOUND_ERR,
+                "Volume "+vol['display_name'] + " not found")
+
+    def _resolve_vipr_volume(self, vol_id):
+        """Returns the (name, uri) of the ViPR volume tagged with the given
+        OpenStack id, or None if there is no such volume.
+        """
+        cached = self._lookup_vipr_resource('volume', vol_id)
+        if cached is not None:
+            return cached
+
+        if self.tag_writer is not None:
+            # a pending tag write may be all that makes the volume findable
+            self.tag_writer.flush(vol_id)
+            cached = self._lookup_vipr_resource('volume', vol_id)
+            if cached is not None:
+                return cached
+
+        tagname = "OpenStack:id:"+ vol_id
         rslt = vipr_utils.search_by_tag(
             vipr_vol.Volume.URI_SEARCH_VOLUMES_BY_TAG.format(tagname),
             self.configuration.vipr_hostname,
@@ -1355,24 +2052,78 @@ class EMCViPRDriverCommon(object):
 
         #if the result is empty, then search with the tagname as "OpenStack:obj_id"
         #as snapshots will be having the obj_id instead of just id.
-        if(len(rslt) == 0):
-            tagname="OpenStack:obj_id:"+vol['id']
+        if( (rslt is None) or (len(rslt) == 0) ):
+            tagname="OpenStack:obj_id:"+vol_id
             rslt = vipr_utils.search_by_tag(
                 vipr_vol.Volume.URI_SEARCH_VOLUMES_BY_TAG.format(tagname),
                 self.configuration.vipr_hostname,
                 self.configuration.vipr_port)
 
-        if(len(rslt) > 0):
-            rsltVol = self.volume_obj.show_by_uri(rslt[0])
+        if( (rslt is None) or (len(rslt) == 0) ):
+            return None
 
-            if(verbose == True):
-                return rsltVol['name'] , rslt[0]
-            else:
-                return rsltVol['name']
+        rsltVol = self.volume_obj.show_by_uri(rslt[0])
+        self._remember_vipr_resource('volume', vol_id,
+                                     rsltVol['name'], rslt[0])
+        return rsltVol['name'], rslt[0]
+
+    def _lookup_vipr_resource(self, kind, os_id):
+        """Returns the known (name, uri) of a resource without a tag search.
+
+        The in-memory cache is consulted first, then the persistent index.
+        Index rows confirmed longer than vipr_resolution_cache_ttl ago are
+        checked with one show of the resource before they are used.
+        """
+        cached = self.resolution_cache.get(kind, os_id)
+        if cached is not None or self.id_index is None:
+            return cached
+
+        entry = self.id_index.get(kind, os_id)
+        if entry is None:
+            return None
+        (name, uri, updated_at) = entry
+        ttl = self.configuration.vipr_resolution_cache_ttl
+        if ttl <= 0 or time.time() - updated_at >= ttl:
+            name = self._current_vipr_name(kind, uri)
+            if name is None:
+                LOG.info(_("Indexed %(kind)s %(uri)s no longer exists in "
+                           "ViPR") % {'kind': kind, 'uri': uri})
+                self._forget_vipr_resource(kind, os_id)
+                return None
+            # confirmed: the row is good for another ttl seconds
+            self._remember_vipr_resource(kind, os_id, name, uri)
         else:
-            raise vipr_utils.SOSError(
-                vipr_utils.SOSError.NOT_FOUND_ERR,
-                "Volume "+vol['display_name'] + " not found")
+            self.resolution_cache.put(kind, os_id, name, uri)
+        return name, uri
+
+    def _current_vipr_name(self, kind, uri):
+        """Returns the name of an active ViPR resource, None if it is gone."""
+        try:
+            (s, h) = vipr_utils.service_json_request(
+                self.configuration.vipr_hostname,
+                self.configuration.vipr_port, "GET",
+                URI_RESOURCES[kind].format(uri), None)
+        except vipr_utils.SOSError as e:
+            if e.err_code == vipr_utils.SOSError.NOT_FOUND_ERR or \
+                    'HTTP code: 404' in (e.err_text or ''):
+                return None
+            raise
+        o = vipr_utils.json_decode(s)
+        if not o or o.get('inactive'):
+            return None
+        return o['name']
+
+    def _remember_vipr_resource(self, kind, os_id, name, uri):
+        """Records the ViPR name and URI an OpenStack id resolves to."""
+        self.resolution_cache.put(kind, os_id, name, uri)
+        if self.id_index is not None and os_id is not None:
+            self.id_index.put(kind, os_id, name, uri)
+
+    def _forget_vipr_resource(self, kind, os_id):
+        """Drops a resolution once the ViPR resource is deleted or renamed."""
+        self.resolution_cache.invalidate(kind, os_id)
+        if self.id_index is not None:
+            self.id_index.delete(kind, os_id)
 
 
     def _get_volume_name(self, vol):
@@ -1411,60 +2162,143 @@ class EMCViPRDriverCommon(object):
         """Find the export group to which the given initiator ports are the
         same as the initiators in the group
         """
+        varray_uri = self._get_varray_uri()
         foundgroupname = None
+        if not self.exportgroup_index.expired:
+            foundgroupname = self.exportgroup_index.find(initiator_ports,
+                                                         varray_uri)
+
+        if foundgroupname is None:
+            # re-read the groups that share a port with the connector
+            # too, their initiators may have changed since
+            self.exportgroup_index.mark_ports_dirty(initiator_ports)
+            self._refresh_exportgroup_index()
+            foundgroupname = self.exportgroup_index.find(initiator_ports,
+                                                         varray_uri)
+
+        if foundgroupname is not None:
+            LOG.debug("Found exportgroup " + foundgroupname)
+        return foundgroupname
+
+    def _refresh_exportgroup_index(self):
+        """Brings the export group index up to date.
+
+        An expired index is rebuilt from every group in the project,
+        otherwise only groups that are new or were marked dirty are shown.
+        """
+        full_scan = self.exportgroup_index.expired
+        if full_scan:
+            self.exportgroup_index.clear()
+
         grouplist = self.exportgroup_obj.exportgroup_list(
             self.configuration.vipr_project,
             self.configuration.vipr_tenant)
-        for groupid in grouplist:
+        for groupid in self.exportgroup_index.uris_to_refresh(grouplist):
             groupdetails = self.exportgroup_obj.exportgroup_show(
                 groupid,
                 self.configuration.vipr_project,
                 self.configuration.vipr_tenant)
             if groupdetails is not None:
-                if groupdetails['inactive']:
-                    continue
-                initiators = groupdetails['initiators']
-                if initiators is not None:
-                    inits_eg = set()
-                    for initiator in initiators:
-                        inits_eg.add(initiator['initiator_port'])
-
-                    if inits_eg <= set(initiator_ports):
-                        foundgroupname = groupdetails['name']
-                    if foundgroupname is not None:
-                        # Check the associated varray
-                        if groupdetails['varray']:
-                            varray_uri = groupdetails['varray']['id']
-                            varray_details = self.varray_obj.varray_show(
-                                varray_uri)
-                            if varray_details['name'] == \
-                                    self.configuration.vipr_varray:
-                                LOG.debug(
-                                    "Found exportgroup " +
-                                    foundgroupname)
-                                break
-
-                        # Not the right varray
-                        foundgroupname = None
+                self.exportgroup_index.update(groupdetails)
+            else:
+                self.exportgroup_index.remove(groupid)
 
-        return foundgroupname
+        if full_scan:
+            self.exportgroup_index.mark_loaded()
+
+    def _get_varray_uri(self):
+        if self._varray_uri is None:
+            self._varray_uri = self.varray_obj.varray_query(
+                self.configuration.vipr_varray)
+        return self._varray_uri
 
     @retry_wrapper
-    def _find_host(self, initiator_port):
-        '''Find the host, if exists, to which the given initiator belong.'''
-        foundhostname = None
+    def _find_hosts(self, initiator_ports):
+        """Returns a dict of initiator port -> ViPR host name for each of
+        the given ports that belongs to a host in the tenant.
+
+        Ports missing from the tenant-wide map may have been registered
+        after it was built, so they are looked up with an initiator search.
+        """
+        if self.host_index.expired:
+            self._load_host_index()
+
+        foundhosts = {}
+        for initiator_port in initiator_ports:
+            hostname = self.host_index.get(initiator_port)
+            if hostname is None:
+                hostname = self._search_initiator_host(initiator_port)
+                if hostname is not None:
+                    self.host_index.add(initiator_port, hostname)
+            if hostname is not None:
+                foundhosts[initiator_port] = hostname
+
+        return foundhosts
+
+    def _load_host_index(self):
+        """Builds the initiator port -> host map in one bulk pass."""
         hosts = self.host_obj.list_all(self.configuration.vipr_tenant)
-        for host in hosts:
-            initiators = self.host_obj.list_initiators(host['id'])
-            for initiator in initiators:
-                if initiator_port == initiator['name']:
-                    foundhostname = host['name']
-                    break
+        self._host_names = dict((host['id'], host['name']) for host in hosts)
 
-            if foundhostname is not None:
-                break
+        (s, h) = vipr_utils.service_json_request(
+            self.configuration.vipr_hostname,
+            self.configuration.vipr_port, "GET",
+            URI_INITIATORS_BULK, None)
+        o = vipr_utils.json_decode(s)
+        initiator_uris = o.get('id', []) if o else []
+
+        port_to_host = {}
+        batch_size = max(self.configuration.vipr_bulk_batch_size, 1)
+        for start in xrange(0, len(initiator_uris), batch_size):
+            body = json.dumps({'id': initiator_uris[start:start + batch_size]})
+            (s, h) = vipr_utils.service_json_request(
+                self.configuration.vipr_hostname,
+                self.configuration.vipr_port, "POST",
+                URI_INITIATORS_BULK, body)
+            o = vipr_utils.json_decode(s)
+            for initiator in (o.get('initiator', []) if o else []):
+                if initiator.get('inactive') or not initiator.get('host'):
+                    continue
+                hostname = self._host_names.get(initiator['host']['id'])
+                # hosts outside the configured tenant are not listed
+                if hostname is not None:
+                    port_to_host[initiator['initiator_port']] = hostname
+
+        self.host_index.load(port_to_host)
+        LOG.debug("Loaded %d initiators into the host index" %
+                  len(port_to_host))
+
+    def _search_initiator_host(self, initiator_port):
+        """Asks ViPR for the host owning a single initiator port."""
+        (s, h) = vipr_utils.service_json_request(
+            self.configuration.vipr_hostname,
+            self.configuration.vipr_port, "GET",
+            URI_INITIATORS_SEARCH_BY_PORT.format(
+                urllib.parse.quote(initiator_port, '')),
+            None)
+        o = vipr_utils.json_decode(s)
+        for resource in (o.get('resource', []) if o else []):
+            (s, h) = vipr_utils.service_json_request(
+                self.configuration.vipr_hostname,
+                self.configuration.vipr_port, "GET",
+                URI_INITIATOR.format(resource['id']), None)
+            initiator = vipr_utils.json_decode(s)
+            if (not initiator or initiator.get('inactive') or
+                    not initiator.get('host')):
+                continue
+            host_uri = initiator['host']['id']
+            if host_uri not in self._host_names:
+                # the host may be newer than the last bulk pass
+                hosts = self.host_obj.list_all(
+                    self.configuration.vipr_tenant)
+                self._host_names = dict(
+                    (host['id'], host['name']) for host in hosts)
+            hostname = self._host_names.get(host_uri)
+            # hosts outside the configured tenant are not listed
+            if hostname is not None:
+                return hostname
 
-        return foundhostname
+        return None
 
     @retry_wrapper
     def _host_exists(self, host_name):
@@ -1502,6 +2336,53 @@ class EMCViPRDriverCommon(object):
         itls = export_itl_maps['itl']
         return itls.__len__()
 
+    def get_volume_stats(self):
+        """Returns the backend stats without waiting on ViPR.
+
+        The first call refreshes inline and starts a background refresher;
+        later calls return the last good snapshot together with its age.
+        """
+        if self.configuration.vipr_stats_refresh_interval <= 0:
+            stats = dict(self.update_volume_stats())
+        else:
+            if self.stats_refresher is None:
+                self.stats_refresher = vipr_stats.StatsRefresher(
+                    self.update_volume_stats,
+                    self.configuration.vipr_stats_refresh_interval,
+                    self.configuration.vipr_stats_refresh_max_interval,
+                    self.configuration.vipr_stats_slow_threshold)
+                self.stats_refresher.refresh()
+                self.stats_refresher.start()
+
+            stats, age = self.stats_refresher.get()
+            if stats is None:
+                # no refresh has succeeded yet
+                stats = dict(self.stats)
+            stats['stats_age_seconds'] = \
+                int(age) if age is not None else None
+            stats['stats_refresh_interval'] = \
+                self.stats_refresher.current_interval
+
+        stats['vipr_http_pool'] = self.rest_client.pool_stats()
+        stats['vipr_circuit'] = self.rest_client.breaker.state_info()
+
+        if self.configuration.vipr_metrics_file:
+            self.dump_metrics(self.configuration.vipr_metrics_file)
+        return stats
+
+    def _device_info_stats(self):
+        device_info = dict(self.device_info_stats)
+        for key in ('wait_seconds', 'max_wait_seconds'):
+            device_info[key] = round(device_info[key], 3)
+        return device_info
+
+    def dump_metrics(self, path):
+        """Writes the ViPR call metrics of this backend to path."""
+        try:
+            self.metrics.dump(path)
+        except (IOError, OSError):
+            LOG.exception(_("Writing ViPR metrics to %s failed") % path)
+
     @retry_wrapper
     def update_volume_stats(self):
         """Retrieve stats info."""
@@ -1510,42 +2391,27 @@ class EMCViPRDriverCommon(object):
 
         try:
             self.stats['consistencygroup_support'] = 'True'
-            vols = self.volume_obj.list_volumes(
-                self.configuration.vipr_tenant +
-                "/" +
-                self.configuration.vipr_project)
- 	    
-            vpairs = set()
-            if len(vols) > 0:
-                for vol in vols:
-                    if vol:
-                        vpair = (vol["vpool"]["id"], vol["varray"]["id"])
-                        if vpair not in vpairs:
-                            vpairs.add(vpair)
+            vpairs = self._get_capacity_pairs()
 
             if len(vpairs) > 0:
                 free_gb = 0.0
                 used_gb = 0.0
                 provisioned_gb = 0.0
-                for vpair in vpairs:
-                    if vpair:
-                        (s, h) = vipr_utils.service_json_request(
-                            self.configuration.vipr_hostname,
-                            self.configuration.vipr_port,
-                            "GET",
-                            URI_VPOOL_VARRAY_CAPACITY.format(vpair[0],
-                                                             vpair[1]),
-                            body=None)
-                        capacity = vipr_utils.json_decode(s)
-
-                        free_gb += float(capacity["free_gb"])
-                        used_gb += float(capacity["used_gb"])
-                        provisioned_gb += float(capacity["provisioned_gb"])
+                pool = greenpool.GreenPool(
+                    max(self.configuration.vipr_stats_max_concurrency, 1))
+                get_capacity = vipr_tracing.bind(vipr_rest.bind(
+                    self.rest_client, self._get_vpool_varray_capacity))
+                for capacity in pool.imap(get_capacity,
+                                          vpairs):
+                    free_gb += float(capacity["free_gb"])
+                    used_gb += float(capacity["used_gb"])
+                    provisioned_gb += float(capacity["provisioned_gb"])
 
                 self.stats['free_capacity_gb'] = free_gb
                 self.stats['total_capacity_gb'] = free_gb + used_gb
-                self.stats['reserved_percentage'] = 100 * \
-                    provisioned_gb / (free_gb + used_gb)
+                if free_gb + used_gb > 0:
+                    self.stats['reserved_percentage'] = 100 * \
+                        provisioned_gb / (free_gb + used_gb)
 
             return self.stats
 
@@ -1555,12 +2421,60 @@ class EMCViPRDriverCommon(object):
                     LOG.exception(_("Update volume stats failed"))
 
 
+    def _get_capacity_pairs(self):
+        """Returns the (vpool uri, varray uri) pairs to report capacity of.
+
+        The virtual pools are taken from the volume types of this backend
+        and from the pools the driver has created volumes in, so no volume
+        listing is needed. The configured virtual array is used for all of
+        them since the driver only creates volumes there.
+        """
+        vpool_names = set(self._capacity_vpools)
+        ctxt = context.get_admin_context()
+        backend_name = self.stats['volume_backend_name']
+        for volume_type in volume_types.get_all_types(ctxt).values():
+            specs = volume_type.get('extra_specs') or {}
+            if 'ViPR:VPOOL' not in specs:
+                continue
+            type_backend = specs.get('volume_backend_name')
+            if type_backend is not None and type_backend != backend_name:
+                continue
+            vpool_names.add(specs['ViPR:VPOOL'])
+
+        varray_uri = self._get_varray_uri()
+        vpairs = set()
+        for vpool_name in vpool_names:
+            vpool_uri = self._vpool_uris.get(vpool_name)
+            if vpool_uri is None:
+                try:
+                    vpool_uri = self.vpool_obj.vpool_query(vpool_name,
+                                                           'block')
+                except vipr_utils.SOSError as e:
+                    LOG.warning(_("Virtual pool %(vpool)s could not be "
+                                  "resolved: %(err)s") %
+                                {'vpool': vpool_name, 'err': e.err_text})
+                    continue
+                self._vpool_uris[vpool_name] = vpool_uri
+            vpairs.add((vpool_uri, varray_uri))
+
+        return vpairs
+
+    def _get_vpool_varray_capacity(self, vpair):
+        (s, h) = vipr_utils.service_json_request(
+            self.configuration.vipr_hostname,
+            self.configuration.vipr_port,
+            "GET",
+            URI_VPOOL_VARRAY_CAPACITY.format(vpair[0], vpair[1]),
+            body=None)
+        return vipr_utils.json_decode(s)
+
     @retry_wrapper
     def retype(self, ctxt, volume, new_type, diff, host):
         """changes the vpool type"""
         self.authenticate_user()
         volume_name = self._get_vipr_volume_name(volume)
         vpool_name = new_type['extra_specs']['ViPR:VPOOL']
+        self._capacity_vpools.add(vpool_name)
 
         try:
             task = self.volume_obj.update(
@@ -1570,7 +2484,11 @@ class EMCViPRDriverCommon(object):
                 volume_name,
                 vpool_name)
 
-            self.volume_obj.check_for_sync(task['task'][0], True)
+            # the update is submitted already; only the wait is left
+            self._run_task(
+                "change virtual pool",
+                lambda sync: (self.volume_obj.check_for_sync(
+                    task['task'][0], True) if sync else task))
             return True
         except vipr_utils.SOSError as e:
             if e.err_code == vipr_utils.SOSError.SOS_FAILURE_ERR:
@@ -1581,3 +2499,6 @@ class EMCViPRDriverCommon(object):
                 with excutils.save_and_reraise_exception():
                     LOG.exception(_("Volume : %s type update failed") % volume_name)
 
+
+# a span per public operation and private helper, when sampled
+vipr_tracing.trace_methods(EMCViPRDriverCommon)
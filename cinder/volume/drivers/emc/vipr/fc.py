@@ -263,7 +263,7 @@ class EMCViPRFCDriver(driver.FibreChannelDriver):
     def update_volume_stats(self):
         """Retrieve stats info from virtual pool/virtual array."""
         LOG.debug("Updating volume stats")
-        self._stats = self.common.update_volume_stats()
+        self._stats = self.common.get_volume_stats()
 
 
     def retype(self, ctxt, volume, new_type, diff, host):
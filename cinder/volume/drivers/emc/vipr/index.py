@@ -0,0 +1,118 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Persistent OpenStack id to ViPR resource index for the EMC ViPR driver.
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class PersistentIdIndex(object):
+    """SQLite-backed map of OpenStack id -> ViPR (name, uri).
+
+    The index lives on local disk so that a restarted cinder-volume does
+    not have to fall back to ViPR tag searches for resources it already
+    knows about.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS vipr_id_index ('
+                ' kind TEXT NOT NULL,'
+                ' os_id TEXT NOT NULL,'
+                ' name TEXT NOT NULL,'
+                ' uri TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL,'
+                ' PRIMARY KEY (kind, os_id))')
+            self._conn.commit()
+
+    def get(self, kind, os_id):
+        """Returns the indexed (name, uri, updated_at) tuple or None.
+
+        Rows never expire; updated_at tells when the resolution was last
+        confirmed.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT name, uri, updated_at FROM vipr_id_index'
+                ' WHERE kind = ? AND os_id = ?', (kind, os_id)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2]
+
+    def put(self, kind, os_id, name, uri):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO vipr_id_index'
+                ' (kind, os_id, name, uri, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (kind, os_id, name, uri, time.time()))
+            self._conn.commit()
+
+    def delete(self, kind, os_id):
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM vipr_id_index WHERE kind = ? AND os_id = ?',
+                (kind, os_id))
+            self._conn.commit()
+
+    def replace_all(self, kind, rows):
+        """Replaces every entry of the given kind in one transaction.
+
+        rows is an iterable of (os_id, name, uri) tuples.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    'DELETE FROM vipr_id_index WHERE kind = ?', (kind,))
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO vipr_id_index'
+                    ' (kind, os_id, name, uri, updated_at)'
+                    ' VALUES (?, ?, ?, ?, ?)',
+                    [(kind, os_id, name, uri, now)
+                     for (os_id, name, uri) in rows])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def count(self, kind=None):
+        with self._lock:
+            if kind is None:
+                row = self._conn.execute(
+                    'SELECT COUNT(*) FROM vipr_id_index').fetchone()
+            else:
+                row = self._conn.execute(
+                    'SELECT COUNT(*) FROM vipr_id_index WHERE kind = ?',
+                    (kind,)).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
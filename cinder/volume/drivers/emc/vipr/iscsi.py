@@ -215,7 +215,7 @@ class EMCViPRISCSIDriver(driver.ISCSIDriver):
     def update_volume_stats(self):
         """Retrieve stats info from virtual pool/virtual array."""
         LOG.debug("Updating volume stats")
-        self._stats = self.common.update_volume_stats()
+        self._stats = self.common.get_volume_stats()
 
     def retype(self, ctxt, volume, new_type, diff, host):    
         """Change the volume type"""
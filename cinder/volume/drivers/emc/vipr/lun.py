@@ -0,0 +1,98 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Host LUN allocation for ViPR export groups.
+
+"""
+
+import threading
+
+# ViPR's answer when the host LUN of an export is taken
+COLLISION_MARKERS = ('already in use', 'already used', 'is in use')
+
+
+def is_collision(err_text):
+    """Tells whether an export failed because its LUN was taken."""
+    lowered = (err_text or '').lower()
+    return ('lun' in lowered or 'hlu' in lowered) and \
+        any(marker in lowered for marker in COLLISION_MARKERS)
+
+
+class LunAllocator(object):
+    """Hands out host LUN ids per export group.
+
+    Each export group is tracked as an integer bitmap in which bit N is
+    set when LUN N is in use or reserved by an attach in progress. LUN 0
+    is never handed out: exporting with LUN 0 fails when creating a
+    volume from an image on a cinder node that is not the nova node.
+    """
+
+    FIRST_LUN = 1
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def is_seeded(self, group):
+        with self._lock:
+            return group in self._groups
+
+    def seed(self, group, luns):
+        """Initializes a group from the LUNs already used in ViPR.
+
+        A group that is already tracked keeps its bitmap, so reservations
+        made by concurrent attaches are not lost. Returns True if the
+        group was seeded by this call.
+        """
+        bitmap = (1 << self.FIRST_LUN) - 1
+        for lun in luns:
+            try:
+                lun = int(lun)
+            except (TypeError, ValueError):
+                continue
+            if lun >= 0:
+                bitmap |= 1 << lun
+
+        with self._lock:
+            if group in self._groups:
+                return False
+            self._groups[group] = bitmap
+            return True
+
+    def reserve(self, group):
+        """Reserves and returns the lowest free LUN of a seeded group."""
+        with self._lock:
+            bitmap = self._groups[group]
+            lowest_free = ~bitmap & (bitmap + 1)
+            self._groups[group] = bitmap | lowest_free
+            return lowest_free.bit_length() - 1
+
+    def release(self, group, lun):
+        """Returns a LUN to the pool after a detach or a failed attach."""
+        try:
+            lun = int(lun)
+        except (TypeError, ValueError):
+            return
+        if lun < self.FIRST_LUN:
+            return
+        with self._lock:
+            if group in self._groups:
+                self._groups[group] &= ~(1 << lun)
+
+    def forget(self, group):
+        """Drops a group so that it is seeded again on next use."""
+        with self._lock:
+            self._groups.pop(group, None)
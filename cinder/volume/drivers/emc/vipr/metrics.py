@@ -0,0 +1,269 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Latency histograms and counters for ViPR calls.
+
+"""
+
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+import six
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from cinder.volume.drivers.emc.vipr import tracing as vipr_tracing
+
+
+LOG = logging.getLogger(__name__)
+
+# kinds of instrumented calls
+REST = 'rest'
+VIPRCLI = 'viprcli'
+# waits of the driver for ViPR state, such as the host LUN of an export
+WAIT = 'wait'
+
+# upper bounds of the latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10, 30, 60, 120)
+
+_URN = re.compile(r'urn(:|%3A)[^/?&]+', re.IGNORECASE)
+_NUMBER = re.compile(r'/\d+(?=/|$)')
+_NOT_IN_NAME = re.compile(r'[^a-zA-Z0-9_]+')
+
+_PROMETHEUS_NAMES = {REST: 'vipr_rest_request',
+                     VIPRCLI: 'vipr_cli_call',
+                     WAIT: 'vipr_driver_wait'}
+
+
+def uri_template(uri):
+    """Returns uri with ids replaced, e.g. /block/volumes/{id}/exports."""
+    path = uri.split('?', 1)[0]
+    path = _URN.sub('{id}', path)
+    return _NUMBER.sub('/{n}', path)
+
+
+class _Series(object):
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def observe(self, duration, error, bytes_sent, bytes_received):
+        index = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                index = i
+                break
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.errors += 1 if error else 0
+        self.sum_seconds += duration
+        self.max_seconds = max(self.max_seconds, duration)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(BUCKETS + ('+Inf',), self.bucket_counts):
+            cumulative += count
+            buckets.append((str(bound), cumulative))
+        return {'count': self.count,
+                'errors': self.errors,
+                'sum_seconds': round(self.sum_seconds, 6),
+                'max_seconds': round(self.max_seconds, 6),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'buckets': buckets}
+
+
+class MetricsRegistry(object):
+    """Per-backend latency histograms keyed by call kind and name.
+
+    REST calls are keyed by "<METHOD> <uri template>", viprcli calls by
+    "<Class>.<method>" or "<module>.<function>", driver waits by what is
+    waited for. Counters kept elsewhere in the driver are added to the
+    dump through add_stats.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._series = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add_stats(self, name, stats_func):
+        """Includes the dict returned by stats_func in every dump."""
+        with self._lock:
+            self._stats[name] = stats_func
+
+    def stats(self):
+        """Returns {name: stats} of the functions given to add_stats."""
+        with self._lock:
+            funcs = list(self._stats.items())
+        return dict((name, func()) for name, func in funcs)
+
+    def observe(self, kind, name, duration, error=False, bytes_sent=0,
+                bytes_received=0):
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None:
+                series = self._series[(kind, name)] = _Series()
+            series.observe(duration, error, bytes_sent, bytes_received)
+
+    def snapshot(self):
+        """Returns {kind: {name: series}} for reading in process."""
+        with self._lock:
+            result = {}
+            for (kind, name), series in self._series.items():
+                result.setdefault(kind, {})[name] = series.snapshot()
+            return result
+
+    def to_prometheus(self):
+        lines = []
+        snapshot = self.snapshot()
+        for kind in sorted(snapshot):
+            metric = _PROMETHEUS_NAMES.get(kind, 'vipr_' + kind)
+            lines.append('# TYPE %s_duration_seconds histogram' % metric)
+            for name in sorted(snapshot[kind]):
+                series = snapshot[kind][name]
+                labels = 'backend="%s",call="%s"' % (
+                    _escape(self.backend), _escape(name))
+                for bound, count in series['buckets']:
+                    lines.append('%s_duration_seconds_bucket{%s,le="%s"} %d'
+                                 % (metric, labels, bound, count))
+                lines.append('%s_duration_seconds_sum{%s} %f' %
+                             (metric, labels, series['sum_seconds']))
+                lines.append('%s_duration_seconds_count{%s} %d' %
+                             (metric, labels, series['count']))
+                lines.append('%s_errors_total{%s} %d' %
+                             (metric, labels, series['errors']))
+                lines.append('%s_bytes_sent_total{%s} %d' %
+                             (metric, labels, series['bytes_sent']))
+                lines.append('%s_bytes_received_total{%s} %d' %
+                             (metric, labels, series['bytes_received']))
+
+        labels = 'backend="%s"' % _escape(self.backend)
+        stats = self.stats()
+        for name in sorted(stats):
+            for (key, value) in _flatten(name, stats[name]):
+                metric = _NOT_IN_NAME.sub('_', key).strip('_')
+                if isinstance(value, six.string_types):
+                    # e.g. the state of the circuit breaker
+                    lines.append('%s{%s,value="%s"} 1' %
+                                 (metric, labels, _escape(value)))
+                elif value is not None:
+                    lines.append('%s{%s} %s' % (metric, labels,
+                                                float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Writes the metrics to path, as a Prometheus textfile if it ends
+        in .prom and as JSON otherwise. The file is replaced atomically.
+        """
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps({'backend': self.backend,
+                                  'time': time.time(),
+                                  'metrics': self.snapshot(),
+                                  'stats': self.stats()},
+                                 indent=2, sort_keys=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as fp:
+            fp.write(content)
+        os.rename(tmp_path, path)
+
+
+def _flatten(prefix, value):
+    """Yields (name, leaf) for the leaves of nested dicts."""
+    if isinstance(value, dict):
+        for key in sorted(value):
+            for item in _flatten('%s_%s' % (prefix, key), value[key]):
+                yield item
+    else:
+        yield (prefix, value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def timed(registry_func, kind, name, func):
+    """Wraps func to record its calls in the registry from registry_func.
+
+    registry_func is evaluated per call, so one wrapper installed in a
+    shared module can record into the registry of the calling backend.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        registry = registry_func()
+        if registry is None:
+            return func(*args, **kwargs)
+        start = time.time()
+        error = True
+        try:
+            with vipr_tracing.span(name, kind):
+                result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            registry.observe(kind, name, time.time() - start, error)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_module(module, names, registry_func):
+    """Replaces the named functions of a viprcli module with timed ones."""
+    prefix = module.__name__.rsplit('.', 1)[-1]
+    for name in names:
+        func = getattr(module, name, None)
+        if func is None or getattr(func, 'instrumented', False):
+            continue
+        setattr(module, name, timed(registry_func, VIPRCLI,
+                                    '%s.%s' % (prefix, name), func))
+
+
+class InstrumentedObject(object):
+    """Proxy that times every method call made on a viprcli object."""
+
+    def __init__(self, target, registry):
+        self._target = target
+        self._registry = registry
+        self._prefix = type(target).__name__
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        registry = self._registry
+        return timed(lambda: registry, VIPRCLI,
+                     '%s.%s' % (self._prefix, name), attr)
@@ -0,0 +1,72 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Wait strategies used when polling ViPR.
+
+"""
+
+import random
+import time
+
+from cinder.volume.drivers.emc.vipr import tracing as vipr_tracing
+
+
+class Backoff(object):
+    """Exponential backoff with jitter, bounded by an overall deadline.
+
+    next_delay() returns the number of seconds to sleep before the next
+    attempt, or None once the deadline would be exceeded. The first
+    delay is initial_delay; each later one is multiplied by multiplier
+    and capped at max_delay. A random fraction (up to jitter) of each
+    delay is subtracted so that concurrent waiters spread out.
+    """
+
+    def __init__(self, initial_delay, max_delay, timeout,
+                 multiplier=2.0, jitter=0.2):
+        self.initial_delay = max(float(initial_delay), 0.0)
+        self.max_delay = max(float(max_delay), self.initial_delay)
+        self.timeout = timeout
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.started = time.time()
+        self.attempts = 0
+        self._delay = self.initial_delay
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def next_delay(self):
+        delay = self._delay * (1.0 - random.uniform(0, self.jitter))
+        self._delay = min(self._delay * self.multiplier, self.max_delay)
+
+        if self.timeout is not None:
+            remaining = self.timeout - self.elapsed
+            if remaining <= 0:
+                return None
+            delay = min(delay, remaining)
+
+        self.attempts += 1
+        return delay
+
+    def sleep(self):
+        """Sleeps for the next delay; returns False once out of time."""
+        delay = self.next_delay()
+        if delay is None:
+            return False
+        with vipr_tracing.span('sleep', 'sleep'):
+            time.sleep(delay)
+        return True
@@ -0,0 +1,571 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Pooled, keep-alive HTTP transport and session handling for the ViPR
+REST API.
+
+"""
+
+import threading
+import time
+
+import requests
+from requests import adapters
+from requests.packages.urllib3 import connectionpool
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from cinder.volume.drivers.emc.vipr import metrics as vipr_metrics
+from cinder.volume.drivers.emc.vipr import retry as vipr_retry
+from cinder.volume.drivers.emc.vipr import tracing as vipr_tracing
+
+try:
+    import viprcli.common as vipr_utils
+except ImportError:
+    # reported when the driver imports viprcli
+    vipr_utils = None
+
+
+LOG = logging.getLogger(__name__)
+
+AUTH_TOKEN_HEADER = 'X-SDS-AUTH-TOKEN'
+
+# the rest client of the backend whose operation runs in this greenthread
+_context = threading.local()
+
+
+def active_client():
+    return getattr(_context, 'client', None)
+
+
+def active_metrics():
+    return getattr(active_client(), 'metrics', None)
+
+
+class use_client(object):
+    """Makes client the active backend of the calling greenthread.
+
+    After the block, reauth_replays holds the number of requests that
+    were replayed after a re-login inside it and outermost tells whether
+    the block was not nested in another one.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.reauth_replays = 0
+        self.outermost = True
+
+    def __enter__(self):
+        self._previous = active_client()
+        self._replays_before = getattr(_context, 'reauth_replays', 0)
+        self.outermost = getattr(_context, 'depth', 0) == 0
+        _context.client = self.client
+        _context.depth = getattr(_context, 'depth', 0) + 1
+        _context.reauth_replays = self._replays_before
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.reauth_replays = (getattr(_context, 'reauth_replays', 0) -
+                               self._replays_before)
+        _context.client = self._previous
+        _context.depth -= 1
+
+
+def _count_reauth_replay():
+    _context.reauth_replays = getattr(_context, 'reauth_replays', 0) + 1
+
+
+def bind(client, func):
+    """Wraps func to run with client active, for spawned greenthreads."""
+    def bound(*args, **kwargs):
+        with use_client(client):
+            return func(*args, **kwargs)
+    return bound
+
+
+class TokenStore(object):
+    """In-memory ViPR auth token shared by all greenthreads of a backend.
+
+    get() returns the current token, logging in through login_func when
+    there is none or when it is older than max_age seconds. Logins are
+    single-flight: greenthreads that need a token while a login is in
+    progress wait for it and reuse its result instead of logging in
+    themselves.
+    """
+
+    def __init__(self, login_func, max_age):
+        self.login_func = login_func
+        self.max_age = max_age
+        self.logins = 0
+        self._token = None
+        self._obtained_at = None
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        if self._token is None:
+            return False
+        if not self.max_age:
+            return True
+        return time.time() - self._obtained_at < self.max_age
+
+    def get(self):
+        if self._fresh():
+            return self._token
+        with self._lock:
+            # another greenthread may have logged in while we waited
+            if not self._fresh():
+                self._token = self.login_func()
+                self._obtained_at = time.time()
+                self.logins += 1
+            return self._token
+
+    def invalidate(self, token):
+        """Drops token after ViPR rejected it, unless already replaced."""
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+
+class _PoolStats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self.evictions = 0
+        self.unscoped = 0
+        self.cross_talk = 0
+        self.reauth_replays = 0
+
+    def begin(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def unscoped_request(self, ambiguous):
+        with self._lock:
+            self.unscoped += 1
+            if ambiguous:
+                self.cross_talk += 1
+
+    def reauth_replay(self):
+        with self._lock:
+            self.reauth_replays += 1
+
+
+class _CountingAdapter(adapters.HTTPAdapter):
+    """HTTPAdapter whose connection pools count the connections they open."""
+
+    def __init__(self, stats, **kwargs):
+        self._stats = stats
+        super(_CountingAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CountingAdapter, self).init_poolmanager(*args, **kwargs)
+        stats = self._stats
+
+        def counting(base):
+            class _Pool(base):
+                def _new_conn(pool):
+                    stats.new_connection()
+                    return base._new_conn(pool)
+            return _Pool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': counting(connectionpool.HTTPConnectionPool),
+            'https': counting(connectionpool.HTTPSConnectionPool)}
+
+    def idle_connections(self):
+        idle = 0
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            idle += sum(1 for conn in list(pool.pool.queue)
+                        if conn is not None)
+        return idle
+
+
+class ViPRRestClient(object):
+    """A requests.Session with a bounded keep-alive pool to one ViPR.
+
+    Connections, and so the TLS handshakes, are reused across calls. Up
+    to pool_size connections are kept open; a burst beyond that opens
+    short-lived extra connections instead of blocking. When the pool has
+    been unused for idle_timeout seconds its connections are closed
+    before the next request rather than risking a write on a socket the
+    server already dropped.
+    """
+
+    def __init__(self, host, port, pool_size=10, idle_timeout=60):
+        self.host = host
+        self.port = port
+        protocol = 'http' if str(port) == '8080' else 'https'
+        self.base_url = '%s://%s:%s' % (protocol, host, port)
+        self.tokens = None
+        self.retry_policy = None
+        self.breaker = None
+        self.throttle = None
+        self.metrics = None
+        self.pool_size = max(int(pool_size), 1)
+        self.idle_timeout = idle_timeout
+        self.stats = _PoolStats()
+        self._last_used = time.time()
+        self._lock = threading.Lock()
+        self._adapter = None
+        self.session = None
+        self._new_session()
+
+    def _new_session(self):
+        self._adapter = _CountingAdapter(self.stats,
+                                         pool_connections=1,
+                                         pool_maxsize=self.pool_size)
+        session = requests.Session()
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        self.session = session
+
+    def _evict_idle(self):
+        now = time.time()
+        with self._lock:
+            idle_for = now - self._last_used
+            self._last_used = now
+            if (self.idle_timeout and idle_for > self.idle_timeout and
+                    self.stats.in_flight == 0):
+                self._adapter.poolmanager.clear()
+                self.stats.evictions += 1
+
+    def request(self, method, url, **kwargs):
+        if self.breaker is not None:
+            self.breaker.check()
+        if self.throttle is None:
+            return self._guarded_request(method, url, **kwargs)
+        with self.throttle.slot(method, url):
+            return self._guarded_request(method, url, **kwargs)
+
+    def _guarded_request(self, method, url, **kwargs):
+        if self.breaker is None:
+            return self._request(method, url, **kwargs)
+
+        start = time.time()
+        try:
+            response = self._request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record(True, time.time() - start)
+            raise
+        self.breaker.record(response.status_code >= 500,
+                            time.time() - start)
+        return response
+
+    def _request(self, method, url, **kwargs):
+        self._evict_idle()
+        self.stats.begin()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            self.stats.end()
+            self._last_used = time.time()
+
+    def probe(self, timeout=10):
+        """Cheap health call that bypasses the circuit breaker.
+
+        Any answer below 500, including the 401 of an unauthenticated
+        request, shows that the ViPR API is serving requests.
+        """
+        response = self._request('GET', self.base_url + '/user/whoami',
+                                 headers={'X-EMC-REST-CLIENT': 'TRUE'},
+                                 verify=False, timeout=timeout)
+        return response.status_code < 500
+
+    def set_credentials(self, username, password, token_max_age):
+        self.tokens = TokenStore(
+            lambda: self.login(username, password), token_max_age)
+
+    def login(self, username, password):
+        """Logs in to ViPR and returns a new auth token."""
+        LOG.debug("Logging in to ViPR %s" % self.base_url)
+        response = self.request('GET', self.base_url + '/login',
+                                auth=(username, password),
+                                headers={'X-EMC-REST-CLIENT': 'TRUE'},
+                                verify=False)
+        token = response.headers.get(AUTH_TOKEN_HEADER)
+        for earlier in response.history:
+            token = token or earlier.headers.get(AUTH_TOKEN_HEADER)
+        if response.status_code != requests.codes['ok']:
+            self._raise_for_status(response)
+        if not token:
+            raise vipr_utils.SOSError(
+                vipr_utils.SOSError.HTTP_ERR,
+                "HTTP code: 401, Unauthorized [Login to ViPR returned no "
+                "authentication token]")
+        return token
+
+    def json_request(self, http_method, uri, body, token=None, xml=False,
+                     contenttype='application/json', filename=None,
+                     customheaders=None):
+        """Same contract as viprcli.common.service_json_request.
+
+        The auth token comes from the in-memory token store rather than
+        from a cookie file. When ViPR rejects the token with a 401 the
+        token is dropped, a new one is obtained and this one request is
+        sent again, so the calling operation never has to start over.
+        """
+        if xml:
+            headers = {'Content-Type': 'application/xml',
+                       'ACCEPT': 'application/xml, application/octet-stream',
+                       'X-EMC-REST-CLIENT': 'TRUE'}
+        else:
+            headers = {'Content-Type': contenttype,
+                       'ACCEPT': 'application/json, application/octet-stream',
+                       'X-EMC-REST-CLIENT': 'TRUE'}
+        if customheaders:
+            headers.update(customheaders)
+
+        if token:
+            uri += ('&' if '?' in uri else '?') + 'requestToken=' + token
+
+        url = self.base_url + uri
+        endpoint = '%s %s' % (http_method, vipr_metrics.uri_template(uri))
+        start = time.time()
+        response = None
+        try:
+            with vipr_tracing.span(endpoint, 'rest'):
+                response = self._send_with_retries(http_method, url, body,
+                                                   headers)
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe(
+                    vipr_metrics.REST,
+                    endpoint,
+                    time.time() - start,
+                    error=response is None,
+                    bytes_sent=len(body) if body else 0,
+                    bytes_received=len(response.content)
+                    if response is not None else 0)
+
+        if filename:
+            with open(filename, 'wb') as fp:
+                fp.write(response.content)
+        return (response.text, response.headers)
+
+    def _send_with_retries(self, http_method, url, body, headers):
+        # bulk queries only read, although they are sent as POST
+        read = http_method in ('GET', 'HEAD') or \
+            url.split('?')[0].endswith('/bulk')
+        try:
+            if self.retry_policy is None or \
+                    (not read and vipr_retry.in_task()):
+                # the TASK call around this request resubmits it when it
+                # is rejected; retrying here as well would multiply the
+                # submissions
+                response = self._send_checked(http_method, url, body,
+                                              headers)
+            else:
+                op_class = vipr_retry.READ if read else vipr_retry.MUTATION
+                response = self.retry_policy.call(
+                    op_class, self._send_checked, http_method, url, body,
+                    headers)
+            if not read:
+                vipr_retry.task_submitted()
+            return response
+        except requests.exceptions.RequestException as e:
+            raise vipr_utils.SOSError(vipr_utils.SOSError.HTTP_ERR, str(e))
+
+    def _send_checked(self, http_method, url, body, headers):
+        response = self._send_authenticated(http_method, url, body, headers)
+        if response.status_code in (requests.codes['ok'], 202):
+            return response
+        self._raise_for_status(response)
+
+    def _send_authenticated(self, http_method, url, body, headers):
+        # a 401 means ViPR did not act on the request, so it is safe to
+        # send it once more with a new token
+        for attempt in range(2):
+            auth_token = self.tokens.get()
+            headers[AUTH_TOKEN_HEADER] = auth_token
+            response = self.request(http_method, url, data=body,
+                                    headers=headers, verify=False)
+            if response.status_code != 401:
+                break
+            self.tokens.invalidate(auth_token)
+            if attempt == 0:
+                LOG.info("ViPR rejected the auth token; logging in again "
+                         "and replaying %s %s" % (http_method, url))
+                self.stats.reauth_replay()
+                _count_reauth_replay()
+        return response
+
+    def _raise_for_status(self, response):
+        code = response.status_code
+        if code == 500:
+            details = ''
+            try:
+                details = response.json().get('details', '')
+            except ValueError:
+                pass
+            error_msg = "ViPR internal server error. Error details: " + \
+                details
+        elif code == 401:
+            error_msg = "Access forbidden: Authentication required"
+        elif code == 403:
+            error_msg = "Access forbidden: " + response.text
+        elif code == 404:
+            error_msg = "Requested resource not found"
+        elif code == 405:
+            error_msg = "Method not supported by ViPR"
+        elif code == 503:
+            error_msg = ("Service temporarily unavailable: The server is "
+                         "temporarily unable to service your request")
+        else:
+            error_msg = response.text
+        raise vipr_utils.SOSError(
+            vipr_utils.SOSError.HTTP_ERR,
+            "HTTP code: %s, %s [%s]" % (code, response.reason, error_msg))
+
+    def pool_stats(self):
+        stats = self.stats
+        total = stats.requests
+        reused = max(total - stats.new_connections, 0)
+        return {'requests': total,
+                'new_connections': stats.new_connections,
+                'reuse_ratio': round(float(reused) / total, 3) if total
+                else None,
+                'open_connections': (self._adapter.idle_connections() +
+                                     stats.in_flight),
+                'idle_evictions': stats.evictions,
+                'logins': self.tokens.logins if self.tokens else 0,
+                'unscoped_requests': stats.unscoped,
+                'cross_talk_requests': stats.cross_talk,
+                'reauth_replays': stats.reauth_replays}
+
+    def close(self):
+        self.session.close()
+
+
+class PooledRequests(object):
+    """Stands in for the requests module inside viprcli.
+
+    viprcli calls requests.get/post/put/delete at module level, which
+    opens a new connection per call. Requests to a registered ViPR
+    host and port are sent through the ViPRRestClient of the backend
+    active in the calling greenthread; anything else, and every other
+    attribute (codes, exceptions, ...), falls through to the real
+    requests module.
+    """
+
+    def __init__(self):
+        self._clients = {}
+
+    def register(self, client):
+        key = (client.host, str(client.port))
+        clients = self._clients.setdefault(key, [])
+        if client not in clients:
+            clients.append(client)
+
+    def lookup(self, host, port):
+        """Returns the client for a request to host:port, or None.
+
+        This is the active backend of the calling greenthread when it
+        talks to that host. Otherwise the first backend registered for
+        it is used and the request is counted as unscoped, and as cross
+        talk when several backends share the host.
+        """
+        key = (host, str(port))
+        client = active_client()
+        if client is not None and (client.host, str(client.port)) == key:
+            return client
+
+        clients = self._clients.get(key)
+        if not clients:
+            return None
+        clients[0].stats.unscoped_request(len(clients) > 1)
+        return clients[0]
+
+    def client_for(self, url):
+        parsed = requests.utils.urlparse(url)
+        return self.lookup(parsed.hostname, parsed.port)
+
+    def request(self, method, url, **kwargs):
+        client = self.client_for(url)
+        if client is None:
+            return requests.request(method, url, **kwargs)
+        return client.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+_pooled_requests = PooledRequests()
+
+
+def install(client, *modules):
+    """Routes the REST calls of the given viprcli modules to client.
+
+    viprcli.common.service_json_request is replaced by one that sends
+    requests for a registered host and port through its client, with
+    the client's in-memory token.
+    """
+    _pooled_requests.register(client)
+    for module in modules:
+        if getattr(module, 'requests', None) is not None:
+            module.requests = _pooled_requests
+
+    if vipr_utils is not None and not getattr(
+            vipr_utils.service_json_request, 'pooled', False):
+        vipr_utils.service_json_request = _make_service_json_request(
+            vipr_utils.service_json_request)
+
+
+def _make_service_json_request(original):
+    def service_json_request(ip_addr, port, http_method, uri, body,
+                             *args, **kwargs):
+        client = _pooled_requests.lookup(ip_addr, port)
+        if client is None or client.tokens is None:
+            return original(ip_addr, port, http_method, uri, body,
+                            *args, **kwargs)
+        return client.json_request(http_method, uri, body, *args, **kwargs)
+
+    service_json_request.pooled = True
+    return service_json_request
@@ -0,0 +1,190 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Retry policy for calls to ViPR.
+
+"""
+
+import re
+import threading
+import time
+
+import requests
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from cinder.volume.drivers.emc.vipr import polling as vipr_polling
+
+
+LOG = logging.getLogger(__name__)
+
+# operation classes
+READ = 'read'
+MUTATION = 'mutation'
+TASK = 'task'
+
+# error classes
+PERMANENT = 'permanent'
+# ViPR or the network failed; the request may have been acted on
+TRANSIENT = 'transient'
+# the request certainly was not acted on
+REJECTED = 'rejected'
+# a ViPR task failed because a resource was busy with another operation
+BUSY = 'busy'
+
+_HTTP_CODE = re.compile(r'HTTP code: (\d+)')
+
+TRANSIENT_HTTP_CODES = (500, 502, 504)
+REJECTED_HTTP_CODES = (429, 503)
+
+BUSY_MARKERS = ('busy',
+                'in progress',
+                'another operation',
+                'pending task',
+                'is locked',
+                'try again later')
+
+_RETRYABLE = {READ: (TRANSIENT, REJECTED, BUSY),
+              MUTATION: (REJECTED,),
+              TASK: (REJECTED, BUSY)}
+
+# the attempt of the TASK call running in this greenthread
+_task_scope = threading.local()
+
+
+def in_task():
+    return getattr(_task_scope, 'attempt', None) is not None
+
+
+def task_submitted():
+    """Records that ViPR accepted a request of the running TASK call."""
+    attempt = getattr(_task_scope, 'attempt', None)
+    if attempt is not None:
+        attempt['submitted'] = True
+
+
+def _task_ended_busy(error, error_class):
+    # a failed task reports its message; failed requests an HTTP code
+    return error_class == BUSY and \
+        not _HTTP_CODE.search(getattr(error, 'err_text', None) or '')
+
+
+def classify(error):
+    """Returns the error class of an exception raised by a ViPR call."""
+    # set by the driver when it knows better than the error text
+    if getattr(error, 'error_class', None) is not None:
+        return error.error_class
+    if isinstance(error, (requests.exceptions.ConnectTimeout,
+                          requests.exceptions.ProxyError)):
+        return REJECTED
+    if isinstance(error, requests.exceptions.ConnectionError):
+        text = str(error)
+        if 'NewConnectionError' in text or 'refused' in text:
+            return REJECTED
+        return TRANSIENT
+    if isinstance(error, requests.exceptions.Timeout):
+        return TRANSIENT
+
+    err_text = getattr(error, 'err_text', None)
+    if err_text is None:
+        return PERMANENT
+
+    match = _HTTP_CODE.search(err_text)
+    if match:
+        code = int(match.group(1))
+        if code in REJECTED_HTTP_CODES:
+            return REJECTED
+        if code in TRANSIENT_HTTP_CODES:
+            return TRANSIENT
+
+    lowered = err_text.lower()
+    if any(marker in lowered for marker in BUSY_MARKERS):
+        return BUSY
+    return PERMANENT
+
+
+class RetryPolicy(object):
+    """Retries ViPR calls according to their operation class.
+
+    READ calls are idempotent and are retried on any transient error.
+    MUTATION calls are only retried when ViPR certainly did not act on
+    them (connection refused, 429, 503). TASK calls are mutations whose
+    ViPR task may fail because the resource is busy with another task.
+    A TASK call is resubmitted only while ViPR has not accepted any of its
+    mutating requests, or when the accepted task ended as busy; once a
+    task exists, a failed lookup or poll never submits a second one. The
+    mutating requests inside a TASK call are not retried on their own.
+    Each class has its own attempt limit;
+    the delay between attempts grows exponentially with jitter.
+    """
+
+    def __init__(self, limits, initial_delay, max_delay):
+        self.limits = dict(limits)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self.retries = dict((op_class, 0) for op_class in self.limits)
+        self.exhausted = dict((op_class, 0) for op_class in self.limits)
+
+    def call(self, op_class, func, *args, **kwargs):
+        limit = max(self.limits.get(op_class, 1), 1)
+        backoff = vipr_polling.Backoff(self.initial_delay, self.max_delay,
+                                       None)
+        attempt = 1
+        while True:
+            state = {'submitted': False}
+            previous = getattr(_task_scope, 'attempt', None)
+            if op_class == TASK:
+                _task_scope.attempt = state
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error_class = classify(e)
+                if error_class not in _RETRYABLE.get(op_class, ()):
+                    raise
+                if state['submitted'] and \
+                        not _task_ended_busy(e, error_class):
+                    raise
+                if attempt >= limit:
+                    self._count(self.exhausted, op_class)
+                    raise
+
+                delay = backoff.next_delay()
+                self._count(self.retries, op_class)
+                LOG.warning("ViPR %(op_class)s call failed (%(error)s, "
+                            "attempt %(attempt)d of %(limit)d); retrying "
+                            "in %(delay).1f seconds" %
+                            {'op_class': op_class,
+                             'error': error_class,
+                             'attempt': attempt,
+                             'limit': limit,
+                             'delay': delay})
+                time.sleep(delay)
+                attempt += 1
+            finally:
+                _task_scope.attempt = previous
+
+    def _count(self, counters, op_class):
+        with self._lock:
+            counters[op_class] = counters.get(op_class, 0) + 1
+
+    def counters(self):
+        with self._lock:
+            return {'retries': dict(self.retries),
+                    'exhausted': dict(self.exhausted)}
@@ -263,7 +263,7 @@ class EMCViPRScaleIODriver(driver.VolumeDriver):
     def update_volume_stats(self):
         """Retrieve stats info from virtual pool/virtual array."""
         LOG.debug("Updating volume stats")
-        self._stats = self.common.update_volume_stats()
+        self._stats = self.common.get_volume_stats()
 
     def _get_scaleio_version(self):
         LOG.info("Get version of the scaleio SDC")
@@ -0,0 +1,119 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Background refresh of the EMC ViPR backend stats.
+
+"""
+
+import threading
+import time
+
+from eventlet import greenthread
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+class StatsRefresher(object):
+    """Keeps the last good stats snapshot and refreshes it asynchronously.
+
+    refresh_func is called every interval seconds in a greenthread. When
+    a refresh fails or takes longer than slow_threshold seconds the
+    interval is doubled, up to max_interval, and it returns to interval
+    after the next fast, successful refresh.
+    """
+
+    def __init__(self, refresh_func, interval, max_interval, slow_threshold):
+        self.refresh_func = refresh_func
+        self.interval = max(interval, 1)
+        self.max_interval = max(max_interval, self.interval)
+        self.slow_threshold = slow_threshold
+        self.current_interval = self.interval
+        self._snapshot = None
+        self._updated_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self.failures = 0
+        self.last_duration = None
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    def refresh(self):
+        """Runs one refresh in the calling greenthread.
+
+        Returns True when a new snapshot was stored.
+        """
+        start = time.time()
+        try:
+            stats = self.refresh_func()
+        except Exception:
+            self.failures += 1
+            self.last_duration = time.time() - start
+            self._back_off()
+            LOG.exception("Refreshing ViPR backend stats failed; keeping "
+                          "the previous snapshot")
+            return False
+
+        self.last_duration = time.time() - start
+        with self._lock:
+            self._snapshot = dict(stats)
+            self._updated_at = time.time()
+
+        if self.slow_threshold and self.last_duration > self.slow_threshold:
+            self._back_off()
+            LOG.warning("Refreshing ViPR backend stats took %(took).1f "
+                        "seconds; next refresh in %(next)d seconds" %
+                        {'took': self.last_duration,
+                         'next': self.current_interval})
+        else:
+            self.current_interval = self.interval
+        return True
+
+    def _back_off(self):
+        self.current_interval = min(self.current_interval * 2,
+                                    self.max_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = greenthread.spawn(self._run)
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped:
+            greenthread.sleep(self.current_interval)
+            if not self._stopped:
+                self.refresh()
+
+    def get(self):
+        """Returns (stats copy, age in seconds); (None, None) if empty."""
+        with self._lock:
+            if self._snapshot is None:
+                return None, None
+            return dict(self._snapshot), time.time() - self._updated_at
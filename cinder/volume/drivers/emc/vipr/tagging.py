@@ -0,0 +1,261 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Write-behind tagging of ViPR resources.
+
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from eventlet import event
+from eventlet import greenthread
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+class TagJournal(object):
+    """Durable SQLite queue of pending tag writes.
+
+    Each entry holds everything needed to tag a ViPR volume later: the
+    OpenStack id, the tenant/project/name path of the volume, the tag URI
+    template and the desired OpenStack tags. There is at most one entry
+    per OpenStack id; a newer write replaces an older one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS vipr_tag_journal ('
+                ' os_id TEXT PRIMARY KEY,'
+                ' path TEXT NOT NULL,'
+                ' uri TEXT NOT NULL,'
+                ' tags TEXT NOT NULL,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' next_attempt_at REAL NOT NULL,'
+                ' created_at REAL NOT NULL)')
+            self._conn.commit()
+
+    def enqueue(self, os_id, path, uri, tags):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO vipr_tag_journal'
+                ' (os_id, path, uri, tags, attempts, next_attempt_at,'
+                '  created_at) VALUES (?, ?, ?, ?, 0, ?, ?)',
+                (os_id, path, uri, json.dumps(tags), now, now))
+            self._conn.commit()
+
+    def get(self, os_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT os_id, path, uri, tags, attempts'
+                ' FROM vipr_tag_journal WHERE os_id = ?',
+                (os_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def due(self, limit=100):
+        """Returns the entries whose next attempt is due, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT os_id, path, uri, tags, attempts'
+                ' FROM vipr_tag_journal WHERE next_attempt_at <= ?'
+                ' ORDER BY created_at LIMIT ?',
+                (time.time(), limit)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def pending(self):
+        """Returns every entry, including those waiting for a retry."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT os_id, path, uri, tags, attempts'
+                ' FROM vipr_tag_journal ORDER BY created_at').fetchall()
+        return [self._entry(row) for row in rows]
+
+    def complete(self, os_id, tags=None):
+        """Removes the entry of os_id.
+
+        When tags is given the entry is only removed if it still holds
+        those tags, so a write enqueued in the meantime is kept.
+        """
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM vipr_tag_journal WHERE os_id = ?' +
+                self._same_tags(tags), self._args(os_id, tags))
+            self._conn.commit()
+
+    def defer(self, os_id, delay, tags=None):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE vipr_tag_journal SET attempts = attempts + 1,'
+                ' next_attempt_at = ? WHERE os_id = ?' +
+                self._same_tags(tags),
+                (time.time() + delay,) + self._args(os_id, tags))
+            self._conn.commit()
+
+    def _same_tags(self, tags):
+        return ' AND tags = ?' if tags is not None else ''
+
+    def _args(self, os_id, tags):
+        if tags is None:
+            return (os_id,)
+        return (os_id, json.dumps(tags))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM vipr_tag_journal').fetchone()[0]
+
+    def _entry(self, row):
+        return {'os_id': row[0],
+                'path': row[1],
+                'uri': row[2],
+                'tags': json.loads(row[3]),
+                'attempts': row[4]}
+
+
+class TagWriter(object):
+    """Applies journaled tag writes from a background greenthread.
+
+    apply_func(entry) performs the ViPR calls for one journal entry. It
+    returns normally on success, raises LookupError when the resource no
+    longer exists and any other exception for a retryable failure.
+    Failed entries are retried with exponential backoff and dropped
+    after max_attempts.
+    """
+
+    def __init__(self, journal, apply_func, interval=2,
+                 max_attempts=10, max_backoff=300):
+        self.journal = journal
+        self.apply_func = apply_func
+        self.interval = max(interval, 0.1)
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        # os_id -> event sent when the write being applied has ended
+        self._inflight = {}
+        self._thread = None
+        self._stopped = False
+
+    def enqueue(self, os_id, path, uri, tags):
+        self.journal.enqueue(os_id, path, uri, tags)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = greenthread.spawn(self._run)
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+
+    def flush(self, os_id=None):
+        """Applies pending writes now, for one OpenStack id or for all.
+
+        Used before any operation that looks resources up by tag.
+        """
+        if os_id is not None:
+            entry = self.journal.get(os_id)
+            if entry is not None:
+                self._apply(entry)
+        else:
+            for entry in self.journal.pending():
+                self._apply(entry)
+
+    def _run(self):
+        while not self._stopped:
+            greenthread.sleep(self.interval)
+            try:
+                for entry in self.journal.due():
+                    if self._stopped:
+                        break
+                    self._apply(entry)
+            except Exception:
+                LOG.exception("Processing the ViPR tag journal failed")
+
+    def _claim(self, entry):
+        """Marks the entry in flight; returns its event, or None when the
+        entry was applied or replaced in the meantime.
+
+        Waits while another greenthread is applying the same OpenStack
+        id, so a flush returns only once the write is in ViPR.
+        """
+        os_id = entry['os_id']
+        while True:
+            with self._lock:
+                done = self._inflight.get(os_id)
+                if done is None:
+                    current = self.journal.get(os_id)
+                    if current is None or current['tags'] != entry['tags']:
+                        return None
+                    done = event.Event()
+                    self._inflight[os_id] = done
+                    return done
+            done.wait()
+
+    def _apply(self, entry):
+        done = self._claim(entry)
+        if done is None:
+            return
+        os_id = entry['os_id']
+        tags = entry['tags']
+        try:
+            # the ViPR calls run without the lock, so a flush of another
+            # id does not wait behind them
+            self.apply_func(entry)
+        except LookupError:
+            LOG.info("Dropping tag write for %s; the ViPR resource no "
+                     "longer exists" % os_id)
+            self.journal.complete(os_id, tags)
+        except Exception:
+            attempts = entry['attempts'] + 1
+            if attempts >= self.max_attempts:
+                LOG.exception("Giving up tagging %(path)s after "
+                              "%(attempts)d attempts" %
+                              {'path': entry['path'],
+                               'attempts': attempts})
+                self.journal.complete(os_id, tags)
+            else:
+                delay = min(self.interval * (2 ** attempts),
+                            self.max_backoff)
+                LOG.warning("Tagging %(path)s failed; retrying in "
+                            "%(delay)d seconds" %
+                            {'path': entry['path'], 'delay': delay})
+                self.journal.defer(os_id, delay, tags)
+        else:
+            self.journal.complete(os_id, tags)
+        finally:
+            with self._lock:
+                del self._inflight[os_id]
+            done.send()
@@ -0,0 +1,353 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tracking of the ViPR tasks a backend has in flight.
+
+"""
+
+import threading
+import time
+
+import eventlet
+from eventlet import event
+from eventlet import greenthread
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+# task states that are final
+READY = 'ready'
+ERROR = 'error'
+
+# weight of the latest completion time in the estimate of an operation
+ESTIMATE_WEIGHT = 0.3
+
+
+def task_list(result):
+    """Returns the task representations in the answer of a viprcli call.
+
+    Depending on the call, viprcli returns one task, a {'task': [...]}
+    list or nothing.
+    """
+    if not result:
+        return []
+    if isinstance(result, list):
+        return result
+    if 'task' in result:
+        return list(result['task'] or [])
+    if 'id' in result:
+        return [result]
+    return []
+
+
+class TaskError(Exception):
+    """A ViPR task failed, or the driver could not follow it to its end.
+
+    err_text carries the task message, so the retry policy can tell a
+    busy resource from a permanent failure. task_failed is False when
+    the task may still be running in ViPR: it timed out or the tracker
+    lost it, and it must not be submitted again.
+    """
+
+    def __init__(self, err_text, task_failed=True):
+        super(TaskError, self).__init__(err_text)
+        self.err_text = err_text
+        self.task_failed = task_failed
+
+
+class TrackedTask(object):
+
+    def __init__(self, rep, operation, resources=()):
+        self.uri = rep['id']
+        self.operation = operation
+        # what later operations may depend on, e.g. ('volume', uri)
+        self.resources = frozenset(resources)
+        # operations blocked until this deferred task ends
+        self.dependents = 0
+        resource = rep.get('resource') or {}
+        self.resource = resource.get('name') or resource.get('id')
+        self.state = rep.get('state')
+        self.message = rep.get('message')
+        self.submitted = time.time()
+        self.next_poll = self.submitted
+        self.last_poll = self.submitted
+        self.deferred = False
+        # why the tracker gave up on the task, if it did
+        self.lost = None
+        # sent by the poller when the task is done or cannot be polled
+        self.event = event.Event()
+
+    @property
+    def done(self):
+        return self.state in (READY, ERROR)
+
+    def update(self, rep):
+        self.state = rep.get('state')
+        self.message = rep.get('message')
+
+    def describe(self):
+        return "%s of %s (task %s)" % (self.operation, self.resource,
+                                       self.uri)
+
+
+class TaskTracker(object):
+    """Shared poller of the ViPR tasks a backend waits for.
+
+    Operations register the tasks viprcli submitted and wait() until the
+    poller wakes them. One greenthread polls every pending task with
+    fetch_func(uris), a bulk query that returns the task representations,
+    so the number of polls does not grow with the number of waiters.
+
+    Each task is first polled when tasks of the same operation usually
+    end, as learned from the tasks seen so far, and then with a delay
+    growing with its age; delays stay between initial_delay and max_delay
+    seconds. A waiter gives up after timeout seconds. Deferred tasks have
+    no waiter: they are polled every max_delay seconds and how they end
+    is logged. An operation that depends on the resources of deferred
+    tasks waits for them with wait_for_resources() first; they are then
+    polled as if waited for.
+    """
+
+    def __init__(self, fetch_func, initial_delay, max_delay, timeout):
+        self.fetch_func = fetch_func
+        self.initial_delay = max(initial_delay, 0.1)
+        self.max_delay = max(max_delay, self.initial_delay)
+        self.timeout = timeout
+        self._tasks = {}
+        self._estimates = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.max_wait_seconds = 0.0
+        self.poll_requests = 0
+        self.polled_tasks = 0
+        self.poll_failures = 0
+
+    def track(self, operation, result, resources=()):
+        """Registers the tasks in a viprcli answer; returns them."""
+        tasks = [TrackedTask(rep, operation, resources)
+                 for rep in task_list(result)]
+        with self._lock:
+            first_poll = self._clamp(self._estimates.get(operation, 0))
+            for task in tasks:
+                if task.done:
+                    continue
+                task.next_poll = task.submitted + first_poll
+                self._tasks[task.uri] = task
+            if self._tasks and self._thread is None:
+                self._thread = greenthread.spawn(self._run)
+        return tasks
+
+    def wait(self, tasks):
+        """Returns once all tasks are ready; raises TaskError otherwise."""
+        deadline = time.time() + self.timeout
+        for task in tasks:
+            if task.done:
+                continue
+            with eventlet.Timeout(max(deadline - time.time(), 0), False):
+                task.event.wait()
+
+        lost = [task for task in tasks if task.lost]
+        if lost:
+            raise TaskError('; '.join(
+                "Lost track of %s: %s" % (task.describe(), task.lost)
+                for task in lost), task_failed=False)
+
+        pending = [task for task in tasks if not task.done]
+        if pending:
+            # still running in ViPR: follow them in the background
+            self.defer(pending)
+            self.timed_out += 1
+            raise TaskError("Timed out after %d seconds waiting for %s" %
+                            (self.timeout,
+                             ', '.join(t.describe() for t in pending)),
+                            task_failed=False)
+
+        failed = [task for task in tasks if task.state == ERROR]
+        if failed:
+            raise TaskError('; '.join(
+                "%s failed: %s" % (task.describe(), task.message)
+                for task in failed))
+
+    def defer(self, tasks):
+        """Leaves tasks nobody waits for to the poller."""
+        for task in tasks:
+            task.deferred = True
+
+    def wait_for_resources(self, resources):
+        """Waits for the deferred tasks on any of resources to end.
+
+        Deleting a volume while the deferred delete of its snapshot still
+        runs, for example, would fail in ViPR. Gives up after timeout
+        seconds and lets the dependent operation try anyway.
+        """
+        resources = frozenset(resources)
+        with self._lock:
+            blocking = [task for task in self._tasks.values()
+                        if task.deferred and task.resources & resources]
+        if not blocking:
+            return
+
+        now = time.time()
+        deadline = now + self.timeout
+        for task in blocking:
+            task.dependents += 1
+            task.next_poll = min(task.next_poll, now + self.initial_delay)
+        try:
+            for task in blocking:
+                with eventlet.Timeout(max(deadline - time.time(), 0),
+                                      False):
+                    task.event.wait()
+        finally:
+            for task in blocking:
+                task.dependents -= 1
+
+        pending = [task for task in blocking if not task.done]
+        if pending:
+            LOG.warning("Going on while %s still run" %
+                        ', '.join(task.describe() for task in pending))
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+
+    def _clamp(self, delay):
+        return min(max(delay, self.initial_delay), self.max_delay)
+
+    def _run(self):
+        try:
+            while True:
+                now = time.time()
+                with self._lock:
+                    if not self._tasks:
+                        self._thread = None
+                        return
+                    pending = list(self._tasks.values())
+                # tasks due a little later share this poll
+                due = [task for task in pending
+                       if task.next_poll <= now + self.initial_delay / 2]
+                if not due:
+                    greenthread.sleep(min(
+                        min(task.next_poll for task in pending) - now,
+                        self.initial_delay))
+                    continue
+                try:
+                    self._poll(due)
+                except Exception as e:
+                    LOG.exception("Following %d ViPR tasks failed" %
+                                  len(due))
+                    self._lose(due, str(e))
+        finally:
+            # a later track() must be able to start a new poller
+            with self._lock:
+                if self._thread is greenthread.getcurrent():
+                    self._thread = None
+
+    def _poll(self, due):
+        self.poll_requests += 1
+        self.polled_tasks += len(due)
+        now = time.time()
+        try:
+            reps = self.fetch_func([task.uri for task in due])
+        except Exception:
+            # the tasks go on in ViPR whatever happened to the query;
+            # poll them again later
+            self.poll_failures += 1
+            LOG.exception("Polling %d ViPR tasks failed" % len(due))
+            for task in due:
+                task.next_poll = now + self._next_delay(task, now)
+            return
+        reps = dict((rep['id'], rep) for rep in reps if rep.get('id'))
+
+        now = time.time()
+        for task in due:
+            if task.uri in reps:
+                task.update(reps[task.uri])
+            if task.done:
+                self._finish(task, now)
+            else:
+                task.next_poll = now + self._next_delay(task, now)
+            task.last_poll = now
+
+    def _next_delay(self, task, now):
+        if task.deferred and not task.dependents:
+            return self.max_delay
+        return self._clamp((now - task.submitted) / 2)
+
+    def _lose(self, tasks, reason):
+        """Stops following tasks and fails their waiters."""
+        with self._lock:
+            for task in tasks:
+                self._tasks.pop(task.uri, None)
+        for task in tasks:
+            task.lost = reason
+            self._wake(task)
+
+    def _wake(self, task):
+        # deferred tasks may have dependents waiting
+        if not task.event.ready():
+            task.event.send()
+
+    def _finish(self, task, now):
+        elapsed = now - task.submitted
+        # the task ended some time between the last two polls
+        duration = (task.last_poll + now) / 2 - task.submitted
+        with self._lock:
+            self._tasks.pop(task.uri, None)
+            if task.state == ERROR:
+                self.failed += 1
+            else:
+                self.completed += 1
+                estimate = self._estimates.get(task.operation)
+                self._estimates[task.operation] = duration \
+                    if estimate is None else \
+                    estimate + ESTIMATE_WEIGHT * (duration - estimate)
+            self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+
+        self._wake(task)
+        if task.deferred:
+            if task.state == ERROR:
+                LOG.error("%(task)s failed after the driver returned: "
+                          "%(message)s" %
+                          {'task': task.describe(),
+                           'message': task.message})
+            else:
+                LOG.debug("%s is complete" % task.describe())
+
+    def stats(self):
+        with self._lock:
+            in_flight = list(self._tasks.values())
+            estimates = dict((operation, round(seconds, 3))
+                             for operation, seconds
+                             in self._estimates.items())
+        return {'in_flight': len(in_flight),
+                'deferred': sum(1 for task in in_flight if task.deferred),
+                'completed': self.completed,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+                'max_wait_seconds': round(self.max_wait_seconds, 3),
+                'poll_requests': self.poll_requests,
+                'polled_tasks': self.polled_tasks,
+                'poll_failures': self.poll_failures,
+                'estimated_seconds': estimates}
@@ -0,0 +1,140 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Client-side concurrency and rate limits for ViPR API calls.
+
+"""
+
+import contextlib
+import threading
+import time
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+READ = 'read'
+MUTATION = 'mutation'
+
+
+class TokenBucket(object):
+    """Allows rate calls per second on average, in bursts of up to burst.
+
+    A caller that finds the bucket empty reserves the next token and
+    sleeps until it is due, so waiters are released in arrival order
+    instead of all retrying at once. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(max(burst or rate, 1))
+        self._tokens = self.burst
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token; returns the seconds spent waiting for it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            wait = -self._tokens / self.rate
+        time.sleep(wait)
+        return wait
+
+
+class CallLimiter(object):
+    """Bounds the in-flight calls and the call rate of one call class."""
+
+    def __init__(self, max_in_flight, rate, burst=None):
+        self.max_in_flight = max_in_flight
+        self._semaphore = threading.BoundedSemaphore(max_in_flight) \
+            if max_in_flight > 0 else None
+        self._bucket = TokenBucket(rate, burst)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waited_calls = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.in_flight = 0
+
+    @contextlib.contextmanager
+    def slot(self):
+        start = time.time()
+        self._bucket.acquire()
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        wait = time.time() - start
+        self._record(wait)
+        try:
+            yield wait
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def _record(self, wait):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            # ignore scheduling noise
+            if wait >= 0.001:
+                self.waited_calls += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls,
+                    'in_flight': self.in_flight,
+                    'waited_calls': self.waited_calls,
+                    'wait_seconds': round(self.wait_seconds, 3),
+                    'max_wait_seconds': round(self.max_wait_seconds, 3)}
+
+
+class Throttle(object):
+    """Separate limiters for ViPR reads (GET, HEAD) and mutations."""
+
+    def __init__(self, read_limiter, mutation_limiter):
+        self.limiters = {READ: read_limiter, MUTATION: mutation_limiter}
+
+    @contextlib.contextmanager
+    def slot(self, http_method, url):
+        call_class = READ if http_method in ('GET', 'HEAD') else MUTATION
+        with self.limiters[call_class].slot() as wait:
+            if wait >= 1:
+                LOG.debug("%(method)s %(url)s waited %(wait).2f seconds "
+                          "for a ViPR %(class)s slot" %
+                          {'method': http_method,
+                           'url': url,
+                           'wait': wait,
+                           'class': call_class})
+            yield wait
+
+    def stats(self):
+        return dict((call_class, limiter.stats())
+                    for call_class, limiter in self.limiters.items())
@@ -0,0 +1,248 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Lightweight trace spans for EMC ViPR driver operations.
+
+"""
+
+import functools
+import inspect
+import json
+import random
+import threading
+import time
+import types
+
+try:
+    from oslo_context import context as oslo_context
+except ImportError:
+    oslo_context = None
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+# spans kept per trace; deeper or later calls are only counted
+MAX_SPANS = 2000
+
+_local = threading.local()
+
+
+class Span(object):
+
+    __slots__ = ('name', 'kind', 'start', 'duration', 'error', 'children')
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self.children = []
+
+    def to_dict(self, origin):
+        span = {'name': self.name,
+                'kind': self.kind,
+                'offset_ms': round((self.start - origin) * 1000, 3),
+                'duration_ms': round((self.duration or 0) * 1000, 3)}
+        if self.error:
+            span['error'] = self.error
+        if self.children:
+            span['children'] = [child.to_dict(origin)
+                                for child in self.children]
+        return span
+
+
+class _Trace(object):
+
+    def __init__(self, tracer, root):
+        self.tracer = tracer
+        self.root = root
+        self.spans = 1
+        self.dropped = 0
+        self.request_id = _request_id()
+
+
+def _request_id():
+    if oslo_context is None:
+        return None
+    ctx = oslo_context.get_current()
+    return getattr(ctx, 'request_id', None)
+
+
+def _current():
+    """Returns (trace, parent span) of the calling greenthread."""
+    return (getattr(_local, 'trace', None), getattr(_local, 'span', None))
+
+
+class _SpanScope(object):
+
+    def __init__(self, trace, parent, span):
+        self.trace = trace
+        self.parent = parent
+        self.span = span
+
+    def __enter__(self):
+        self._saved = _current()
+        _local.trace = self.trace
+        _local.span = self.span
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, tb):
+        span = self.span
+        span.duration = time.time() - span.start
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        _local.trace, _local.span = self._saved
+        if self.parent is None:
+            self.trace.tracer.finish(self.trace)
+
+
+class _NoScope(object):
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_NO_SCOPE = _NoScope()
+
+
+def span(name, kind='internal'):
+    """Opens a child span of the current span, if a trace is active."""
+    trace, parent = _current()
+    if trace is None or parent is None:
+        return _NO_SCOPE
+    if trace.spans >= MAX_SPANS:
+        trace.dropped += 1
+        return _NO_SCOPE
+    trace.spans += 1
+    child = Span(name, kind)
+    parent.children.append(child)
+    return _SpanScope(trace, parent, child)
+
+
+def bind(func):
+    """Wraps func to continue the caller's trace in a spawned greenthread."""
+    trace, parent = _current()
+    if trace is None:
+        return func
+
+    def bound(*args, **kwargs):
+        saved = _current()
+        _local.trace, _local.span = trace, parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace, _local.span = saved
+    return bound
+
+
+class Tracer(object):
+    """Samples driver operations and reports the slow ones.
+
+    A sampled operation collects a span per driver method and REST call.
+    When it takes at least threshold seconds its span tree, with the time
+    share of each direct child, is appended as a JSON line to path, or
+    logged when no path is set.
+    """
+
+    def __init__(self, backend, sample_rate=0.0, threshold=0, path=None):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.path = path
+        self._lock = threading.Lock()
+
+    def start(self, name):
+        """Opens the root span of an operation, or a no-op scope."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return _NO_SCOPE
+        root = Span(name, 'operation')
+        return _SpanScope(_Trace(self, root), None, root)
+
+    def finish(self, trace):
+        root = trace.root
+        if root.duration < self.threshold:
+            return
+        record = {'backend': self.backend,
+                  'operation': root.name,
+                  'request_id': trace.request_id,
+                  'start': root.start,
+                  'duration_ms': round(root.duration * 1000, 3),
+                  'breakdown': _breakdown(root),
+                  'dropped_spans': trace.dropped,
+                  'span': root.to_dict(root.start)}
+        line = json.dumps(record, sort_keys=True)
+        if not self.path:
+            LOG.info("ViPR trace: %s" % line)
+            return
+        try:
+            with self._lock:
+                with open(self.path, 'a') as fp:
+                    fp.write(line + '\n')
+        except (IOError, OSError):
+            LOG.exception("Writing ViPR trace to %s failed" % self.path)
+
+
+def _breakdown(root):
+    """Returns the share of the root's time spent in each direct child."""
+    totals = {}
+    for child in root.children:
+        totals[child.name] = totals.get(child.name, 0.0) + \
+            (child.duration or 0)
+    total = root.duration or 0
+    return dict((name, {'ms': round(seconds * 1000, 3),
+                        'percent': round(100.0 * seconds / total, 1)
+                        if total else None})
+                for name, seconds in totals.items())
+
+
+def _traced(name, func, public):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        trace, parent = _current()
+        if trace is not None:
+            scope = span(name)
+        elif public and getattr(self, 'tracer', None) is not None:
+            scope = self.tracer.start(name)
+        else:
+            return func(self, *args, **kwargs)
+        with scope:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def trace_methods(cls):
+    """Wraps the methods of cls in spans.
+
+    A public method starts a (sampled) trace when none is active; every
+    method adds a child span to an active trace. Generator methods are
+    left alone since their body runs after they return.
+    """
+    for name, attr in list(vars(cls).items()):
+        if not isinstance(attr, types.FunctionType):
+            continue
+        if name.startswith('__') or inspect.isgeneratorfunction(attr):
+            continue
+        setattr(cls, name, _traced(name, attr, not name.startswith('_')))
+    return cls
@@ -0,0 +1,385 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Offline benchmark of EMCViPRDriverCommon.
+
+Runs the driver of this working tree against an in-memory ViPR model
+(fake_vipr) through an in-process viprcli stand-in (fake_viprcli), and
+reports the wall time and the number of ViPR REST calls of volume create,
+attach, second attach from a host, detach, consistency group snapshot,
+stats refresh and write-behind tagging. Cinder must be installed; the ViPR
+driver is taken from this tree, not from Cinder.
+
+    python util/benchmark_driver.py --volumes 10000 --hosts 2000 \\
+        --export-groups 1000 --latency-ms 2 --json after.json \\
+        --compare before.json
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import fake_vipr
+import fake_viprcli
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir)
+
+SCENARIOS = ('create', 'attach', 'reattach', 'detach', 'cgsnapshot',
+             'stats', 'tagwrite')
+
+VOLUME_TYPE = {'id': 'bench-type',
+               'name': 'bench',
+               'extra_specs': {'ViPR:VPOOL': 'vpool1'}}
+
+
+def import_driver():
+    """Makes cinder.volume.drivers.emc.vipr resolve to this tree."""
+    from cinder.volume.drivers import emc
+    emc.__path__.insert(0, os.path.join(REPO_ROOT, 'cinder', 'volume',
+                                        'drivers', 'emc'))
+
+
+def use_volume_type(volume_type=VOLUME_TYPE):
+    """Gives every volume volume_type; there is no Cinder database here."""
+    from cinder.volume import volume_types
+    volume_types.get_volume_type = lambda ctxt, type_id: volume_type
+    volume_types.get_all_types = \
+        lambda ctxt: {volume_type['name']: volume_type}
+
+
+class Configuration(object):
+    """Backend configuration with the defaults of the given options."""
+
+    def __init__(self, **overrides):
+        self.volume_backend_name = None
+        self._overrides = overrides
+
+    def append_config_values(self, opts):
+        for opt in opts:
+            if hasattr(self, opt.dest):
+                continue
+            value = self._overrides.get(opt.dest, opt.default)
+            if isinstance(value, str) and opt.type is not None:
+                # values given with --option
+                value = opt.type(value)
+            setattr(self, opt.dest, value)
+
+    def safe_get(self, name):
+        return getattr(self, name, None)
+
+
+class Resource(dict):
+    """A Cinder volume, snapshot or group: indexable, with attributes."""
+
+    def __init__(self, **fields):
+        super(Resource, self).__init__(fields)
+        self.__dict__.update(fields)
+
+
+class _GroupDB(object):
+
+    def __init__(self):
+        self.groups = {}
+
+    def consistencygroup_get(self, ctxt, cg_id):
+        return self.groups[cg_id]
+
+
+class BenchDriver(object):
+    """What EMCViPRDriverCommon needs from the Cinder driver it serves."""
+
+    def __init__(self):
+        self.db = _GroupDB()
+
+
+def new_volume(prefix):
+    vol_id = str(uuid.uuid4())
+    return Resource(id=vol_id,
+                    name='volume-' + vol_id,
+                    display_name='%s-%s' % (prefix, vol_id[:8]),
+                    size=1,
+                    volume_type_id=VOLUME_TYPE['id'],
+                    consistencygroup_id=None,
+                    provider_auth=None)
+
+
+def fc_connector(number):
+    ports = [fake_vipr._wwn('1000', number * 2 + i) for i in range(2)]
+    nodes = [fake_vipr._wwn('2000', number * 2 + i) for i in range(2)]
+    return {'host': 'bench-new-%05d' % number, 'nodes': nodes,
+            'ports': ports}
+
+
+def known_connector(model, host):
+    initiators = [i for i in model.initiators.values()
+                  if i['host']['id'] == host['id']]
+    return {'host': host['name'],
+            'nodes': [i['initiator_node'] for i in initiators],
+            'ports': [i['initiator_port'] for i in initiators]}
+
+
+class Benchmark(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.model = fake_vipr.FakeViPR(latency=args.latency_ms / 1000.0)
+        self.model.populate(volumes=args.volumes, hosts=args.hosts,
+                            export_groups=args.export_groups)
+        fake_viprcli.install(self.model)
+        import_driver()
+
+        from cinder.volume.drivers.emc.vipr import common as vipr_common
+        use_volume_type()
+
+        # the tag journal and the id index of a run start empty
+        self.state_dir = tempfile.mkdtemp(prefix='vipr-bench-')
+        config = Configuration(
+            vipr_cookiedir=self.state_dir,
+            vipr_hostname='vipr.bench', vipr_port=4443,
+            vipr_username=self.model.username,
+            vipr_password=self.model.password,
+            vipr_tenant=self.model.tenant['name'],
+            vipr_project=self.model.project['name'],
+            vipr_varray=self.model.default_varray()['name'],
+            vipr_stats_refresh_interval=0,
+            vipr_device_info_initial_delay=0.1)
+        for item in args.option or []:
+            (name, _sep, value) = item.partition('=')
+            config._overrides[name] = value
+        self.common = vipr_common.EMCViPRDriverCommon(
+            'FC', 'EMCViPRFCDriver', config)
+        fake_viprcli.attach(self.common.rest_client, self.model)
+        self.common.check_for_setup_error()
+        self.driver = BenchDriver()
+        self.attached = []
+        self.created = []
+
+    def run(self):
+        results = {}
+        for name in SCENARIOS:
+            if name in self.args.skip:
+                continue
+            setup = getattr(self, 'setup_' + name, None)
+            if setup is not None:
+                setup()
+            self.model.reset_counters()
+            timings = []
+            start = time.time()
+            for i in range(self.args.ops):
+                op_start = time.time()
+                getattr(self, 'op_' + name)(i)
+                timings.append(time.time() - op_start)
+            wall = time.time() - start
+            calls = self.model.call_count()
+            results[name] = {
+                'ops': self.args.ops,
+                'wall_seconds': round(wall, 3),
+                'mean_op_ms': round(1000.0 * wall / self.args.ops, 2),
+                'max_op_ms': round(1000.0 * max(timings), 2),
+                'rest_calls': calls,
+                'rest_calls_per_op': round(float(calls) / self.args.ops, 2),
+                'endpoints': dict(self.model.calls)}
+        return results
+
+    def op_create(self, i):
+        vol = new_volume('bench-create')
+        self.common.create_volume(vol, self.driver)
+        self.common.set_volume_tags(vol, ['_obj_volume_type'])
+        self.created.append(vol)
+
+    def op_attach(self, i):
+        vol = self.created[i % len(self.created)]
+        # every other attach goes to a host ViPR already has a group for
+        hosts = sorted((h for h in self.model.hosts.values()
+                        if h['name'].startswith('bench-host-')),
+                       key=lambda h: h['name'])
+        if i % 2 == 0 and i // 2 < min(len(hosts), self.args.export_groups):
+            connector = known_connector(self.model, hosts[i // 2])
+        else:
+            connector = fc_connector(i)
+        self.common.initialize_connection(vol, 'FC', connector['nodes'],
+                                          connector['ports'],
+                                          connector['host'])
+        self.attached.append((vol, connector))
+
+    def op_reattach(self, i):
+        # a new host gets an export group on its first attach; the second
+        # attach has to find that group without listing export groups
+        connector = fc_connector(self.args.ops + i)
+        for n in range(2):
+            vol = self.created[(i + n) % len(self.created)]
+            listed = self.model.calls['GET /block/exports/search']
+            self.common.initialize_connection(vol, 'FC', connector['nodes'],
+                                              connector['ports'],
+                                              connector['host'])
+        if self.model.calls['GET /block/exports/search'] != listed:
+            raise RuntimeError('the second attach from %s listed the export '
+                               'groups' % connector['host'])
+
+    def op_detach(self, i):
+        (vol, connector) = self.attached[i % len(self.attached)]
+        self.common.terminate_connection(vol, 'FC', connector['nodes'],
+                                         connector['ports'],
+                                         connector['host'])
+
+    def op_cgsnapshot(self, i):
+        members = self.created[:self.args.cg_volumes]
+        cg_id = str(uuid.uuid4())
+        name = 'bench-cg-%d' % i
+        self.model.add_cg(name, [self.model.find_by_name(
+            self.model.volumes, vol['display_name']) for vol in members])
+        self.driver.db.groups[cg_id] = {'id': cg_id, 'name': name}
+        cgsnapshot = Resource(id=str(uuid.uuid4()),
+                              name='bench-cgsnap-%d' % i,
+                              consistencygroup_id=cg_id)
+        snapshots = [Resource(id=str(uuid.uuid4()), volume_id=vol['id'],
+                              cgsnapshot_id=cgsnapshot['id'])
+                     for vol in members]
+        self.common.create_cgsnapshot(self.driver, None, cgsnapshot,
+                                      snapshots)
+        # members may only be in one group at a time
+        for vol in members:
+            self.model.find_by_name(self.model.volumes,
+                                    vol['display_name']).pop(
+                'consistency_group', None)
+
+    def op_stats(self, i):
+        self.common.update_volume_stats()
+
+    def setup_tagwrite(self):
+        if self.common.tag_writer is None:
+            # runs last, so the other scenarios keep tagging inline
+            self.common.configuration.vipr_tag_write_interval = 1
+            self.common._start_tag_writer()
+
+    def op_tagwrite(self, i):
+        vol = new_volume('bench-tagwrite')
+        self.common.create_volume(vol, self.driver)
+        self.common.set_volume_tags(vol, ['_obj_volume_type'])
+        vipr_vol = self.model.find_by_name(self.model.volumes,
+                                           vol['display_name'])
+        if i % 2 == 0:
+            # a lookup that misses the caches flushes the pending write
+            # before it searches by tag
+            self.common._forget_vipr_resource('volume', vol['id'])
+            resolved = self.common._resolve_vipr_volume(vol['id'])
+            if resolved is None or resolved[1] != vipr_vol['id']:
+                raise RuntimeError('volume %s was not found by its tag '
+                                   'after a flush' % vol['display_name'])
+        else:
+            # left to the background writer
+            writer = self.common.tag_writer
+            deadline = time.time() + 10 * writer.interval + 5
+            while writer.journal.get(vol['id']) is not None:
+                if time.time() > deadline:
+                    raise RuntimeError('the tags of %s were not written' %
+                                       vol['display_name'])
+                eventlet.sleep(writer.interval / 2)
+        if 'OpenStack:id:' + vol['id'] not in vipr_vol['tags']:
+            raise RuntimeError('volume %s is not tagged' %
+                               vol['display_name'])
+
+    def close(self):
+        if self.common.tag_writer is not None:
+            self.common.tag_writer.stop()
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+def print_report(results, baseline=None):
+    header = '%-11s %5s %10s %10s %10s %10s' % (
+        'scenario', 'ops', 'wall s', 'ms/op', 'calls', 'calls/op')
+    if baseline:
+        header += ' %12s %10s' % ('calls/op +-', 'ms/op +-')
+    print(header)
+    for name in SCENARIOS:
+        if name not in results:
+            continue
+        r = results[name]
+        line = '%-11s %5d %10.3f %10.2f %10d %10.2f' % (
+            name, r['ops'], r['wall_seconds'], r['mean_op_ms'],
+            r['rest_calls'], r['rest_calls_per_op'])
+        base = (baseline or {}).get(name)
+        if base:
+            line += ' %+12.2f %+10.2f' % (
+                r['rest_calls_per_op'] - base['rest_calls_per_op'],
+                r['mean_op_ms'] - base['mean_op_ms'])
+        print(line)
+
+    for name in SCENARIOS:
+        if name not in results:
+            continue
+        print('\n%s, calls per endpoint:' % name)
+        endpoints = results[name]['endpoints']
+        for endpoint in sorted(endpoints, key=endpoints.get, reverse=True):
+            print('  %7d  %s' % (endpoints[endpoint], endpoint))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Offline benchmark of the ViPR Cinder driver')
+    parser.add_argument('--volumes', type=int, default=1000,
+                        help='volumes in the ViPR inventory')
+    parser.add_argument('--hosts', type=int, default=200,
+                        help='hosts in the ViPR inventory')
+    parser.add_argument('--export-groups', type=int, default=100,
+                        help='export groups in the ViPR inventory, one '
+                             'host each')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='time each REST call takes')
+    parser.add_argument('--ops', type=int, default=10,
+                        help='operations per scenario')
+    parser.add_argument('--cg-volumes', type=int, default=4,
+                        help='volumes per consistency group snapshot')
+    parser.add_argument('--skip', action='append', default=[],
+                        choices=SCENARIOS, help='scenario not to run')
+    parser.add_argument('--option', action='append',
+                        help='driver option as name=value, e.g. '
+                             'vipr_id_index=True')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare',
+                        help='results file of an earlier run to compare to')
+    args = parser.parse_args()
+    if args.ops < 1:
+        parser.error('--ops must be at least 1')
+
+    benchmark = Benchmark(args)
+    try:
+        results = benchmark.run()
+    finally:
+        benchmark.close()
+    report = {'parameters': vars(args), 'time': time.time(),
+              'results': results}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,381 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Boot storm load generator for the FC, iSCSI and ScaleIO drivers.
+
+For each driver, starts a ViPR stand-in process (vipr_standin), creates
+one volume per instance and then attaches all of them at once from
+--concurrency greenthreads, with the connectors nova sends, and detaches
+them again. It reports the p50/p95/p99 latency and the throughput of
+every phase, the ViPR REST calls per operation and the LUN collisions
+the stand-in saw. The instances are spread over --backends driver
+instances that share the compute hosts, as several cinder-volume
+services of one ViPR do; that is what makes their LUN choices collide.
+Cinder must be installed; the ViPR driver is taken from this tree.
+
+    python util/boot_storm.py --instances 500 --compute-hosts 50 \\
+        --concurrency 200 --latency lognormal:0.03,0.6 --json after.json \\
+        --compare before.json
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import importlib
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+from six.moves import urllib
+
+import benchmark_driver
+import fake_vipr
+import fake_viprcli
+import vipr_standin
+
+UTIL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# driver name: (stand-in protocol, module, class)
+DRIVERS = (
+    ('fc', ('FC', 'fc', 'EMCViPRFCDriver')),
+    ('iscsi', ('iSCSI', 'iscsi', 'EMCViPRISCSIDriver')),
+    ('scaleio', ('ScaleIO', 'scaleio', 'EMCViPRScaleIODriver')))
+
+PHASES = ('create', 'attach', 'detach')
+
+PERCENTILES = (50, 95, 99)
+
+# initiator numbers of the compute hosts ViPR does not know yet
+NEW_HOST_BASE = 1 << 20
+
+
+def connector(index, known):
+    """The connector nova sends from compute host index.
+
+    A known host is inventory host index of the stand-in, with the
+    initiators populate gave it; any other host is new to ViPR.
+    """
+    if known:
+        (name, number) = ('bench-host-%05d' % index, index * 2)
+    else:
+        (name, number) = ('storm-host-%05d' % index,
+                          NEW_HOST_BASE + index * 2)
+    wwpns = [fake_vipr._wwn('2100', number + i) for i in range(2)]
+    wwnns = [fake_vipr._wwn('2000', number + i) for i in range(2)]
+    return {'host': name,
+            'ip': fake_vipr._sdc_ip(number),
+            'initiator': 'iqn.1993-08.org.debian:01:bench%08x' % number,
+            'wwpns': [wwn.replace(':', '').lower() for wwn in wwpns],
+            'wwnns': [wwn.replace(':', '').lower() for wwn in wwnns],
+            'multipath': False,
+            'platform': 'x86_64',
+            'os_type': 'linux2'}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of the sorted list values."""
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=UTIL_DIR,
+            stderr=open(os.devnull, 'w')).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Standin(object):
+    """A vipr_standin process, or the stand-in already running at url."""
+
+    def __init__(self, args, protocol):
+        self.process = None
+        if args.url:
+            self.url = args.url.rstrip('/')
+            return
+        port = free_port()
+        command = [sys.executable, os.path.join(UTIL_DIR, 'vipr_standin.py'),
+                   '--port', str(port)]
+        command += vipr_standin.model_argv(args, protocol=protocol)
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        # the stand-in prints its address once it serves
+        if not self.process.stdout.readline():
+            raise RuntimeError('The ViPR stand-in did not start: %s' %
+                               ' '.join(command))
+        self.url = 'https://127.0.0.1:%d' % port
+
+    def stats(self):
+        return requests.get(self.url + '/standin/stats', verify=False).json()
+
+    def reset(self):
+        requests.post(self.url + '/standin/reset', verify=False)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+
+def make_driver(args, name, url, index):
+    (protocol, module_name, class_name) = dict(DRIVERS)[name]
+    parsed = urllib.parse.urlsplit(url)
+    config = benchmark_driver.Configuration(
+        vipr_hostname=parsed.hostname, vipr_port=parsed.port,
+        vipr_username=args.username, vipr_password=args.password,
+        vipr_tenant=args.tenant, vipr_project=args.project,
+        vipr_varray=args.varray,
+        vipr_stats_refresh_interval=0,
+        vipr_device_info_initial_delay=0.1,
+        vipr_scaleio_rest_gateway_ip=parsed.hostname,
+        vipr_scaleio_rest_gateway_port=str(parsed.port),
+        vipr_scaleio_rest_server_username=args.username,
+        vipr_scaleio_rest_server_password=args.password,
+        scaleio_verify_server_certificate='False')
+    for item in args.option or []:
+        (option, _sep, value) = item.partition('=')
+        config._overrides[option] = value
+    config.volume_backend_name = 'storm-%s-%d' % (name, index)
+
+    module = importlib.import_module('cinder.volume.drivers.emc.vipr.' +
+                                     module_name)
+    driver = getattr(module, class_name)(
+        configuration=config, db=benchmark_driver.BenchDriver().db,
+        host='storm@' + config.volume_backend_name)
+    if name == 'scaleio':
+        # the SDC version comes from drv_cfg on a real compute host
+        driver._get_scaleio_version = lambda: args.scaleio_version
+    return driver
+
+
+def driver_retries(drivers):
+    return sum(sum(driver.common.retry_policy.counters()['retries'].values())
+               for driver in drivers)
+
+
+class Storm(object):
+    """One boot storm against one driver."""
+
+    def __init__(self, args, name):
+        self.args = args
+        self.name = name
+
+    def run(self):
+        args = self.args
+        standin = Standin(args, dict(DRIVERS)[self.name][0])
+        try:
+            drivers = [make_driver(args, self.name, standin.url, k)
+                       for k in range(args.backends)]
+            volumes = [benchmark_driver.new_volume('storm-' + self.name)
+                       for i in range(args.instances)]
+            known = min(args.compute_hosts - args.new_hosts, args.hosts)
+            connectors = [connector(k, k < known)
+                          for k in range(args.compute_hosts)]
+
+            def backend(i):
+                # every host gets instances from every backend
+                return drivers[(i // len(connectors)) % len(drivers)]
+
+            def host(i):
+                return connectors[i % len(connectors)]
+
+            jobs = {
+                'create': lambda i: backend(i).create_volume(volumes[i]),
+                'attach': lambda i: backend(i).initialize_connection(
+                    volumes[i], host(i)),
+                'detach': lambda i: backend(i).terminate_connection(
+                    volumes[i], host(i))}
+            return dict((phase, self.phase(standin, drivers, jobs[phase]))
+                        for phase in PHASES)
+        finally:
+            standin.stop()
+
+    def phase(self, standin, drivers, job):
+        timings = []
+        errors = []
+
+        def timed(i):
+            start = time.time()
+            try:
+                job(i)
+            except Exception as e:
+                # driver errors carry their stack trace after the message
+                lines = str(e).strip().splitlines()
+                errors.append(lines[0] if lines else type(e).__name__)
+                return
+            timings.append(time.time() - start)
+
+        standin.reset()
+        retries_before = driver_retries(drivers)
+        pool = eventlet.GreenPool(self.args.concurrency or
+                                  self.args.instances)
+        start = time.time()
+        for i in range(self.args.instances):
+            pool.spawn_n(timed, i)
+        pool.waitall()
+        wall = time.time() - start
+        counters = standin.stats()
+
+        timings.sort()
+        ops = self.args.instances
+        result = {'ops': ops,
+                  'errors': len(errors),
+                  'error_samples': sorted(set(errors))[:3],
+                  'wall_seconds': round(wall, 3),
+                  'throughput_per_s': round(len(timings) / wall, 2),
+                  'mean_ms': round(1000.0 * sum(timings) / len(timings), 2)
+                  if timings else None,
+                  'max_ms': round(1000.0 * timings[-1], 2)
+                  if timings else None,
+                  'rest_calls': counters['total_calls'],
+                  'rest_calls_per_op': round(
+                      float(counters['total_calls']) / ops, 2),
+                  'lun_collisions': counters['lun_collisions'],
+                  'injected_errors': counters['injected_errors'],
+                  'driver_retries': driver_retries(drivers) - retries_before,
+                  'endpoints': counters['calls']}
+        for pct in PERCENTILES:
+            value = percentile(timings, pct)
+            result['p%d_ms' % pct] = round(1000.0 * value, 2) \
+                if value is not None else None
+        return result
+
+
+def _ms(value):
+    return '%10.1f' % value if value is not None else '%10s' % '-'
+
+
+def print_report(results, baseline=None):
+    header = '%-8s %-7s %5s %5s %8s %10s %10s %10s %9s %8s' % (
+        'driver', 'phase', 'ops', 'err', 'ops/s', 'p50 ms', 'p95 ms',
+        'p99 ms', 'calls/op', 'LUN coll')
+    if baseline:
+        header += ' %10s %10s' % ('p95 +-', 'calls/op +-')
+    print(header)
+    for name, _spec in DRIVERS:
+        for phase in PHASES:
+            r = results.get(name, {}).get(phase)
+            if r is None:
+                continue
+            line = '%-8s %-7s %5d %5d %8.2f %s %s %s %9.2f %8d' % (
+                name, phase, r['ops'], r['errors'], r['throughput_per_s'],
+                _ms(r['p50_ms']), _ms(r['p95_ms']), _ms(r['p99_ms']),
+                r['rest_calls_per_op'], r['lun_collisions'])
+            base = (baseline or {}).get(name, {}).get(phase)
+            if base:
+                if r['p95_ms'] is not None and base['p95_ms'] is not None:
+                    line += ' %+10.1f' % (r['p95_ms'] - base['p95_ms'])
+                else:
+                    line += ' %10s' % '-'
+                line += ' %+10.2f' % (r['rest_calls_per_op'] -
+                                      base['rest_calls_per_op'])
+            print(line)
+
+    for name, _spec in DRIVERS:
+        for phase in PHASES:
+            r = results.get(name, {}).get(phase)
+            if r and r['error_samples']:
+                print('\n%s %s, errors:' % (name, phase))
+                for error in r['error_samples']:
+                    print('  ' + error)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Boot storm load generator for the ViPR Cinder drivers')
+    parser.add_argument('--driver', action='append',
+                        choices=[name for name, _spec in DRIVERS],
+                        help='driver to load; repeat for more (default: '
+                             'all)')
+    parser.add_argument('--instances', type=int, default=100,
+                        help='instances booting, one volume each')
+    parser.add_argument('--concurrency', type=int,
+                        help='greenthreads calling the driver at once '
+                             '(default: one per instance)')
+    parser.add_argument('--compute-hosts', type=int, default=20,
+                        help='compute hosts the instances are spread over')
+    parser.add_argument('--new-hosts', type=int, default=5,
+                        help='compute hosts not yet known to ViPR')
+    parser.add_argument('--backends', type=int, default=2,
+                        help='driver instances per driver sharing the '
+                             'compute hosts')
+    parser.add_argument('--scaleio-version', default='R2_0',
+                        help='SDC version the ScaleIO driver sees')
+    parser.add_argument('--url',
+                        help='stand-in to use, e.g. https://127.0.0.1:4443; '
+                             'by default one is started per driver')
+    parser.add_argument('--option', action='append',
+                        help='driver option as name=value, e.g. '
+                             'vipr_max_concurrent_mutations=8')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare',
+                        help='results file of an earlier run to compare to')
+    vipr_standin.add_model_arguments(parser)
+    # viprcli resolves names by listing, so calls per operation grow with
+    # the inventory; keep the default run short
+    parser.set_defaults(volumes=100, hosts=50, export_groups=25,
+                        latency='lognormal:0.02,0.5',
+                        task_duration='uniform:0.2,1', seed=1)
+    args = parser.parse_args()
+    if args.instances < 1 or args.compute_hosts < 1 or args.backends < 1:
+        parser.error('--instances, --compute-hosts and --backends must be '
+                     'at least 1')
+
+    # the stand-in's certificate is self-signed
+    requests.packages.urllib3.disable_warnings()
+    # the driver imports viprcli; requests reach the stand-in over HTTPS
+    fake_viprcli.install(None)
+    benchmark_driver.import_driver()
+    benchmark_driver.use_volume_type(dict(
+        benchmark_driver.VOLUME_TYPE,
+        extra_specs={'ViPR:VPOOL': (args.vpool or ['vpool1'])[0]}))
+
+    results = {}
+    for name, _spec in DRIVERS:
+        if name in (args.driver or dict(DRIVERS)):
+            results[name] = Storm(args, name).run()
+    report = {'parameters': vars(args), 'revision': git_revision(),
+              'time': time.time(), 'results': results}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
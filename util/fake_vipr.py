@@ -0,0 +1,1126 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-memory model of the part of the ViPR REST API used by the driver.
+
+FakeViPR keeps tenants, projects, volumes, snapshots, consistency groups,
+export groups, hosts, initiators and tasks in dicts and answers REST
+requests on them through handle(). It also answers the two ScaleIO REST
+gateway calls of the ScaleIO driver: login and the SDC lookup by IP. It counts every request by method and
+URI template so the round trips of a driver operation can be compared
+between commits. It is shared by the offline benchmark, the HTTP
+stand-in and the attach load generator; none of them talk to a real
+ViPR.
+"""
+
+import base64
+import collections
+import json
+import math
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+
+from six.moves import urllib
+
+SDS_AUTH_TOKEN = 'X-SDS-AUTH-TOKEN'
+
+GB = 1073741824
+
+
+def urn(kind):
+    return 'urn:storageos:%s:%s:vdc1' % (kind, uuid.uuid4())
+
+
+def _wwn(prefix, number):
+    digits = '%s%012x' % (prefix, number)
+    return ':'.join(digits[i:i + 2] for i in range(0, 16, 2)).upper()
+
+
+def _sdc_ip(number):
+    return '10.%d.%d.%d' % ((number >> 16) & 255, (number >> 8) & 255,
+                            number & 255)
+
+
+def _sdc_id(ip):
+    """The ScaleIO SDC id of the host with the given IP address.
+
+    The model has an SDC on every address, so hosts need no registering
+    before the driver looks them up.
+    """
+    (number,) = struct.unpack('!I', socket.inet_aton(ip))
+    return '5dc0%012x' % number
+
+
+def _ref(rep):
+    return {'id': rep['id'], 'name': rep.get('name'),
+            'link': {'rel': 'self', 'href': rep.get('href', '')}}
+
+
+def _header(headers, name):
+    if not headers:
+        return None
+    lowered = name.lower()
+    for key in headers.keys():
+        if key.lower() == lowered:
+            return headers[key]
+    return None
+
+
+class Distribution(object):
+    """Random durations in seconds, parsed from a spec.
+
+    A spec is a plain number of seconds, or one of fixed:SECONDS,
+    uniform:LOW,HIGH, exponential:MEAN or lognormal:MEDIAN,SIGMA. A
+    lognormal with a sigma around 0.5 to 1 gives the long tail of a busy
+    appliance.
+    """
+
+    KINDS = {'fixed': 1, 'uniform': 2, 'exponential': 1, 'lognormal': 2}
+
+    def __init__(self, spec, rng=None):
+        self.spec = str(spec)
+        self.rng = rng or random.Random()
+        (kind, _sep, args) = self.spec.partition(':')
+        if not args:
+            (kind, args) = ('fixed', kind)
+        if kind not in self.KINDS:
+            raise ValueError('Unknown distribution: %s' % self.spec)
+        self.kind = kind
+        self.args = [float(arg) for arg in args.split(',')]
+        if len(self.args) != self.KINDS[kind]:
+            raise ValueError('%s takes %d parameters: %s' %
+                             (kind, self.KINDS[kind], self.spec))
+
+    def sample(self):
+        if self.kind == 'fixed':
+            return self.args[0]
+        if self.kind == 'uniform':
+            return self.rng.uniform(self.args[0], self.args[1])
+        if self.kind == 'exponential':
+            if self.args[0] <= 0:
+                return 0.0
+            return self.rng.expovariate(1.0 / self.args[0])
+        if self.args[0] <= 0:
+            return 0.0
+        return self.rng.lognormvariate(math.log(self.args[0]), self.args[1])
+
+    def __str__(self):
+        return self.spec
+
+
+class _TaskReply(Exception):
+    """Ends a handler early with an accepted, already failed task."""
+
+    def __init__(self, reply):
+        super(_TaskReply, self).__init__()
+        self.reply = reply
+
+
+class ViPRError(Exception):
+    """An error answer, as ViPR sends it: HTTP status plus a JSON body."""
+
+    def __init__(self, status, description, code=1000):
+        super(ViPRError, self).__init__(description)
+        self.status = status
+        self.description = description
+        self.code = code
+
+    def body(self):
+        return {'code': self.code,
+                'retryable': self.status >= 500,
+                'description': self.description,
+                'details': self.description}
+
+
+class FakeViPR(object):
+    """Stateful ViPR REST model.
+
+    latency is how long every request takes before it is answered, as
+    seconds or a Distribution spec; endpoint_latency overrides it per
+    "<METHOD> <URI template>". Tasks finish task_duration after they are
+    submitted; 0 makes every task ready as soon as it is created.
+
+    Faults can be injected: error_rate of the requests are answered with
+    one of error_statuses. 429 and 503 are sent before the request is
+    acted on, other statuses after it, as a failing appliance would.
+    Tokens are rejected with 401 once they are token_lifetime seconds
+    old, and task_error_rate of the tasks fail because the resource is
+    busy. seed makes latencies and faults repeatable.
+    """
+
+    def __init__(self, username='root', password='ChangeMe',
+                 tenant='Provider Tenant', project='openstack',
+                 varray='varray1', vpools=('vpool1',), latency=0.0,
+                 task_duration=0.0, endpoint_latency=None, error_rate=0.0,
+                 error_statuses=(503,), token_lifetime=0,
+                 task_error_rate=0.0, seed=None):
+        self.username = username
+        self.password = password
+        self.rng = random.Random(seed)
+        self.latency = Distribution(latency, self.rng)
+        self.endpoint_latency = dict(
+            (template, Distribution(spec, self.rng))
+            for template, spec in (endpoint_latency or {}).items())
+        self.task_duration = Distribution(task_duration, self.rng)
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.token_lifetime = token_lifetime
+        self.task_error_rate = task_error_rate
+
+        self._lock = threading.RLock()
+        self.tokens = {}
+        self.calls = collections.Counter()
+        self.lun_collisions = 0
+        self.injected_errors = 0
+        self.expired_tokens = 0
+        self.failed_tasks = 0
+
+        self.tenant = {'id': urn('TenantOrg'), 'name': tenant}
+        self.project = {'id': urn('Project'), 'name': project,
+                        'tenant': {'id': self.tenant['id']}}
+        self.projects = {self.project['id']: self.project}
+        varray_rep = {'id': urn('VirtualArray'), 'name': varray}
+        self.varrays = {varray_rep['id']: varray_rep}
+        self.vpools = collections.OrderedDict()
+        for name in vpools:
+            vpool = {'id': urn('VirtualPool'), 'name': name, 'type': 'block',
+                     'free_gb': 500000, 'used_gb': 0, 'provisioned_gb': 0}
+            self.vpools[vpool['id']] = vpool
+
+        # ordered, so searches list resources in creation order and the
+        # call counts of name lookups do not change from run to run
+        self.volumes = collections.OrderedDict()
+        self.snapshots = collections.OrderedDict()
+        self.cgs = collections.OrderedDict()
+        self.exports = collections.OrderedDict()
+        self.hosts = collections.OrderedDict()
+        self.initiators = collections.OrderedDict()
+        self.tasks = collections.OrderedDict()
+
+        self.fc_targets = [{'id': urn('StoragePort'),
+                            'port': _wwn('5006016', i),
+                            'ip_address': None, 'tcp_port': None}
+                           for i in range(4)]
+        self.iscsi_targets = [{'id': urn('StoragePort'),
+                               'port': 'iqn.1992-04.com.emc:cx.fake.a%d' % i,
+                               'ip_address': '10.0.0.%d' % (10 + i),
+                               'tcp_port': '3260'}
+                              for i in range(2)]
+        self.scaleio_targets = [{'id': urn('StoragePort'),
+                                 'port': 'scaleio-sds-%d' % i,
+                                 'ip_address': '10.0.1.%d' % (10 + i),
+                                 'tcp_port': '7072'}
+                                for i in range(2)]
+
+        self._routes = []
+        self._add_routes()
+
+    # ---- inventory ----
+
+    def default_varray(self):
+        return list(self.varrays.values())[0]
+
+    def default_vpool(self):
+        return list(self.vpools.values())[0]
+
+    def populate(self, volumes=0, hosts=0, export_groups=0,
+                 volumes_per_group=16, initiators_per_host=2,
+                 protocol='FC'):
+        """Adds an inventory of tagged volumes and of hosts exported to.
+
+        export_groups is capped at hosts since every group holds one
+        host; up to volumes_per_group of the volumes are exported through
+        each group. protocol is FC, iSCSI or ScaleIO; a ScaleIO initiator
+        is the SDC of the address _sdc_ip(number).
+        """
+        with self._lock:
+            created = []
+            for i in range(volumes):
+                vol = self._new_volume('bench-vol-%06d' % i, GB,
+                                       self.default_vpool()['id'])
+                vol['tags'].append('OpenStack:id:%s' % uuid.uuid4())
+                created.append(vol)
+
+            host_reps = []
+            for i in range(hosts):
+                host = self._new_host('bench-host-%05d' % i)
+                for j in range(initiators_per_host):
+                    number = i * initiators_per_host + j
+                    if protocol == 'iSCSI':
+                        port = 'iqn.1993-08.org.debian:01:bench%08x' % number
+                    elif protocol == 'ScaleIO':
+                        port = _sdc_id(_sdc_ip(number))
+                    else:
+                        port = _wwn('2100', number)
+                    self._new_initiator(host, protocol, port, port)
+                host_reps.append(host)
+
+            pending = iter(created)
+            for host in host_reps[:export_groups]:
+                group = self._new_export('%sSG-BENCH' % host['name'],
+                                         host)
+                for lun in range(1, volumes_per_group + 1):
+                    vol = next(pending, None)
+                    if vol is None:
+                        break
+                    group['volumes'].append({'id': vol['id'], 'lun': lun})
+            return created, host_reps
+
+    def find_by_name(self, table, name):
+        for rep in table.values():
+            if rep.get('name') == name and not rep.get('inactive'):
+                return rep
+        return None
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.lun_collisions = 0
+            self.injected_errors = 0
+            self.expired_tokens = 0
+            self.failed_tasks = 0
+
+    def counters(self):
+        with self._lock:
+            return {'calls': dict(self.calls),
+                    'total_calls': sum(self.calls.values()),
+                    'lun_collisions': self.lun_collisions,
+                    'injected_errors': self.injected_errors,
+                    'expired_tokens': self.expired_tokens,
+                    'failed_tasks': self.failed_tasks,
+                    'pending_tasks': sum(
+                        1 for task in self.tasks.values()
+                        if task['state'] == 'pending'),
+                    'inventory': {
+                        'volumes': len(self.volumes),
+                        'snapshots': len(self.snapshots),
+                        'consistency_groups': len(self.cgs),
+                        'export_groups': len(self.exports),
+                        'hosts': len(self.hosts),
+                        'initiators': len(self.initiators)}}
+
+    def call_count(self):
+        return sum(self.calls.values())
+
+    # ---- request handling ----
+
+    def handle(self, method, uri, body=None, headers=None):
+        """Answers one REST request; returns (status, headers, text)."""
+        path, _sep, query = uri.partition('?')
+        params = dict((key, values[0]) for key, values in
+                      urllib.parse.parse_qs(query).items())
+
+        for route_method, pattern, template, handler, auth in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match is None:
+                continue
+            break
+        else:
+            template, handler, match, auth = path, None, None, False
+
+        endpoint = '%s %s' % (method, template)
+        with self._lock:
+            self.calls[endpoint] += 1
+            delay = self.endpoint_latency.get(endpoint, self.latency).sample()
+            fault = self._pick_fault()
+        if delay > 0:
+            time.sleep(delay)
+
+        if handler is None:
+            return self._answer(ViPRError(404, 'No resource at ' + path))
+        if auth and not self._authorized(headers):
+            return self._answer(ViPRError(401, 'Authentication required',
+                                          code=1001))
+        if fault in (429, 503):
+            return self._answer(ViPRError(fault, 'Injected fault: the '
+                                          'request was not processed'))
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            return self._answer(ViPRError(400, 'Malformed JSON body'))
+
+        try:
+            with self._lock:
+                result = handler(*match.groups(), params=params, body=data,
+                                 headers=headers)
+        except ViPRError as e:
+            return self._answer(e)
+        except _TaskReply as e:
+            result = (202, e.reply, {})
+        if fault is not None:
+            # acted on, but the answer is lost
+            return self._answer(ViPRError(fault, 'Injected fault after the '
+                                          'request was processed'))
+
+        if isinstance(result, tuple):
+            status, obj, extra = result
+        else:
+            status, obj, extra = 200, result, {}
+        response_headers = {'Content-Type': 'application/json'}
+        response_headers.update(extra)
+        text = json.dumps(obj) if obj is not None else ''
+        return status, response_headers, text
+
+    def _answer(self, error):
+        return (error.status, {'Content-Type': 'application/json'},
+                json.dumps(error.body()))
+
+    def _pick_fault(self):
+        if self.error_rate <= 0 or self.rng.random() >= self.error_rate:
+            return None
+        self.injected_errors += 1
+        return self.rng.choice(self.error_statuses)
+
+    def _authorized(self, headers):
+        token = _header(headers, SDS_AUTH_TOKEN)
+        if token is None:
+            # viprcli may send the token as a cookie instead
+            cookie = _header(headers, 'Cookie') or ''
+            for part in cookie.split(';'):
+                (name, _sep, value) = part.strip().partition('=')
+                if name == SDS_AUTH_TOKEN:
+                    token = value
+        return self._token_valid(token)
+
+    def _token_valid(self, token):
+        with self._lock:
+            issued = self.tokens.get(token)
+            if issued is None:
+                return False
+            if self.token_lifetime and \
+                    time.time() - issued > self.token_lifetime:
+                del self.tokens[token]
+                self.expired_tokens += 1
+                return False
+        return True
+
+    def _route(self, method, template, handler, auth=True):
+        regex = '^' + re.sub(r'\{\w+\}', '([^/]+)',
+                             template.replace('.', r'\.')) + '$'
+        self._routes.append((method, re.compile(regex), template, handler,
+                             auth))
+
+    def _add_routes(self):
+        r = self._route
+        r('GET', '/login', self.login, auth=False)
+        r('GET', '/logout', self.logout)
+        r('GET', '/user/whoami', self.whoami)
+        r('GET', '/tenant', self.get_tenant)
+        r('GET', '/tenants/{id}/subtenants', self.list_subtenants)
+        r('GET', '/tenants/{id}/projects', self.list_projects)
+        r('GET', '/projects/{id}', self.show_project)
+        r('GET', '/vdc/varrays', self.list_varrays)
+        r('GET', '/vdc/varrays/{id}', self.show_varray)
+        r('GET', '/block/vpools', self.list_vpools)
+        r('GET', '/block/vpools/{id}', self.show_vpool)
+        r('GET', '/block/vpools/{id}/varrays/{id}/capacity', self.capacity)
+        r('POST', '/vdc/tasks/bulk', self.bulk_tasks)
+        r('GET', '/vdc/tasks/{id}', self.show_task)
+
+        r('POST', '/block/volumes', self.create_volume)
+        r('GET', '/block/volumes/search', self.search_volumes)
+        r('GET', '/block/volumes/bulk', self.bulk_ids(self.volumes))
+        r('POST', '/block/volumes/bulk', self.bulk_show(self.volumes,
+                                                       'volume'))
+        r('GET', '/block/volumes/{id}', self.show(self.volumes))
+        r('POST', '/block/volumes/{id}/deactivate', self.delete_volume)
+        r('POST', '/block/volumes/{id}/expand', self.expand_volume)
+        r('GET', '/block/volumes/{id}/exports', self.volume_exports)
+        r('GET', '/block/volumes/{id}/tags', self.list_tags(self.volumes))
+        r('PUT', '/block/volumes/{id}/tags', self.put_tags(self.volumes))
+        r('POST', '/block/volumes/{id}/protection/snapshots',
+          self.snapshot_volume)
+        r('GET', '/block/volumes/{id}/protection/snapshots',
+          self.list_volume_snapshots)
+
+        r('GET', '/block/snapshots/search', self.search(self.snapshots))
+        r('GET', '/block/snapshots/bulk', self.bulk_ids(self.snapshots))
+        r('POST', '/block/snapshots/bulk', self.bulk_show(self.snapshots,
+                                                         'block_snapshot'))
+        r('GET', '/block/snapshots/{id}', self.show(self.snapshots))
+        r('POST', '/block/snapshots/{id}/deactivate', self.delete_snapshot)
+        r('GET', '/block/snapshots/{id}/tags', self.list_tags(self.snapshots))
+        r('PUT', '/block/snapshots/{id}/tags', self.put_tags(self.snapshots))
+
+        r('POST', '/block/consistency-groups', self.create_cg)
+        r('GET', '/block/consistency-groups/search', self.search(self.cgs))
+        r('GET', '/block/consistency-groups/bulk', self.bulk_ids(self.cgs))
+        r('POST', '/block/consistency-groups/bulk',
+          self.bulk_show(self.cgs, 'consistency_group'))
+        r('GET', '/block/consistency-groups/{id}', self.show(self.cgs))
+        r('PUT', '/block/consistency-groups/{id}', self.update_cg)
+        r('POST', '/block/consistency-groups/{id}/deactivate',
+          self.delete_cg)
+        r('GET', '/block/consistency-groups/{id}/tags',
+          self.list_tags(self.cgs))
+        r('PUT', '/block/consistency-groups/{id}/tags',
+          self.put_tags(self.cgs))
+        r('POST', '/block/consistency-groups/{id}/protection/snapshots',
+          self.snapshot_cg)
+        r('GET', '/block/consistency-groups/{id}/protection/snapshots',
+          self.list_cg_snapshots)
+
+        r('GET', '/block/exports', self.exports_for_initiators)
+        r('POST', '/block/exports', self.create_export)
+        r('GET', '/block/exports/search', self.search(self.exports))
+        r('GET', '/block/exports/{id}', self.show(self.exports))
+        r('PUT', '/block/exports/{id}', self.update_export)
+
+        r('GET', '/tenants/{id}/hosts', self.list_hosts)
+        r('POST', '/tenants/{id}/hosts', self.create_host)
+        r('GET', '/compute/hosts/search', self.search_hosts)
+        r('GET', '/compute/hosts/{id}', self.show(self.hosts))
+        r('POST', '/compute/hosts/{id}/initiators', self.create_initiator)
+        r('GET', '/compute/hosts/{id}/initiators', self.list_initiators)
+        r('GET', '/compute/initiators/search', self.search_initiators)
+        r('GET', '/compute/initiators/bulk', self.bulk_ids(self.initiators))
+        r('POST', '/compute/initiators/bulk',
+          self.bulk_show(self.initiators, 'initiator'))
+        r('GET', '/compute/initiators/{id}', self.show(self.initiators))
+
+        # ScaleIO REST gateway; it checks its own credentials
+        r('GET', '/api/login', self.scaleio_login, auth=False)
+        r('GET', '/api/types/Sdc/instances/getByIp::{ip}/',
+          self.scaleio_sdc_by_ip, auth=False)
+
+    # ---- helpers ----
+
+    def _get(self, table, uri, kind='Resource'):
+        rep = table.get(uri)
+        if rep is None or rep.get('inactive'):
+            raise ViPRError(404, '%s %s not found' % (kind, uri), code=1004)
+        return rep
+
+    def _resolve(self, table, value, kind):
+        """Accepts a URI or a name, as ViPR does for most references."""
+        if value in table:
+            return self._get(table, value, kind)
+        rep = self.find_by_name(table, value)
+        if rep is None:
+            raise ViPRError(400, 'Invalid %s: %s' % (kind, value),
+                            code=1008)
+        return rep
+
+    def _reject_if_busy(self, resource, name, listed=False):
+        """Fails task_error_rate of the tasks before they change anything."""
+        if self.task_error_rate <= 0 or \
+                self.rng.random() >= self.task_error_rate:
+            return
+        task = self._new_task(resource, name, 'rejected',
+                              'The resource %s is busy with another '
+                              'operation; try again later' % resource['id'])
+        reply = self._tasks([task]) if listed else self._task_rep(task)
+        raise _TaskReply(reply)
+
+    def _new_task(self, resource, name, description, error=None):
+        task = {'id': urn('Task'),
+                'op_id': str(uuid.uuid4()),
+                'name': name,
+                'description': description,
+                'resource': {'id': resource['id'],
+                             'name': resource.get('name')},
+                'start_time': int(time.time() * 1000),
+                'due': time.time() + self.task_duration.sample(),
+                'error': error,
+                'state': 'pending'}
+        self.tasks[task['id']] = task
+        return task
+
+    def _task_rep(self, task):
+        if task['state'] == 'pending' and time.time() >= task['due']:
+            if task['error']:
+                self.failed_tasks += 1
+                task['state'] = 'error'
+                task['message'] = task['error']
+                task['service_error'] = {'code': 1000,
+                                         'details': task['error']}
+            else:
+                task['state'] = 'ready'
+                task['message'] = 'Operation completed successfully'
+            task['end_time'] = int(time.time() * 1000)
+        rep = dict(task)
+        rep.pop('due')
+        rep.pop('error')
+        rep['link'] = {'rel': 'self', 'href': '/vdc/tasks/' + task['id']}
+        return rep
+
+    def _tasks(self, tasks):
+        return {'task': [self._task_rep(task) for task in tasks]}
+
+    def _new_volume(self, name, size, vpool_uri, cg=None):
+        vol = {'id': urn('Volume'),
+               'name': name,
+               'inactive': False,
+               'project': {'id': self.project['id']},
+               'tenant': {'id': self.tenant['id']},
+               'varray': {'id': self.default_varray()['id']},
+               'vpool': {'id': vpool_uri},
+               'provisioned_capacity_gb': '%.2f' % (float(size) / GB),
+               'requested_capacity_gb': '%.2f' % (float(size) / GB),
+               'wwn': uuid.uuid4().hex.upper(),
+               'tags': []}
+        if cg is not None:
+            vol['consistency_group'] = {'id': cg['id']}
+            cg['volumes'].append({'id': vol['id']})
+        self.volumes[vol['id']] = vol
+        vpool = self.vpools[vpool_uri]
+        vpool['free_gb'] -= float(size) / GB
+        vpool['used_gb'] += float(size) / GB
+        vpool['provisioned_gb'] += float(size) / GB
+        return vol
+
+    def _new_host(self, name):
+        host = {'id': urn('Host'), 'name': name, 'host_name': name,
+                'inactive': False, 'type': 'Other',
+                'tenant': {'id': self.tenant['id']}}
+        self.hosts[host['id']] = host
+        return host
+
+    def _new_initiator(self, host, protocol, node, port):
+        initiator = {'id': urn('Initiator'),
+                     'name': port,
+                     'inactive': False,
+                     'protocol': protocol,
+                     'initiator_node': node,
+                     'initiator_port': port,
+                     'hostname': host['name'],
+                     'host': {'id': host['id']}}
+        self.initiators[initiator['id']] = initiator
+        for group in self.exports.values():
+            if any(h['id'] == host['id'] for h in group['hosts']):
+                group['initiators'].append(self._initiator_ref(initiator))
+        return initiator
+
+    def _initiator_ref(self, initiator):
+        return {'id': initiator['id'],
+                'initiator_port': initiator['initiator_port'],
+                'initiator_node': initiator['initiator_node'],
+                'hostname': initiator['hostname'],
+                'protocol': initiator['protocol']}
+
+    def _new_export(self, name, host):
+        group = {'id': urn('ExportGroup'),
+                 'name': name,
+                 'inactive': False,
+                 'type': 'Host',
+                 'project': {'id': self.project['id']},
+                 'tenant': {'id': self.tenant['id']},
+                 'varray': {'id': self.default_varray()['id']},
+                 'hosts': [{'id': host['id'], 'name': host['name']}],
+                 'initiators': [self._initiator_ref(initiator)
+                                for initiator in self.initiators.values()
+                                if initiator['host']['id'] == host['id']
+                                and not initiator['inactive']],
+                 'volumes': []}
+        self.exports[group['id']] = group
+        return group
+
+    def _itls(self, group, volume_ids=None, ports=None):
+        itls = []
+        for exported in group['volumes']:
+            if volume_ids is not None and exported['id'] not in volume_ids:
+                continue
+            vol = self.volumes.get(exported['id'])
+            if vol is None:
+                continue
+            for initiator in group['initiators']:
+                if ports is not None and \
+                        initiator['initiator_port'] not in ports:
+                    continue
+                protocol = (initiator['protocol'] or '').lower()
+                if protocol == 'iscsi':
+                    targets = self.iscsi_targets
+                elif protocol == 'scaleio':
+                    targets = self.scaleio_targets[:1]
+                else:
+                    targets = self.fc_targets[:2]
+                for target in targets:
+                    itls.append({
+                        'hlu': exported['lun'],
+                        'initiator': {'id': initiator['id'],
+                                      'port': initiator['initiator_port']},
+                        'export': {'id': group['id'],
+                                   'name': group['name']},
+                        'device': {'id': vol['id'], 'wwn': vol['wwn']},
+                        'target': dict(target),
+                        'san_zone_name': None})
+        return itls
+
+    def _search(self, table, params):
+        """Answers ?project=, ?tag= and ?name= searches."""
+        resources = []
+        for rep in table.values():
+            if rep.get('inactive'):
+                continue
+            if 'project' in params:
+                if rep.get('project', {}).get('id') != params['project']:
+                    continue
+                match = rep['project']['id']
+            elif 'tag' in params:
+                if params['tag'] not in rep.get('tags', []):
+                    continue
+                match = params['tag']
+            elif 'name' in params:
+                if rep.get('name') != params['name']:
+                    continue
+                match = rep['name']
+            else:
+                raise ViPRError(400, 'A search parameter is required')
+            resources.append({'id': rep['id'], 'match': match,
+                              'link': {'rel': 'self', 'href': ''}})
+        return {'resource': resources}
+
+    # ---- generic handlers ----
+
+    def show(self, table):
+        def handler(uri, **kwargs):
+            return self._get(table, uri)
+        return handler
+
+    def search(self, table):
+        def handler(**kwargs):
+            return self._search(table, kwargs['params'])
+        return handler
+
+    def bulk_ids(self, table):
+        def handler(**kwargs):
+            return {'id': [uri for uri, rep in table.items()
+                           if not rep.get('inactive')]}
+        return handler
+
+    def bulk_show(self, table, key):
+        def handler(body=None, **kwargs):
+            uris = (body or {}).get('id', [])
+            return {key: [table[uri] for uri in uris if uri in table]}
+        return handler
+
+    def list_tags(self, table):
+        def handler(uri, **kwargs):
+            return {'tag': list(self._get(table, uri)['tags'])}
+        return handler
+
+    def put_tags(self, table):
+        def handler(uri, body=None, **kwargs):
+            rep = self._get(table, uri)
+            changes = body or {}
+            for tag in changes.get('remove') or []:
+                if tag in rep['tags']:
+                    rep['tags'].remove(tag)
+            for tag in changes.get('add') or []:
+                if tag not in rep['tags']:
+                    rep['tags'].append(tag)
+            return {'tag': list(rep['tags'])}
+        return handler
+
+    # ---- auth, tenant and catalog ----
+
+    def login(self, **kwargs):
+        auth = _header(kwargs['headers'], 'Authorization') or ''
+        if not auth.startswith('Basic '):
+            raise ViPRError(401, 'Authentication required', code=1001)
+        try:
+            decoded = base64.b64decode(auth[6:].encode('ascii'))
+            username, password = decoded.decode('utf-8').split(':', 1)
+        except (TypeError, ValueError):
+            raise ViPRError(401, 'Malformed credentials', code=1001)
+        if username != self.username or password != self.password:
+            raise ViPRError(401, 'Invalid credentials', code=1001)
+        token = uuid.uuid4().hex
+        self.tokens[token] = time.time()
+        return 200, {'user': username}, {
+            SDS_AUTH_TOKEN: token,
+            'Set-Cookie': '%s=%s; Path=/; Secure' % (SDS_AUTH_TOKEN, token)}
+
+    def logout(self, **kwargs):
+        self.tokens.pop(_header(kwargs['headers'], SDS_AUTH_TOKEN), None)
+        return {'user': self.username}
+
+    def whoami(self, **kwargs):
+        return {'common_name': self.username,
+                'tenant': self.tenant['id'],
+                'roles': ['SYSTEM_ADMIN']}
+
+    def get_tenant(self, **kwargs):
+        return {'id': self.tenant['id'], 'name': self.tenant['name']}
+
+    def list_subtenants(self, uri, **kwargs):
+        return {'subtenant': []}
+
+    def list_projects(self, uri, **kwargs):
+        return {'project': [_ref(project)
+                            for project in self.projects.values()
+                            if project['tenant']['id'] == uri]}
+
+    def show_project(self, uri, **kwargs):
+        return self._get(self.projects, uri, 'Project')
+
+    def list_varrays(self, **kwargs):
+        return {'varray': [_ref(varray) for varray in self.varrays.values()]}
+
+    def show_varray(self, uri, **kwargs):
+        return self._get(self.varrays, uri, 'VirtualArray')
+
+    def list_vpools(self, **kwargs):
+        return {'virtualpool': [_ref(vpool)
+                                for vpool in self.vpools.values()]}
+
+    def show_vpool(self, uri, **kwargs):
+        return self._get(self.vpools, uri, 'VirtualPool')
+
+    def capacity(self, vpool_uri, varray_uri, **kwargs):
+        vpool = self._get(self.vpools, vpool_uri, 'VirtualPool')
+        self._get(self.varrays, varray_uri, 'VirtualArray')
+        return {'free_gb': int(vpool['free_gb']),
+                'used_gb': int(vpool['used_gb']),
+                'provisioned_gb': int(vpool['provisioned_gb']),
+                'percent_used': 0,
+                'percent_subscribed': 0}
+
+    def show_task(self, uri, **kwargs):
+        return self._task_rep(self._get(self.tasks, uri, 'Task'))
+
+    def bulk_tasks(self, body=None, **kwargs):
+        uris = (body or {}).get('id', [])
+        return self._tasks([self.tasks[uri] for uri in uris
+                            if uri in self.tasks])
+
+    # ---- volumes and snapshots ----
+
+    def create_volume(self, body=None, **kwargs):
+        body = body or {}
+        project = self._get(self.projects, body.get('project'), 'Project')
+        if project is not self.project:
+            raise ViPRError(400, 'Unknown project')
+        self._get(self.varrays, body.get('varray'), 'VirtualArray')
+        vpool = self._get(self.vpools, body.get('vpool'), 'VirtualPool')
+        cg = None
+        if body.get('consistency_group'):
+            cg = self._get(self.cgs, body['consistency_group'],
+                           'BlockConsistencyGroup')
+        self._reject_if_busy(vpool, 'CREATE VOLUME', listed=True)
+        count = int(body.get('count', 1))
+        size = _parse_size(body.get('size'))
+        tasks = []
+        for i in range(count):
+            name = body['name'] if count == 1 else \
+                '%s-%d' % (body['name'], i + 1)
+            if self.find_by_name(self.volumes, name) is not None:
+                raise ViPRError(400, 'A volume with the name %s already '
+                                     'exists' % name, code=1005)
+            vol = self._new_volume(name, size, vpool['id'], cg)
+            tasks.append(self._new_task(vol, 'CREATE VOLUME',
+                                        'create volume'))
+        return 202, self._tasks(tasks), {}
+
+    def search_volumes(self, **kwargs):
+        return self._search(self.volumes, kwargs['params'])
+
+    def delete_volume(self, uri, **kwargs):
+        vol = self._get(self.volumes, uri, 'Volume')
+        self._reject_if_busy(vol, 'DELETE VOLUME')
+        for group in self.exports.values():
+            if any(v['id'] == uri for v in group['volumes']):
+                raise ViPRError(400, 'Volume %s is exported and can not be '
+                                     'deleted' % vol['name'], code=1023)
+        vol['inactive'] = True
+        return 202, self._task_rep(self._new_task(vol, 'DELETE VOLUME',
+                                                  'delete volume')), {}
+
+    def expand_volume(self, uri, body=None, **kwargs):
+        vol = self._get(self.volumes, uri, 'Volume')
+        self._reject_if_busy(vol, 'EXPAND VOLUME')
+        size = _parse_size((body or {}).get('new_size'))
+        vol['provisioned_capacity_gb'] = '%.2f' % (float(size) / GB)
+        return 202, self._task_rep(self._new_task(vol, 'EXPAND VOLUME',
+                                                  'expand volume')), {}
+
+    def volume_exports(self, uri, **kwargs):
+        self._get(self.volumes, uri, 'Volume')
+        itls = []
+        for group in self.exports.values():
+            if not group['inactive']:
+                itls.extend(self._itls(group, volume_ids=(uri,)))
+        return {'itl': itls}
+
+    def _new_snapshot(self, vol, name):
+        snap = {'id': urn('BlockSnapshot'),
+                'name': name,
+                'inactive': False,
+                'parent': {'id': vol['id'], 'name': vol['name']},
+                'project': {'id': self.project['id']},
+                'wwn': uuid.uuid4().hex.upper(),
+                'tags': []}
+        self.snapshots[snap['id']] = snap
+        return snap
+
+    def snapshot_volume(self, uri, body=None, **kwargs):
+        vol = self._get(self.volumes, uri, 'Volume')
+        self._reject_if_busy(vol, 'CREATE SNAPSHOT', listed=True)
+        name = (body or {}).get('name')
+        snap = self._new_snapshot(vol, name)
+        return 202, self._tasks([self._new_task(snap, 'CREATE SNAPSHOT',
+                                                'create snapshot')]), {}
+
+    def list_volume_snapshots(self, uri, **kwargs):
+        self._get(self.volumes, uri, 'Volume')
+        return {'snapshot': [_ref(snap) for snap in self.snapshots.values()
+                             if snap['parent']['id'] == uri
+                             and not snap['inactive']]}
+
+    def delete_snapshot(self, uri, **kwargs):
+        snap = self._get(self.snapshots, uri, 'BlockSnapshot')
+        self._reject_if_busy(snap, 'DELETE SNAPSHOT', listed=True)
+        snap['inactive'] = True
+        return 202, self._tasks([self._new_task(snap, 'DELETE SNAPSHOT',
+                                                'delete snapshot')]), {}
+
+    # ---- consistency groups ----
+
+    def create_cg(self, body=None, **kwargs):
+        body = body or {}
+        self._get(self.projects, body.get('project'), 'Project')
+        if self.find_by_name(self.cgs, body.get('name')) is not None:
+            raise ViPRError(400, 'Consistency group %s already exists' %
+                            body.get('name'), code=1005)
+        cg = self.add_cg(body['name'])
+        return cg
+
+    def add_cg(self, name, volumes=()):
+        cg = {'id': urn('BlockConsistencyGroup'),
+              'name': name,
+              'inactive': False,
+              'project': {'id': self.project['id']},
+              'tenant': {'id': self.tenant['id']},
+              'volumes': [],
+              'tags': []}
+        self.cgs[cg['id']] = cg
+        for vol in volumes:
+            vol['consistency_group'] = {'id': cg['id']}
+            cg['volumes'].append({'id': vol['id']})
+        return cg
+
+    def update_cg(self, uri, body=None, **kwargs):
+        cg = self._get(self.cgs, uri, 'BlockConsistencyGroup')
+        self._reject_if_busy(cg, 'UPDATE CG')
+        changes = (body or {}).get('volumes') or {}
+        for vol_uri in (changes.get('add') or {}).get('volume', []):
+            vol = self._get(self.volumes, vol_uri, 'Volume')
+            vol['consistency_group'] = {'id': uri}
+            cg['volumes'].append({'id': vol_uri})
+        for vol_uri in (changes.get('remove') or {}).get('volume', []):
+            vol = self._get(self.volumes, vol_uri, 'Volume')
+            vol.pop('consistency_group', None)
+            cg['volumes'] = [v for v in cg['volumes'] if v['id'] != vol_uri]
+        return 202, self._task_rep(self._new_task(cg, 'UPDATE CG',
+                                                  'update consistency '
+                                                  'group')), {}
+
+    def delete_cg(self, uri, **kwargs):
+        cg = self._get(self.cgs, uri, 'BlockConsistencyGroup')
+        self._reject_if_busy(cg, 'DELETE CG')
+        cg['inactive'] = True
+        return 202, self._task_rep(self._new_task(cg, 'DELETE CG',
+                                                  'delete consistency '
+                                                  'group')), {}
+
+    def snapshot_cg(self, uri, body=None, **kwargs):
+        cg = self._get(self.cgs, uri, 'BlockConsistencyGroup')
+        self._reject_if_busy(cg, 'CREATE CG SNAPSHOT', listed=True)
+        name = (body or {}).get('name')
+        tasks = []
+        for i, member in enumerate(cg['volumes']):
+            vol = self.volumes[member['id']]
+            snap = self._new_snapshot(vol, '%s-%d' % (name, i + 1))
+            snap['consistency_group'] = {'id': uri}
+            tasks.append(self._new_task(snap, 'CREATE CG SNAPSHOT',
+                                        'create consistency group '
+                                        'snapshot'))
+        return 202, self._tasks(tasks), {}
+
+    def list_cg_snapshots(self, uri, **kwargs):
+        self._get(self.cgs, uri, 'BlockConsistencyGroup')
+        return {'snapshot': [_ref(snap) for snap in self.snapshots.values()
+                             if snap.get('consistency_group', {}).get('id')
+                             == uri and not snap['inactive']]}
+
+    # ---- exports ----
+
+    def exports_for_initiators(self, **kwargs):
+        ports = set(kwargs['params'].get('initiators', '').split(','))
+        itls = []
+        for group in self.exports.values():
+            if not group['inactive']:
+                itls.extend(self._itls(group, ports=ports))
+        return {'itl': itls}
+
+    def create_export(self, body=None, **kwargs):
+        body = body or {}
+        self._get(self.projects, body.get('project'), 'Project')
+        self._get(self.varrays, body.get('varray'), 'VirtualArray')
+        if self.find_by_name(self.exports, body.get('name')) is not None:
+            raise ViPRError(400, 'Export group %s already exists' %
+                            body.get('name'), code=1005)
+        hosts = body.get('hosts') or []
+        if len(hosts) != 1:
+            raise ViPRError(400, 'Exactly one host is supported')
+        host = self._get(self.hosts, hosts[0], 'Host')
+        self._reject_if_busy(host, 'CREATE EXPORT')
+        group = self._new_export(body['name'], host)
+        return 202, self._task_rep(self._new_task(group, 'CREATE EXPORT',
+                                                  'create export group')), {}
+
+    def update_export(self, uri, body=None, **kwargs):
+        group = self._get(self.exports, uri, 'ExportGroup')
+        self._reject_if_busy(group, 'UPDATE EXPORT')
+        changes = (body or {}).get('volume_changes') or {}
+        error = None
+        used = dict((v['lun'], v['id']) for v in group['volumes'])
+        for added in changes.get('add') or []:
+            vol = self._get(self.volumes, added['id'], 'Volume')
+            lun = added.get('lun')
+            lun = int(lun) if lun not in (None, '', '-1') else None
+            if lun is not None and lun in used and used[lun] != vol['id']:
+                self.lun_collisions += 1
+                error = 'HLU %d is already in use by another volume in ' \
+                        'export group %s' % (lun, group['name'])
+                break
+            if lun is None:
+                lun = 1
+                while lun in used:
+                    lun += 1
+            group['volumes'] = [v for v in group['volumes']
+                                if v['id'] != vol['id']]
+            group['volumes'].append({'id': vol['id'], 'lun': lun})
+            used[lun] = vol['id']
+        removed = set(changes.get('remove') or [])
+        if removed and error is None:
+            group['volumes'] = [v for v in group['volumes']
+                                if v['id'] not in removed]
+        return 202, self._task_rep(self._new_task(group, 'UPDATE EXPORT',
+                                                  'update export group',
+                                                  error)), {}
+
+    # ---- hosts and initiators ----
+
+    def list_hosts(self, uri, **kwargs):
+        return {'host': [_ref(host) for host in self.hosts.values()
+                         if host['tenant']['id'] == uri
+                         and not host['inactive']]}
+
+    def create_host(self, uri, body=None, **kwargs):
+        body = body or {}
+        if self.find_by_name(self.hosts, body.get('name')) is not None:
+            raise ViPRError(400, 'Host %s already exists' %
+                            body.get('name'), code=1005)
+        host = self._new_host(body['name'])
+        return 202, self._task_rep(self._new_task(host, 'CREATE HOST',
+                                                  'create host')), {}
+
+    def search_hosts(self, **kwargs):
+        name = kwargs['params'].get('name')
+        return {'resource': [{'id': host['id'], 'match': host['name']}
+                             for host in self.hosts.values()
+                             if not host['inactive'] and
+                             name is not None and name in host['name']]}
+
+    def create_initiator(self, uri, body=None, **kwargs):
+        host = self._get(self.hosts, uri, 'Host')
+        self._reject_if_busy(host, 'ADD INITIATOR')
+        body = body or {}
+        port = body.get('initiator_port')
+        for initiator in self.initiators.values():
+            if initiator['initiator_port'] == port and \
+                    not initiator['inactive']:
+                raise ViPRError(400, 'Initiator %s already exists' % port,
+                                code=1005)
+        initiator = self._new_initiator(host, body.get('protocol'),
+                                        body.get('initiator_node'), port)
+        return 202, self._task_rep(self._new_task(initiator,
+                                                  'ADD INITIATOR',
+                                                  'add initiator')), {}
+
+    def list_initiators(self, uri, **kwargs):
+        self._get(self.hosts, uri, 'Host')
+        return {'initiator': [_ref(initiator)
+                              for initiator in self.initiators.values()
+                              if initiator['host']['id'] == uri
+                              and not initiator['inactive']]}
+
+    def search_initiators(self, **kwargs):
+        port = kwargs['params'].get('initiator_port')
+        return {'resource': [{'id': initiator['id'], 'match': port}
+                             for initiator in self.initiators.values()
+                             if initiator['initiator_port'] == port
+                             and not initiator['inactive']]}
+
+    # ---- ScaleIO REST gateway ----
+
+    def _gateway_credentials(self, headers):
+        """Returns (user, secret) of a Basic Authorization header."""
+        auth = _header(headers, 'Authorization') or ''
+        if not auth.startswith('Basic '):
+            return None, None
+        try:
+            decoded = base64.b64decode(auth[6:].encode('ascii'))
+            return tuple(decoded.decode('utf-8').split(':', 1))
+        except (TypeError, ValueError):
+            return None, None
+
+    def _gateway_error(self, status, message):
+        return status, {'message': message, 'httpStatusCode': status,
+                        'errorCode': 0}, {}
+
+    def scaleio_login(self, **kwargs):
+        (user, secret) = self._gateway_credentials(kwargs['headers'])
+        if user != self.username or secret != self.password:
+            return self._gateway_error(401, 'Unauthorized')
+        token = uuid.uuid4().hex
+        self.tokens[token] = time.time()
+        return token
+
+    def scaleio_sdc_by_ip(self, ip, **kwargs):
+        """Accepts the password, or a token from /api/login, as secret."""
+        (user, secret) = self._gateway_credentials(kwargs['headers'])
+        if user != self.username or (secret != self.password and
+                                     not self._token_valid(secret)):
+            return self._gateway_error(401, 'Unauthorized')
+        ip = urllib.parse.unquote(urllib.parse.unquote(ip))
+        try:
+            return _sdc_id(ip)
+        except (socket.error, struct.error):
+            return self._gateway_error(500, 'Could not find the SDC')
+
+
+def _parse_size(value):
+    if value is None:
+        raise ViPRError(400, 'size is required')
+    text = str(value).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': GB, 'T': 1024 * GB}
+    try:
+        if text[-2:] == 'GB':
+            text = text[:-1]
+        if text[-1:] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(float(text))
+    except ValueError:
+        raise ViPRError(400, 'Invalid size: %s' % value)
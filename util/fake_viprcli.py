@@ -0,0 +1,675 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process stand-in for the viprcli package, backed by a FakeViPR model.
+
+install() registers viprcli.common, volume, exportgroup, host,
+hostinitiators, project, snapshot, virtualarray, virtualpool,
+consistencygroup and tag in sys.modules, so the driver imports them
+instead of the real package. Like viprcli, every object method resolves
+names and submits work with REST calls through
+viprcli.common.service_json_request, which the driver routes to its own
+REST client; FakeViPRAdapter then answers those calls from the model
+without any network I/O. Only the calls the driver makes for volume
+create, delete and tagging, attach, detach, consistency group snapshots
+and stats are modelled; clone, expand and retype are not.
+"""
+
+import base64
+import json
+import sys
+import time
+import types
+
+import requests
+from requests import adapters as requests_adapters
+from requests import structures as requests_structures
+from six.moves import http_client
+from six.moves import urllib
+
+# seconds between two polls of a pending task, as in viprcli
+TASK_POLL_INTERVAL = 1
+
+_model = None
+
+
+def _common():
+    # looked up per call: the driver replaces service_json_request
+    return sys.modules['viprcli.common']
+
+
+def _request(ip_addr, port, method, uri, body=None):
+    common = _common()
+    (s, h) = common.service_json_request(ip_addr, port, method, uri, body)
+    return common.json_decode(s) if s else None
+
+
+def _body(params):
+    return json.dumps(params)
+
+
+class SOSError(Exception):
+
+    SOS_FAILURE_ERR = 1
+    CMD_LINE_ERR = 2
+    HTTP_ERR = 3
+    VALUE_ERR = 4
+    NOT_FOUND_ERR = 1
+    ENTRY_ALREADY_EXISTS_ERR = 5
+    MAX_COUNT_REACHED = 6
+
+    def __init__(self, err_code, err_text):
+        super(SOSError, self).__init__(err_text)
+        self.err_code = err_code
+        self.err_text = err_text
+
+    def __str__(self):
+        return repr(self.err_text)
+
+
+# ---- viprcli.common ----
+
+class _Common(object):
+    """Functions of viprcli.common; bound into the module by install()."""
+
+    COOKIE = None
+    _token = None
+
+    @staticmethod
+    def service_json_request(ip_addr, port, http_method, uri, body,
+                             token=None, xml=False,
+                             contenttype='application/json', filename=None,
+                             customheaders=None):
+        """Used when the driver's REST client has no credentials yet."""
+        if _Common._token is None:
+            credentials = '%s:%s' % (_model.username, _model.password)
+            auth = base64.b64encode(credentials.encode('utf-8'))
+            status, headers, text = _model.handle(
+                'GET', '/login', None,
+                {'Authorization': 'Basic ' + auth.decode('ascii')})
+            _Common._token = headers.get('X-SDS-AUTH-TOKEN')
+        status, headers, text = _model.handle(
+            http_method, uri, body,
+            {'X-SDS-AUTH-TOKEN': token or _Common._token})
+        if status not in (200, 202):
+            raise SOSError(SOSError.HTTP_ERR,
+                           "HTTP code: %d, %s [%s]" %
+                           (status, http_client.responses.get(status, ''),
+                            text))
+        return text, headers
+
+    @staticmethod
+    def json_decode(rsp):
+        try:
+            return json.loads(rsp)
+        except ValueError:
+            raise SOSError(SOSError.VALUE_ERR,
+                           "Failed to recognize JSON payload:\n[" + rsp + "]")
+
+    @staticmethod
+    def search_by_tag(resource_search_uri, ipAddr, port):
+        o = _request(ipAddr, port, 'GET', resource_search_uri)
+        return [resource['id'] for resource in (o or {}).get('resource', [])]
+
+    @staticmethod
+    def get_node_value(json_object, parent_node_name, child_node_name=None):
+        if not json_object or parent_node_name not in json_object:
+            return None
+        value = json_object[parent_node_name]
+        if child_node_name is not None:
+            return value.get(child_node_name)
+        return value
+
+    @staticmethod
+    def to_bytes(in_str):
+        units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+        in_str = in_str.strip().upper()
+        if in_str[-1:] in units:
+            return int(float(in_str[:-1]) * units[in_str[-1]])
+        return int(in_str)
+
+    @staticmethod
+    def format_json_object(obj):
+        return json.dumps(obj, indent=3)
+
+    @staticmethod
+    def get_parent_child_from_xpath(name):
+        if '/' not in name:
+            return None, name
+        return tuple(name.rsplit('/', 1))
+
+
+def _wait_for_tasks(ip_addr, port, result):
+    """Polls the tasks of an async answer until none is pending."""
+    if result is None:
+        return
+    tasks = result.get('task') if 'task' in result else [result]
+    for task in tasks:
+        while True:
+            o = _request(ip_addr, port, 'GET', '/vdc/tasks/' + task['id'])
+            if o['state'] == 'ready':
+                break
+            if o['state'] == 'error':
+                raise SOSError(SOSError.SOS_FAILURE_ERR,
+                               "Task: " + task['id'] +
+                               " is failed with error: " +
+                               str(o.get('message')))
+            time.sleep(TASK_POLL_INTERVAL)
+
+
+class _Base(object):
+
+    def __init__(self, ipAddr, port):
+        self._ipAddr = ipAddr
+        self._port = port
+
+    def _get(self, uri):
+        return _request(self._ipAddr, self._port, 'GET', uri)
+
+    def _send(self, method, uri, params=None):
+        return _request(self._ipAddr, self._port, method, uri,
+                        _body(params) if params is not None else None)
+
+    def _wait(self, result):
+        _wait_for_tasks(self._ipAddr, self._port, result)
+
+
+# ---- viprcli.project, virtualarray, virtualpool ----
+
+class Project(_Base):
+
+    def tenant_query(self, label):
+        root = self._get('/tenant')
+        if not label or label == root['name']:
+            return root['id']
+        o = self._get('/tenants/%s/subtenants' % root['id'])
+        for tenant in o.get('subtenant', []):
+            if tenant['name'] == label:
+                return tenant['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "Tenant " + label + ": not found")
+
+    def project_query(self, name):
+        (tenant, project) = _Common.get_parent_child_from_xpath(name)
+        tenant_uri = self.tenant_query(tenant)
+        o = self._get('/tenants/%s/projects' % tenant_uri)
+        for candidate in o.get('project', []):
+            if candidate['name'] == project:
+                return candidate['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "Project " + project + ": not found")
+
+
+class VirtualArray(_Base):
+
+    def varray_query(self, name):
+        if name.startswith('urn:'):
+            return name
+        for varray in self._get('/vdc/varrays').get('varray', []):
+            if varray['name'] == name:
+                return varray['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "varray " + name + ": not found")
+
+
+class VirtualPool(_Base):
+
+    def vpool_query(self, name, vpooltype):
+        if name.startswith('urn:'):
+            return name
+        o = self._get('/%s/vpools' % vpooltype)
+        for vpool in o.get('virtualpool', []):
+            if vpool['name'] == name:
+                return vpool['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "VPool " + name + " (" + vpooltype + ") : not found")
+
+
+# ---- viprcli.volume ----
+
+class Volume(_Base):
+
+    URI_VOLUMES = '/block/volumes'
+    URI_VOLUME = '/block/volumes/{0}'
+    URI_SEARCH_VOLUMES = '/block/volumes/search?project={0}'
+    URI_SEARCH_VOLUMES_BY_TAG = '/block/volumes/search?tag={0}'
+    URI_TAG_VOLUME = '/block/volumes/{0}/tags'
+    URI_VOLUME_EXPORTS = '/block/volumes/{0}/exports'
+    URI_DEACTIVATE = '/block/volumes/{0}/deactivate'
+    URI_EXPAND = '/block/volumes/{0}/expand'
+
+    def create(self, project, label, size, varray, vpool, protocol, sync,
+               number_of_volumes, thin_provisioned, consistencygroup):
+        (tenant, project_name) = _Common.get_parent_child_from_xpath(project)
+        params = {'name': label,
+                  'size': size,
+                  'count': number_of_volumes,
+                  'project': Project(self._ipAddr,
+                                     self._port).project_query(project),
+                  'varray': VirtualArray(self._ipAddr,
+                                         self._port).varray_query(varray),
+                  'vpool': VirtualPool(self._ipAddr,
+                                       self._port).vpool_query(vpool,
+                                                               'block')}
+        if consistencygroup:
+            params['consistency_group'] = ConsistencyGroup(
+                self._ipAddr, self._port).consistencygroup_query(
+                    consistencygroup, project_name, tenant)
+        o = self._send('POST', Volume.URI_VOLUMES, params)
+        if sync:
+            self._wait(o)
+        return o
+
+    def search_volumes(self, project_uri):
+        o = self._get(Volume.URI_SEARCH_VOLUMES.format(project_uri))
+        return [resource['id'] for resource in o.get('resource', [])]
+
+    def volume_query(self, name):
+        """Resolves tenant/project/volume by showing every volume of the
+        project until one has the name, as viprcli does.
+        """
+        (project_path, label) = _Common.get_parent_child_from_xpath(name)
+        project_uri = Project(self._ipAddr,
+                              self._port).project_query(project_path)
+        for uri in self.search_volumes(project_uri):
+            vol = self.show_by_uri(uri)
+            if vol and vol['name'] == label:
+                return vol['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "Volume " + label + ": not found")
+
+    def show(self, name, show_inactive=False, xml=False):
+        return self.show_by_uri(self.volume_query(name), show_inactive, xml)
+
+    def show_by_uri(self, uri, show_inactive=False, xml=False):
+        o = self._get(Volume.URI_VOLUME.format(uri))
+        if not show_inactive and o.get('inactive'):
+            return None
+        return o
+
+    def get_exports_by_uri(self, uri):
+        return self._get(Volume.URI_VOLUME_EXPORTS.format(uri))
+
+    def check_for_sync(self, result, sync):
+        if sync:
+            self._wait(result)
+        return result
+
+    def delete(self, name, volume_name_list=None, sync=False,
+               forceDelete=False):
+        uri = self.volume_query(name)
+        o = self._send('POST', Volume.URI_DEACTIVATE.format(uri))
+        if sync:
+            self._wait(o)
+        return o
+
+
+# ---- viprcli.consistencygroup ----
+
+class ConsistencyGroup(_Base):
+
+    URI_CONSISTENCY_GROUP = '/block/consistency-groups'
+    URI_CONSISTENCY_GROUPS_INSTANCE = '/block/consistency-groups/{0}'
+    URI_CONSISTENCY_GROUP_TAGS = '/block/consistency-groups/{0}/tags'
+    URI_SEARCH_CONSISTENCY_GROUPS_BY_TAG = \
+        '/block/consistency-groups/search?tag={0}'
+
+    def _project_uri(self, project, tenant):
+        return Project(self._ipAddr, self._port).project_query(
+            (tenant or '') + '/' + project)
+
+    def consistencygroup_query(self, name, project, tenant):
+        if name.startswith('urn:'):
+            return name
+        project_uri = self._project_uri(project, tenant)
+        o = self._get('/block/consistency-groups/search?project=' +
+                      project_uri)
+        for resource in o.get('resource', []):
+            cg = self.show(resource['id'], project, tenant)
+            if cg and cg['name'] == name:
+                return cg['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "Consistency Group " + name + ": not found")
+
+    def show(self, name, project, tenant, xml=False):
+        uri = self.consistencygroup_query(name, project, tenant)
+        o = self._get(
+            ConsistencyGroup.URI_CONSISTENCY_GROUPS_INSTANCE.format(uri))
+        if o.get('inactive'):
+            return None
+        return o
+
+    def create(self, name, project, tenant):
+        params = {'name': name,
+                  'project': self._project_uri(project, tenant)}
+        return self._send('POST', ConsistencyGroup.URI_CONSISTENCY_GROUP,
+                          params)
+
+    def delete(self, name, project, tenant):
+        uri = self.consistencygroup_query(name, project, tenant)
+        o = self._send(
+            'POST', ConsistencyGroup.URI_CONSISTENCY_GROUPS_INSTANCE.format(
+                uri) + '/deactivate')
+        self._wait(o)
+        return o
+
+
+# ---- viprcli.snapshot ----
+
+class Snapshot(_Base):
+
+    URI_SNAPSHOT_LIST = '/{0}/{1}/{2}/protection/snapshots'
+    URI_BLOCK_SNAPSHOTS = '/block/snapshots/{0}'
+    URI_BLOCK_SNAPSHOTS_TAG = '/block/snapshots/{0}/tags'
+    URI_SEARCH_SNAPSHOT_BY_TAG = '/block/snapshots/search?tag={0}'
+
+    def snapshot_create(self, otype, typename, ouri, snaplabel, inactive,
+                        rptype, sync):
+        try:
+            self.snapshot_query(otype, typename, ouri, snaplabel)
+        except SOSError as e:
+            if e.err_code != SOSError.NOT_FOUND_ERR:
+                raise
+        else:
+            raise SOSError(SOSError.ENTRY_ALREADY_EXISTS_ERR,
+                           "Snapshot with name " + snaplabel +
+                           " already exists under " + typename)
+        o = self._send('POST',
+                       Snapshot.URI_SNAPSHOT_LIST.format(otype, typename,
+                                                         ouri),
+                       {'name': snaplabel, 'create_inactive': inactive})
+        if sync:
+            self._wait(o)
+        return o
+
+    def snapshot_list_uri(self, otype, otypename, ouri):
+        o = self._get(Snapshot.URI_SNAPSHOT_LIST.format(otype, otypename,
+                                                        ouri))
+        return o.get('snapshot', [])
+
+    def snapshot_show_uri(self, otype, resourceUri, suri, xml=False):
+        return self._get(Snapshot.URI_BLOCK_SNAPSHOTS.format(suri))
+
+    def snapshot_query(self, storageresType, storageresTypename, resuri,
+                       snapshotName):
+        for snapshot in self.snapshot_list_uri(storageresType,
+                                               storageresTypename, resuri):
+            o = self.snapshot_show_uri(storageresType, resuri,
+                                       snapshot['id'])
+            if not o.get('inactive') and o['name'] == snapshotName:
+                return o['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "Snapshot with the name:" + snapshotName +
+                       " Not Found")
+
+    def storageResource_query(self, storageresType, fileshareName,
+                              volumeName, cgName, project, tenant):
+        if volumeName is not None:
+            return Volume(self._ipAddr, self._port).volume_query(
+                tenant + '/' + project + '/' + volumeName)
+        if cgName is not None:
+            return ConsistencyGroup(self._ipAddr,
+                                    self._port).consistencygroup_query(
+                cgName, project, tenant)
+        return None
+
+    def snapshot_delete_uri(self, otype, resourceUri, suri, sync,
+                            synctimeout=0):
+        o = self._send('POST',
+                       Snapshot.URI_BLOCK_SNAPSHOTS.format(suri) +
+                       '/deactivate')
+        if sync:
+            self._wait(o)
+        return o
+
+    def snapshot_delete(self, storageresType, storageresTypename,
+                        resourceUri, name, sync, synctimeout=0):
+        suri = self.snapshot_query(storageresType, storageresTypename,
+                                   resourceUri, name)
+        return self.snapshot_delete_uri(storageresType, resourceUri, suri,
+                                        sync, synctimeout)
+
+
+# ---- viprcli.host, hostinitiators ----
+
+class Host(_Base):
+
+    def list_all(self, tenant):
+        tenant_uri = Project(self._ipAddr, self._port).tenant_query(tenant)
+        return self._get('/tenants/%s/hosts' % tenant_uri).get('host', [])
+
+    def query_by_name(self, name, tenant=None):
+        for host in self.list_all(tenant):
+            if host['name'] == name:
+                return host['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "Host with name: " + name + " not found")
+
+    def search_by_name(self, host_name):
+        o = self._get('/compute/hosts/search?name=' +
+                      urllib.parse.quote(host_name, ''))
+        return o.get('resource', [])
+
+    def create(self, label, type, address, tenant, port=None, username=None,
+               passwd=None, usessl=None, osversion=None, cluster=None,
+               datacenter=None, vcenter=None, autodiscovery=True):
+        tenant_uri = Project(self._ipAddr, self._port).tenant_query(tenant)
+        params = {'type': type,
+                  'name': label,
+                  'host_name': address,
+                  'discoverable': autodiscovery}
+        o = self._send('POST', '/tenants/%s/hosts' % tenant_uri, params)
+        self._wait(o)
+        return o
+
+
+class HostInitiator(_Base):
+
+    def create(self, hostlabel, protocol, initiatorwwn, portwwn):
+        host_uri = Host(self._ipAddr, self._port).query_by_name(hostlabel)
+        params = {'protocol': protocol,
+                  'initiator_node': initiatorwwn,
+                  'initiator_port': portwwn}
+        o = self._send('POST', '/compute/hosts/%s/initiators' % host_uri,
+                       params)
+        self._wait(o)
+        return o
+
+
+# ---- viprcli.exportgroup ----
+
+class ExportGroup(_Base):
+
+    URI_EXPORT_GROUP = '/block/exports'
+    URI_EXPORT_GROUPS_SHOW = '/block/exports/{0}'
+    URI_EXPORT_GROUP_SEARCH = '/block/exports/search?project={0}'
+
+    def _project_uri(self, project, tenant):
+        return Project(self._ipAddr, self._port).project_query(
+            (tenant or '') + '/' + project)
+
+    def exportgroup_list(self, project, tenant):
+        o = self._get(ExportGroup.URI_EXPORT_GROUP_SEARCH.format(
+            self._project_uri(project, tenant)))
+        return [resource['id'] for resource in o.get('resource', [])]
+
+    def exportgroup_query(self, name, project, tenant, varrayuri=None):
+        if name.startswith('urn:'):
+            return name
+        for uri in self.exportgroup_list(project, tenant):
+            group = self.exportgroup_show(uri, project, tenant)
+            if group and group['name'] == name and (
+                    varrayuri is None or
+                    group['varray']['id'] == varrayuri):
+                return group['id']
+        raise SOSError(SOSError.NOT_FOUND_ERR,
+                       "Export Group " + name + ": not found")
+
+    def exportgroup_show(self, name, project, tenant, varray=None,
+                         xml=False):
+        varrayuri = None
+        if varray:
+            varrayuri = VirtualArray(self._ipAddr,
+                                     self._port).varray_query(varray)
+        uri = self.exportgroup_query(name, project, tenant, varrayuri)
+        o = self._get(ExportGroup.URI_EXPORT_GROUPS_SHOW.format(uri))
+        if o.get('inactive'):
+            return None
+        return o
+
+    def exportgroup_create(self, name, project, tenant, varray,
+                           exportgrouptype, export_destination=None):
+        try:
+            self.exportgroup_query(name, project, tenant)
+        except SOSError as e:
+            if e.err_code != SOSError.NOT_FOUND_ERR:
+                raise
+        else:
+            raise SOSError(SOSError.ENTRY_ALREADY_EXISTS_ERR,
+                           "Export group with name " + name +
+                           " already exists")
+        params = {'name': name,
+                  'project': self._project_uri(project, tenant),
+                  'varray': VirtualArray(self._ipAddr,
+                                         self._port).varray_query(varray),
+                  'type': exportgrouptype}
+        if exportgrouptype == 'Host' and export_destination:
+            params['hosts'] = [Host(self._ipAddr, self._port).query_by_name(
+                export_destination, tenant)]
+        o = self._send('POST', ExportGroup.URI_EXPORT_GROUP, params)
+        self._wait(o)
+        return o
+
+    def exportgroup_add_volumes(self, sync, exportgroupname, tenantname,
+                                maxpaths, minpaths, pathsperinitiator,
+                                projectname, volumenames, snapshots=None,
+                                cg=None):
+        uri = self.exportgroup_query(exportgroupname, projectname,
+                                     tenantname)
+        volume = Volume(self._ipAddr, self._port)
+        added = []
+        for entry in volumenames:
+            (name, _sep, lun) = entry.partition(':')
+            added.append({'id': volume.volume_query(
+                tenantname + '/' + projectname + '/' + name),
+                'lun': lun or None})
+        o = self._send('PUT', ExportGroup.URI_EXPORT_GROUPS_SHOW.format(uri),
+                       {'volume_changes': {'add': added}})
+        if sync:
+            self._wait(o)
+        return o
+
+    def exportgroup_remove_volumes_by_uri(self, exportgroup_uri,
+                                          volumeIdList, sync=False,
+                                          tenantname=None, projectname=None,
+                                          snapshots=None, cg=None):
+        if not isinstance(volumeIdList, list):
+            volumeIdList = [volumeIdList]
+        o = self._send('PUT',
+                       ExportGroup.URI_EXPORT_GROUPS_SHOW.format(
+                           exportgroup_uri),
+                       {'volume_changes': {'remove': volumeIdList}})
+        if sync:
+            self._wait(o)
+        return o
+
+
+# ---- viprcli.tag ----
+
+def tag_resource(ipaddr, port, uri, resourceid, add, remove):
+    params = {'add': add or [], 'remove': remove or []}
+    return _request(ipaddr, port, 'PUT', uri.format(resourceid),
+                    _body(params))
+
+
+def list_tags(ipaddr, port, resourceUri):
+    o = _request(ipaddr, port, 'GET', resourceUri)
+    return (o or {}).get('tag', [])
+
+
+_MODULES = {
+    'common': dict((name, getattr(_Common, name)) for name in
+                   ('service_json_request', 'json_decode', 'search_by_tag',
+                    'get_node_value', 'to_bytes', 'format_json_object',
+                    'get_parent_child_from_xpath')),
+    'project': {'Project': Project},
+    'virtualarray': {'VirtualArray': VirtualArray},
+    'virtualpool': {'VirtualPool': VirtualPool},
+    'volume': {'Volume': Volume},
+    'consistencygroup': {'ConsistencyGroup': ConsistencyGroup},
+    'snapshot': {'Snapshot': Snapshot},
+    'host': {'Host': Host},
+    'hostinitiators': {'HostInitiator': HostInitiator},
+    'exportgroup': {'ExportGroup': ExportGroup},
+    'tag': {'tag_resource': tag_resource, 'list_tags': list_tags},
+}
+
+
+def install(model):
+    """Registers the fake viprcli modules, answered by model.
+
+    Must run before the driver is imported.
+    """
+    global _model
+    _model = model
+    package = types.ModuleType('viprcli')
+    package.__path__ = []
+    sys.modules['viprcli'] = package
+    for name, attrs in _MODULES.items():
+        module = types.ModuleType('viprcli.' + name)
+        module.SOSError = SOSError
+        module.COOKIE = None
+        for attr, value in attrs.items():
+            setattr(module, attr, value)
+        sys.modules[module.__name__] = module
+        setattr(package, name, module)
+
+
+class FakeViPRAdapter(requests_adapters.BaseAdapter):
+    """Transport adapter that answers requests from a FakeViPR model."""
+
+    def __init__(self, model):
+        super(FakeViPRAdapter, self).__init__()
+        self.model = model
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        parts = urllib.parse.urlsplit(request.url)
+        uri = parts.path + ('?' + parts.query if parts.query else '')
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        status, headers, text = self.model.handle(request.method, uri, body,
+                                                  request.headers)
+        response = requests.Response()
+        response.status_code = status
+        response.reason = http_client.responses.get(status, '')
+        response.headers = requests_structures.CaseInsensitiveDict(headers)
+        response._content = text.encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def attach(client, model):
+    """Sends the REST calls of a driver's ViPRRestClient to model."""
+    adapter = FakeViPRAdapter(model)
+    client.session.mount('https://', adapter)
+    client.session.mount('http://', adapter)
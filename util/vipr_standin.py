@@ -0,0 +1,286 @@
+# Copyright (c) 2014 EMC Corporation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Local HTTP stand-in for the ViPR REST API, for load and soak testing.
+
+Serves the stateful FakeViPR model (fake_vipr) over HTTPS, so the
+unmodified driver and viprcli can run against it: point vipr_hostname and
+vipr_port, and the viprcli profile, at this process. Latency, error
+rates, token expiry and task durations are set on the command line. The
+same port answers the ScaleIO REST gateway calls of the ScaleIO driver,
+so vipr_scaleio_rest_gateway_ip and _port can point here too.
+Two extra, unauthenticated endpoints serve the test harness:
+
+    GET  /standin/stats   call counts per endpoint, injected faults and
+                          the inventory size, as JSON
+    POST /standin/reset   zeroes the counters
+
+    python util/vipr_standin.py --port 4443 --volumes 20000 --hosts 3000 \\
+        --export-groups 2000 --latency lognormal:0.03,0.6 \\
+        --endpoint-latency "GET /block/volumes/search=lognormal:0.5,0.4" \\
+        --error-rate 0.01 --error-status 503 --error-status 500 \\
+        --token-lifetime 600 --task-duration uniform:2,20
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+import fake_vipr
+
+# the options of add_model_arguments, in the order model_argv renders them
+MODEL_OPTIONS = ('username', 'password', 'tenant', 'project', 'varray',
+                 'vpool', 'volumes', 'hosts', 'export_groups', 'protocol',
+                 'latency', 'endpoint_latency', 'task_duration',
+                 'task_error_rate', 'error_rate', 'error_status',
+                 'token_lifetime', 'seed')
+
+class StandinServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+    # boot storms open many connections at once
+    request_queue_size = 256
+
+    def __init__(self, address, model, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandinHandler)
+        self.model = model
+        self.verbose = verbose
+
+    def handle_error(self, request, client_address):
+        # clients closing kept-alive connections are not worth a traceback
+        if isinstance(sys.exc_info()[1], (socket.error, ssl.SSLError)) and \
+                not self.verbose:
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # keep-alive, like ViPR, so client connection pools are exercised
+    protocol_version = 'HTTP/1.1'
+    server_version = 'ViPR-standin/1.0'
+    # one write per answer; header lines sent one by one each wait for a
+    # delayed ACK on a kept-alive connection
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_PUT(self):
+        self._dispatch()
+
+    def do_DELETE(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else None
+
+        model = self.server.model
+        if self.path == '/standin/stats' and self.command == 'GET':
+            self._reply(200, {'Content-Type': 'application/json'},
+                        json.dumps(model.counters(), sort_keys=True))
+        elif self.path == '/standin/reset' and self.command == 'POST':
+            model.reset_counters()
+            self._reply(200, {}, '')
+        else:
+            self._reply(*model.handle(self.command, self.path, body,
+                                      self.headers))
+
+    def _reply(self, status, headers, text):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+
+def self_signed_certificate(directory):
+    """Creates a throwaway certificate; returns (certfile, keyfile)."""
+    certfile = os.path.join(directory, 'standin.crt')
+    keyfile = os.path.join(directory, 'standin.key')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-days', '30', '-subj', '/CN=vipr-standin',
+         '-keyout', keyfile, '-out', certfile],
+        stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    return certfile, keyfile
+
+
+def enable_tls(server, certfile, keyfile):
+    protocol = getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23)
+    context = ssl.SSLContext(protocol)
+    context.load_cert_chain(certfile, keyfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+
+
+def build_model(args):
+    endpoint_latency = {}
+    for item in args.endpoint_latency or []:
+        (endpoint, _sep, spec) = item.rpartition('=')
+        endpoint_latency[endpoint] = spec
+    model = fake_vipr.FakeViPR(
+        username=args.username, password=args.password,
+        tenant=args.tenant, project=args.project, varray=args.varray,
+        vpools=args.vpool or ['vpool1'], latency=args.latency,
+        endpoint_latency=endpoint_latency,
+        task_duration=args.task_duration, error_rate=args.error_rate,
+        error_statuses=args.error_status or [503],
+        token_lifetime=args.token_lifetime,
+        task_error_rate=args.task_error_rate, seed=args.seed)
+    model.populate(volumes=args.volumes, hosts=args.hosts,
+                   export_groups=args.export_groups,
+                   protocol=args.protocol)
+    return model
+
+
+def add_model_arguments(parser):
+    """Model options, shared with the harnesses that embed a stand-in."""
+    parser.add_argument('--username', default='root')
+    parser.add_argument('--password', default='ChangeMe')
+    parser.add_argument('--tenant', default='Provider Tenant')
+    parser.add_argument('--project', default='openstack')
+    parser.add_argument('--varray', default='varray1')
+    parser.add_argument('--vpool', action='append',
+                        help='virtual pool name; repeat for more '
+                             '(default: vpool1)')
+    parser.add_argument('--volumes', type=int, default=1000,
+                        help='volumes to start with')
+    parser.add_argument('--hosts', type=int, default=200,
+                        help='hosts to start with')
+    parser.add_argument('--export-groups', type=int, default=100,
+                        help='export groups to start with, one host each')
+    parser.add_argument('--protocol', default='FC',
+                        choices=('FC', 'iSCSI', 'ScaleIO'),
+                        help='protocol of the initial hosts\' initiators')
+    parser.add_argument('--latency', default='0',
+                        help='latency of every request: seconds or a '
+                             'distribution such as uniform:0.01,0.05 or '
+                             'lognormal:0.03,0.6')
+    parser.add_argument('--endpoint-latency', action='append',
+                        help='"<METHOD> <URI template>=<distribution>", '
+                             'e.g. "GET /block/volumes/{id}=fixed:0.2"')
+    parser.add_argument('--task-duration', default='0',
+                        help='time until a task completes, as seconds or '
+                             'a distribution')
+    parser.add_argument('--task-error-rate', type=float, default=0.0,
+                        help='share of tasks that fail as busy')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of requests answered with an error')
+    parser.add_argument('--error-status', type=int, action='append',
+                        help='HTTP status of injected errors; repeat for '
+                             'a mix (default: 503)')
+    parser.add_argument('--token-lifetime', type=float, default=0,
+                        help='seconds after which tokens are rejected with '
+                             '401; 0 never expires them')
+    parser.add_argument('--seed', type=int,
+                        help='seed for repeatable latencies and faults')
+
+
+def model_argv(args, **overrides):
+    """Renders the model options in args back into command line arguments.
+
+    Lets a harness that took them with add_model_arguments start a
+    stand-in process with the same model; overrides replace single values.
+    """
+    argv = []
+    for name in MODEL_OPTIONS:
+        value = overrides.get(name, getattr(args, name, None))
+        if value is None:
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            argv += ['--' + name.replace('_', '-'), str(item)]
+    return argv
+
+
+def serve(model, host, port, plain=False, certfile=None, keyfile=None,
+          verbose=False):
+    """Starts a stand-in in a daemon thread; returns the server."""
+    server = StandinServer((host, port), model, verbose)
+    tempdir = None
+    if not plain:
+        if certfile is None:
+            tempdir = tempfile.mkdtemp(prefix='vipr-standin-')
+            (certfile, keyfile) = self_signed_certificate(tempdir)
+        enable_tls(server, certfile, keyfile)
+        if tempdir is not None:
+            shutil.rmtree(tempdir)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the ViPR REST API')
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4443)
+    parser.add_argument('--plain', action='store_true',
+                        help='serve HTTP instead of HTTPS; the driver uses '
+                             'HTTP only on port 8080')
+    parser.add_argument('--certfile', help='TLS certificate; a self-signed '
+                                           'one is made when not given')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request')
+    add_model_arguments(parser)
+    args = parser.parse_args()
+
+    model = build_model(args)
+    server = serve(model, args.bind, args.port, args.plain, args.certfile,
+                   args.keyfile, args.verbose)
+    print('ViPR stand-in on %s://%s:%d with %d volumes, %d hosts and %d '
+          'export groups' % ('http' if args.plain else 'https', args.bind,
+                             args.port, len(model.volumes),
+                             len(model.hosts), len(model.exports)))
+    print('cinder.conf: vipr_hostname=%s vipr_port=%d vipr_username=%s '
+          'vipr_password=%s vipr_tenant="%s" vipr_project=%s '
+          'vipr_varray=%s' % (args.bind, args.port, args.username,
+                              args.password, args.tenant, args.project,
+                              args.varray))
+    sys.stdout.flush()
+    try:
+        while True:
+            threading.Event().wait(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())